@@ -273,18 +273,18 @@ def _setupCache():
     if curConfig['cache']['enabled']:
         # Replace existing backend, this is necessary
         # because they're initially configured with the null backend
-        cacheConfig = {
-            'cache.global.replace_existing_backend': True,
-            'cache.request.replace_existing_backend': True
-        }
-
-        curConfig['cache'].update(cacheConfig)
-
+        curConfig['cache']['cache.global.replace_existing_backend'] = True
         cache.configure_from_config(curConfig['cache'], 'cache.global.')
-        requestCache.configure_from_config(curConfig['cache'], 'cache.request.')
     else:
         # Reset caches back to null cache (in the case of server teardown)
         cache.configure(backend='dogpile.cache.null', replace_existing_backend=True)
+
+    # The per-request cache does not outlive a request, so it is used whenever
+    # it has a backend, even if the global cache is disabled.
+    if curConfig['cache'].get('cache.request.backend'):
+        curConfig['cache']['cache.request.replace_existing_backend'] = True
+        requestCache.configure_from_config(curConfig['cache'], 'cache.request.')
+    else:
         requestCache.configure(backend='dogpile.cache.null', replace_existing_backend=True)
 
     # Although the rateLimitBuffer has no pre-existing backend, this method may be called multiple
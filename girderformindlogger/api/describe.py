@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 import bson.json_util
 import dateutil.parser
+import gzip
+import hashlib
 import inspect
+import json
 import jsonschema
 import os
 import six
+import threading
 import cherrypy
 from collections import OrderedDict
 
@@ -14,12 +18,13 @@ from girderformindlogger.constants import SortDir, VERSION
 from girderformindlogger.exceptions import RestException
 from girderformindlogger.models.setting import Setting
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import config, toBool
+from girderformindlogger.utility import JsonEncoder, config, toBool
 from girderformindlogger.utility.model_importer import ModelImporter
 from girderformindlogger.utility.webroot import WebrootBase
 from girderformindlogger.utility.resource import _apiRouteMap
 from . import docs, access
-from .rest import Resource, getApiUrl, getUrlParts
+from .rest import Resource, acceptsEncoding, etagMatches, getApiUrl, getUrlParts, \
+    setRawResponse, setResponseHeader
 
 if six.PY3:
     from inspect import signature, Parameter
@@ -29,6 +34,20 @@ else:
 SWAGGER_VERSION = '2.0'
 
 
+def loadExtendedJson(value):
+    """
+    Parse a JSON parameter, which may use MongoDB extended JSON (e.g.
+    ``{"$oid": ...}``). The extended JSON hooks are only applied to values
+    which may contain such keys, since they make parsing several times slower.
+
+    :param value: The JSON text.
+    :type value: str
+    """
+    if '"$' in value or '\\u0024' in value:
+        return bson.json_util.loads(value)
+    return json.loads(value)
+
+
 class Description(object):
     """
     This class provides convenient chainable semantics to allow api route
@@ -454,12 +473,23 @@ class ApiDocs(WebrootBase):
 
 
 class Describe(Resource):
+    """
+    Serves the Swagger description of the API. The description is compiled
+    once per version of the route documentation (see ``docs.version``) and per
+    API url, and served pre-serialized and gzip-compressed with an ETag.
+    """
+
+    # Number of compiled descriptions (one per API url) kept at once
+    MAX_COMPILED = 16
+
     def __init__(self):
         super(Describe, self).__init__()
         self.route('GET', (), self.listResources, nodoc=True)
+        self._compiled = {}
+        self._compiledVersion = None
+        self._compiledLock = threading.Lock()
 
-    @access.public
-    def listResources(self, params):
+    def _buildResources(self, host, basePath):
         # Paths Object
         paths = {}
 
@@ -504,11 +534,6 @@ class Describe(Resource):
 
                 paths[route] = pathItem
 
-        apiUrl = getApiUrl(preferReferer=True)
-        urlParts = getUrlParts(apiUrl)
-        host = urlParts.netloc
-        basePath = urlParts.path
-
         return {
             'swagger': SWAGGER_VERSION,
             'info': {
@@ -522,6 +547,58 @@ class Describe(Resource):
             'definitions': definitions
         }
 
+    def _compile(self, host, basePath):
+        """
+        Get the compiled description for an API url.
+
+        :returns: A tuple of the description, its ETag, its JSON serialization
+            and the gzip-compressed serialization.
+        """
+        with self._compiledLock:
+            if self._compiledVersion != docs.version or len(self._compiled) >= self.MAX_COMPILED:
+                self._compiled = {}
+                self._compiledVersion = docs.version
+
+            key = (host, basePath)
+            if key not in self._compiled:
+                resources = self._buildResources(host, basePath)
+                body = json.dumps(
+                    resources, sort_keys=True, allow_nan=False, cls=JsonEncoder
+                ).encode('utf8')
+                etag = '"%d-%s"' % (docs.version, hashlib.sha1(body).hexdigest())
+                self._compiled[key] = (resources, etag, body, gzip.compress(body))
+            return self._compiled[key]
+
+    @access.public
+    def listResources(self, params):
+        apiUrl = getApiUrl(preferReferer=True)
+        urlParts = getUrlParts(apiUrl)
+        resources, etag, body, gzipped = self._compile(urlParts.netloc, urlParts.path)
+
+        # Browsers get the pretty-printed html rendering
+        for accept in cherrypy.request.headers.elements('Accept'):
+            if accept.value == 'application/json':
+                break
+            elif accept.value == 'text/html':
+                return resources
+
+        setRawResponse()
+        setResponseHeader('ETag', etag)
+        setResponseHeader('Cache-Control', 'no-cache')
+        setResponseHeader('Vary', 'Accept, Accept-Encoding')
+        cherrypy.response.headers.pop('Pragma', None)
+        cherrypy.response.headers.pop('Expires', None)
+
+        if etagMatches(etag):
+            cherrypy.response.status = 304
+            return b''
+
+        setResponseHeader('Content-Type', 'application/json')
+        if acceptsEncoding('gzip'):
+            setResponseHeader('Content-Encoding', 'gzip')
+            return gzipped
+        return body
+
 
 class describeRoute(object):  # noqa: class name
     def __init__(self, description):
@@ -622,6 +699,12 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
 
     def __call__(self, fun):
         self._inspectFunSignature(fun)
+        self._validators = {}
+        binders = [
+            self._compileParam(descParam) for descParam in self.description.params
+            # We need either a type or a schema ( for message body )
+            if 'type' in descParam or 'schema' in descParam
+        ]
 
         @six.wraps(fun)
         def wrapped(*args, **kwargs):
@@ -635,48 +718,8 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
 
             kwargs['params'] = kwargs.get('params', {})
 
-            for descParam in self.description.params:
-                # We need either a type or a schema ( for message body )
-                if 'type' not in descParam and 'schema' not in descParam:
-                    continue
-
-                name = descParam['name']
-                model = self._getModel(name, self.description.modelParams)
-                if name in params:
-                    if name in self.description.jsonParams:
-                        info = self.description.jsonParams[name]
-                        val = self._loadJson(name, info, params[name])
-                        self._passArg(fun, kwargs, name, val)
-                    elif name in self.description.modelParams:
-                        info = self.description.modelParams[name]
-                        kwargs.pop(name, None)  # Remove from path params
-                        val = self._loadModel(name, info, params[name], model)
-                        self._passArg(fun, kwargs, self._destName(info, model), val)
-                    else:
-                        val = self._validateParam(name, descParam, params[name])
-                        self._passArg(fun, kwargs, name, val)
-                elif descParam['in'] == 'body':
-                    if name in self.description.jsonParams:
-                        info = self.description.jsonParams[name].copy()
-                        info['required'] = descParam['required']
-                        val = self._loadJsonBody(name, info)
-                        self._passArg(fun, kwargs, name, val)
-                    else:
-                        self._passArg(fun, kwargs, name, cherrypy.request.body)
-                elif descParam['in'] == 'header':
-                    continue  # For now, do nothing with header params
-                elif 'default' in descParam:
-                    self._passArg(fun, kwargs, name, descParam['default'])
-                elif descParam['required']:
-                    raise RestException('Parameter "%s" is required.' % name)
-                else:
-                    # If required=False but no default is specified, use None
-                    if name in self.description.modelParams:
-                        info = self.description.modelParams[name]
-                        kwargs.pop(name, None)  # Remove from path params
-                        self._passArg(fun, kwargs, info['destName'] or model.name, None)
-                    else:
-                        self._passArg(fun, kwargs, name, None)
+            for bind in binders:
+                bind(params, kwargs)
 
             self._mungeKwargs(kwargs, fun)
 
@@ -688,13 +731,89 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
             wrapped.description = self.description
         return wrapped
 
+    def _compileParam(self, descParam):
+        """
+        Build the function binding one parameter of a request to the arguments
+        of the route handler. This is done once per route, so that requests only
+        pay for the branches that apply to each parameter.
+
+        :param descParam: The formal parameter in the Description.
+        :type descParam: dict
+        :returns: A function taking the request params and the handler kwargs.
+        """
+        name = descParam['name']
+        passArg = self._passArg
+        jsonInfo = self.description.jsonParams.get(name)
+        modelInfo = self.description.modelParams.get(name)
+
+        if jsonInfo is not None:
+            if jsonInfo.get('schema') is not None:
+                self._validators[name] = self._compileSchema(jsonInfo['schema'])
+
+            def bindPassed(value, kwargs):
+                passArg(None, kwargs, name, self._loadJson(name, jsonInfo, value))
+        elif modelInfo is not None:
+            getModel = self._modelGetter(modelInfo)
+
+            def bindPassed(value, kwargs):
+                model = getModel()
+                kwargs.pop(name, None)  # Remove from path params
+                val = self._loadModel(name, modelInfo, value, model)
+                passArg(None, kwargs, self._destName(modelInfo, model), val)
+        else:
+            def bindPassed(value, kwargs):
+                passArg(None, kwargs, name, self._validateParam(name, descParam, value))
+
+        if descParam['in'] == 'body':
+            if jsonInfo is not None:
+                bodyInfo = dict(jsonInfo, required=descParam['required'])
+
+                def bindMissing(kwargs):
+                    passArg(None, kwargs, name, self._loadJsonBody(name, bodyInfo))
+            else:
+                def bindMissing(kwargs):
+                    passArg(None, kwargs, name, cherrypy.request.body)
+        elif descParam['in'] == 'header':
+            def bindMissing(kwargs):
+                pass  # For now, do nothing with header params
+        elif 'default' in descParam:
+            default = descParam['default']
+
+            def bindMissing(kwargs):
+                passArg(None, kwargs, name, default)
+        elif descParam['required']:
+            def bindMissing(kwargs):
+                raise RestException('Parameter "%s" is required.' % name)
+        elif modelInfo is not None:
+            # If required=False but no default is specified, use None
+            def bindMissing(kwargs):
+                kwargs.pop(name, None)  # Remove from path params
+                passArg(None, kwargs, modelInfo['destName'] or getModel().name, None)
+        else:
+            def bindMissing(kwargs):
+                passArg(None, kwargs, name, None)
+
+        def bind(params, kwargs):
+            if name in params:
+                bindPassed(params[name], kwargs)
+            else:
+                bindMissing(kwargs)
+
+        return bind
+
+    @staticmethod
+    def _compileSchema(schema):
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        return cls(schema)
+
     def _validateJsonType(self, name, info, val):
         if info.get('schema') is not None:
-            try:
-                jsonschema.validate(val, info['schema'])
-            except jsonschema.ValidationError as e:
+            validator = self._validators.get(name) or self._compileSchema(info['schema'])
+            error = jsonschema.exceptions.best_match(validator.iter_errors(val))
+            if error is not None:
                 raise RestException('Invalid JSON object for parameter %s: %s' % (
-                    name, str(e)))
+                    name, str(error)))
         elif info['requireObject'] and not isinstance(val, dict):
             raise RestException('Parameter %s must be a JSON object.' % name)
         elif info['requireArray'] and not isinstance(val, list):
@@ -712,7 +831,7 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
 
     def _loadJson(self, name, info, value):
         try:
-            val = bson.json_util.loads(value)
+            val = loadExtendedJson(value)
         except ValueError:
             raise RestException('Parameter %s must be valid JSON.' % name)
 
@@ -720,15 +839,23 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
 
         return val
 
-    def _getModel(self, name, modelParams):
-        if name not in self.description.modelParams:
-            return
-        info = self.description.modelParams[name]
+    def _modelGetter(self, info):
+        """
+        Get a function returning the model of a model param. Models are
+        singletons, so the model is looked up on first use only (plugin models
+        may be registered after the route).
+        """
+        models = []
+
+        def getModel():
+            if not models:
+                if info['isModelClass']:
+                    models.append(info['model']())
+                else:
+                    models.append(ModelImporter.model(info['model'], info['plugin']))
+            return models[0]
 
-        if info['isModelClass']:
-            return info['model']()
-        else:
-            return ModelImporter.model(info['model'], info['plugin'])
+        return getModel
 
     def _loadModel(self, name, info, id, model):
         if info['force']:
@@ -9,6 +9,14 @@ models = collections.defaultdict(dict)
 # e.g. routes[resource][path][method]
 routes = collections.defaultdict(
     functools.partial(collections.defaultdict, dict))
+# Incremented whenever routes or models are added or removed, so that the
+# compiled API description can be reused until then.
+version = 0
+
+
+def _changed():
+    global version
+    version += 1
 
 
 def _toRoutePath(resource, route):
@@ -71,6 +79,7 @@ def addRouteDocs(resource, route, method, info, handler):
     # Add the operation to the given route
     if method not in routes[resource][path]:
         routes[resource][path][method] = operation
+        _changed()
 
 
 def removeRouteDocs(resource, route, method, info, handler):
@@ -98,6 +107,7 @@ def removeRouteDocs(resource, route, method, info, handler):
 
     if method in routes[resource][path]:
         del routes[resource][path][method]
+        _changed()
         # Clean up any empty route paths
         if not routes[resource][path]:
             del routes[resource][path]
@@ -138,9 +148,11 @@ def addModel(name, model, resources=None, silent=False):
             resources = (resources,)
         for resource in resources:
             models[resource][name] = model
+        _changed()
     else:
         if not silent:
             logprint.warning(
                 'WARNING: adding swagger models without specifying resources '
                 'to bind to is discouraged (%s).' % name)
         models[None][name] = model
+        _changed()
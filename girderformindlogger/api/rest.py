@@ -3,6 +3,7 @@ import cgi
 import cherrypy
 import collections
 import datetime
+import hashlib
 import inspect
 import json
 import posixpath
@@ -13,6 +14,7 @@ import traceback
 import types
 import unicodedata
 import uuid
+import zlib
 
 from sentry_sdk import capture_exception
 from dogpile.cache.util import kwarg_function_key_generator
@@ -33,11 +35,20 @@ from girderformindlogger.utility._cache import requestCache
 from girderformindlogger.utility.model_importer import ModelImporter
 from six.moves import range, urllib
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Arbitrary buffer length for stream-reading request bodies
 READ_BUFFER_LEN = 65536
 
 _MONGO_CURSOR_TYPES = (MongoProxy, pymongo.cursor.Cursor, pymongo.command_cursor.CommandCursor)
 
+# Content types which are worth compressing
+_COMPRESSIBLE_TYPES = ('application/json', 'application/ld+json', 'application/javascript',
+                       'application/xml', 'text/csv', 'text/html', 'text/plain')
+
 
 def getUrlParts(url=None):
     """
@@ -484,6 +495,21 @@ def setRawResponse(val=True):
     cherrypy.request.girderRawResponse = val
 
 
+def acceptsEncoding(encoding):
+    """
+    Whether the client of the current request accepts a content coding (e.g.
+    "gzip"), according to its Accept-Encoding header.
+
+    :param encoding: The content coding.
+    :type encoding: str
+    """
+    qvalues = {
+        element.value.lower(): element.qvalue
+        for element in cherrypy.request.headers.elements('Accept-Encoding')
+    }
+    return qvalues.get(encoding, qvalues.get('*', 0)) > 0
+
+
 def setResponseHeader(header, value):
     """
     Set a response header to the given value.
@@ -594,6 +620,156 @@ def _handleValidationException(e):
     return val
 
 
+def etagResponse(fun):
+    """
+    Decorate GET route handlers with this to send a strong ETag, computed from
+    the serialized response, and to answer requests whose If-None-Match header
+    matches it with 304 Not Modified and no body.
+    """
+    @six.wraps(fun)
+    def wrapped(*args, **kwargs):
+        cherrypy.request.girderETag = True
+        return fun(*args, **kwargs)
+    return wrapped
+
+
+def _compressionSettings():
+    conf = config.getConfig().get('server', {})
+    if not conf.get('compression', True):
+        return None
+    return int(conf.get('compression_min_size', 1024)), int(conf.get('compression_level', 6))
+
+
+def _compressible():
+    """
+    Whether the response of the current request may be compressed, and with
+    which content coding. Sets the Vary header of compressible responses.
+    """
+    headers = cherrypy.response.headers
+    contentType = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    if (contentType not in _COMPRESSIBLE_TYPES or 'Content-Encoding' in headers
+            or 'Content-Range' in headers):
+        return None
+
+    vary = headers.get('Vary')
+    if not vary:
+        setResponseHeader('Vary', 'Accept-Encoding')
+    elif 'accept-encoding' not in vary.lower():
+        setResponseHeader('Vary', vary + ', Accept-Encoding')
+
+    if brotli is not None and acceptsEncoding('br'):
+        return 'br'
+    if acceptsEncoding('gzip'):
+        return 'gzip'
+    return None
+
+
+def _suffixETag(encoding):
+    # A compressed representation gets the ETag of the uncompressed one,
+    # suffixed with its content coding (see `etagMatches`).
+    tag = cherrypy.response.headers.get('ETag')
+    if tag and tag.endswith('"'):
+        setResponseHeader('ETag', '%s-%s"' % (tag[:-1], encoding))
+
+
+def etagMatches(tag):
+    """
+    Whether the If-None-Match header of the current request matches an ETag,
+    in which case the client's copy is current. ETags of compressed responses
+    match the ETag they were derived from.
+
+    :param tag: The (quoted) ETag of the uncompressed response.
+    :type tag: str
+    """
+    header = cherrypy.request.headers.get('If-None-Match')
+    if not header:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        for suffix in ('-gzip"', '-br"'):
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)] + '"'
+        if candidate in (tag, '*'):
+            return True
+    return False
+
+
+def _compressResponse(resp):
+    settings = _compressionSettings()
+    if settings is None or not isinstance(resp, bytes) or len(resp) < settings[0]:
+        return resp
+    encoding = _compressible()
+    if encoding is None:
+        return resp
+
+    setResponseHeader('Content-Encoding', encoding)
+    _suffixETag(encoding)
+    if encoding == 'br':
+        return brotli.compress(resp, quality=min(settings[1], 11))
+    # wbits 31 writes a gzip header and trailer
+    compressor = zlib.compressobj(settings[1], zlib.DEFLATED, 31)
+    return compressor.compress(resp) + compressor.flush()
+
+
+def _compressStream(chunks):
+    """
+    Compress a streamed response as it is generated, if it is compressible.
+    """
+    settings = _compressionSettings()
+    if settings is None or 'Content-Length' in cherrypy.response.headers:
+        return chunks
+    encoding = _compressible()
+    if encoding is None:
+        return chunks
+
+    setResponseHeader('Content-Encoding', encoding)
+    _suffixETag(encoding)
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(settings[1], 11))
+        compress, flush = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(settings[1], zlib.DEFLATED, 31)
+        compress, flush = compressor.compress, compressor.flush
+
+    def generate():
+        for chunk in chunks:
+            if isinstance(chunk, six.text_type):
+                chunk = chunk.encode('utf8')
+            data = compress(chunk)
+            if data:
+                yield data
+        yield flush()
+
+    return generate()
+
+
+def _conditionalResponse(resp):
+    """
+    Set the ETag of a response to a GET request of an `etagResponse` route. Returns
+    True if the client's copy is current, in which case the status is set to
+    304 and no body should be sent.
+    """
+    if (not getattr(cherrypy.request, 'girderETag', False) or not isinstance(resp, bytes)
+            or cherrypy.request.method not in ('GET', 'HEAD')
+            or not str(cherrypy.response.status or 200).startswith('200')):
+        return False
+
+    tag = '"%s"' % hashlib.sha1(resp).hexdigest()
+    setResponseHeader('ETag', tag)
+    # let clients store the response, as long as they revalidate it
+    setResponseHeader('Cache-Control', 'private, no-cache')
+    cherrypy.response.headers.pop('Pragma', None)
+    cherrypy.response.headers.pop('Expires', None)
+
+    if not etagMatches(tag):
+        return False
+
+    cherrypy.response.status = 304
+    return True
+
+
 def disableAuditLog(fun):
     """
     If calls to a REST route should not be logged in the audit log, decorate it with this function.
@@ -676,7 +852,7 @@ def endpoint(fun):
                 # function for a streaming response.
                 cherrypy.response.stream = True
                 _logRestRequest(self, path, params)
-                return val()
+                return _compressStream(val())
 
             if isinstance(val, cherrypy.lib.file_generator):
                 # Don't do any post-processing of static files
@@ -719,6 +895,7 @@ def endpoint(fun):
                 val['trace'] = traceback.extract_tb(tb)
 
         resp = _createResponse(val)
+        resp = b'' if _conditionalResponse(resp) else _compressResponse(resp)
         _logRestRequest(self, path, params)
 
         return resp
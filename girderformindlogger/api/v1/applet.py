@@ -33,7 +33,7 @@ import pytz
 from girderformindlogger.api import access
 from girderformindlogger.constants import AccessType, TokenScope, \
     DEFINED_INFORMANTS, SPECIAL_SUBJECTS, USER_ROLES, MAX_PULL_SIZE
-from girderformindlogger.exceptions import AccessException, ValidationException
+from girderformindlogger.exceptions import AccessException, RestException, ValidationException
 from girderformindlogger.i18n import t
 from girderformindlogger.models.account_profile import AccountProfile
 from girderformindlogger.models.activity import Activity as ActivityModel
@@ -53,7 +53,7 @@ from girderformindlogger.models.user import User as UserModel
 from girderformindlogger.utility import jsonld_expander, mail_utils
 from girderformindlogger.utility.validate import validator, email_validator, symbol_validator
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource
+from ..rest import Resource, etagResponse
 from girderformindlogger.utility.redis import cache
 
 USER_ROLE_KEYS = USER_ROLES.keys()
@@ -66,6 +66,7 @@ class Applet(Resource):
         self.resourceName = 'applet'
         self._model = AppletModel()
         self.route('GET', (':id',), self.getApplet)
+        self.route('GET', ('content', ':hash'), self.getAppletContent)
         self.route('GET', ('check_state', ':request_id',), self.check_state)
         self.route('GET', (':id', 'data'), self.getAppletData)
         self.route('GET', (':id', 'groups'), self.getAppletGroups)
@@ -80,6 +81,7 @@ class Applet(Resource):
         self.route('PUT', (':id', 'refresh'), self.refresh)
         self.route('POST', (':id', 'invite'), self.invite)
         self.route('POST', (':id', 'inviteUser'), self.inviteUser)
+        self.route('POST', (':id', 'inviteUsers'), self.inviteUsers)
         self.route('POST', (':id', 'publicLink'), self.createPublicLink)
         self.route('GET', (':id', 'publicLink'), self.getPublicLink)
         self.route('GET', ('public', ':publicId', 'data'), self.getAppletFromPublicLink)
@@ -705,14 +707,15 @@ class Applet(Resource):
 
         if deleteResponse:
             from girderformindlogger.models.response_folder import ResponseItem
+            from girderformindlogger.models.response_statistics import ResponseStatistics
 
-            ResponseItem().removeWithQuery(
-                query={
-                    "baseParentType": 'user',
-                    "baseParentId": profile['userId'],
-                    "meta.applet.@id": applet['_id']
-                }
-            )
+            query = {
+                "baseParentType": 'user',
+                "baseParentId": profile['userId'],
+                "meta.applet.@id": applet['_id']
+            }
+            ResponseStatistics().removeResponses(query)
+            ResponseItem().removeWithQuery(query=query)
 
         return ({
             'message': 'successfully removed user from applet'
@@ -1665,6 +1668,7 @@ class Applet(Resource):
             return dict()
         return json.loads(value)
 
+    @etagResponse
     @access.user(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
         Description('Get an applet by ID.')
@@ -2086,6 +2090,197 @@ class Applet(Resource):
 
         return 'sent invitation mail to {}'.format(email)
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Invite many users to roles in an applet.')
+        .notes(
+            'coordinator/manager can use this endpoint to invite a list of users at once. <br>'
+            'the list is given either as json (`invitations`) or as csv text (`csv`) with a header row. <br>'
+            'each row has email, firstName, lastName and optionally nickName, MRN, role (defaults to user) and lang. <br>'
+            'the result is streamed as one json object per line with the row number, email and either the invitation id or an error.'
+        )
+        .modelParam(
+            'id',
+            model=AppletModel,
+            level=AccessType.READ,
+            destName='applet'
+        )
+        .jsonParam(
+            'invitations',
+            'list of invitations, each an object with the fields of a csv row.',
+            paramType='form',
+            required=False,
+            default=None
+        )
+        .param(
+            'csv',
+            'csv text with the invitations.',
+            paramType='form',
+            required=False,
+            default=None
+        )
+        .param(
+            'lang',
+            'Default language of mail template and web link',
+            default='en',
+            required=False
+        )
+        .errorResponse('Write access was denied for this applet.', 403)
+    )
+    def inviteUsers(self, applet, invitations=None, csv=None, lang='en'):
+        self.shield("inviteUser")
+        import csv as csvlib
+        import io
+        from ..rest import setRawResponse, setResponseHeader
+
+        thisUser = self.getCurrentUser()
+        appletProfile = ProfileModel().findOne({'appletId': applet['_id'], 'userId': thisUser['_id']})
+        inviterRoles = appletProfile.get('roles', []) if appletProfile else []
+        if 'coordinator' not in inviterRoles and 'manager' not in inviterRoles:
+            raise AccessException('You don\'t have enough permission to invite other user to specified role')
+
+        if csv:
+            invitations = list(csvlib.DictReader(io.StringIO(csv.strip())))
+        if not isinstance(invitations, list) or not invitations:
+            raise ValidationException('invitations or csv is required', 'invitations')
+
+        rows = []
+        for invitation in invitations:
+            row = {
+                key: str(invitation.get(key) or '').strip()
+                for key in ('email', 'firstName', 'lastName', 'nickName', 'MRN', 'role', 'lang')
+            }
+            row['email'] = row['email'].lower()
+            row['role'] = row['role'] or 'user'
+            row['lang'] = row['lang'] or lang
+            row['users'] = invitation.get('users') or []
+            rows.append(row)
+
+        # validate every row, with one query per check for the whole list
+        errors = {}
+        seenEmails, seenMRNs = set(), set()
+        for i, row in enumerate(rows):
+            # the same rules as the fields of inviteUser
+            symbolErrors = []
+            for key in ('firstName', 'lastName', 'nickName', 'MRN'):
+                symbol_validator(key, row[key], lambda field, message: symbolErrors.append(message))
+
+            if not mail_utils.validateEmailAddress(row['email']):
+                errors[i] = 'invalid email'
+            elif not row['firstName'] or not row['lastName']:
+                errors[i] = 'firstName and lastName are required'
+            elif symbolErrors:
+                errors[i] = symbolErrors[0]
+            elif row['role'] not in USER_ROLE_KEYS:
+                errors[i] = 'Invalid role.'
+            elif row['lang'] not in ('en', 'fr'):
+                errors[i] = 'Invalid lang parameter.'
+            elif row['role'] not in ('user', 'reviewer') and 'manager' not in inviterRoles:
+                errors[i] = 'You don\'t have enough permission to invite other user to specified role'
+            elif row['email'] in seenEmails:
+                errors[i] = 'duplicated email'
+            elif row['role'] == 'user' and row['MRN'] in seenMRNs:
+                errors[i] = t('mrn_is_duplicated', row['lang'])
+            seenEmails.add(row['email'])
+            if row['role'] == 'user':
+                seenMRNs.add(row['MRN'])
+
+        userMRNs = list({
+            row['MRN'] for i, row in enumerate(rows) if row['role'] == 'user' and i not in errors
+        })
+        duplicatedMRNs = {
+            invitation['MRN'] for invitation in InvitationModel().collection.find({
+                'appletId': applet['_id'],
+                'MRN': {'$in': userMRNs}
+            }, {'MRN': 1})
+        } | {
+            profile['MRN'] for profile in ProfileModel().collection.find({
+                'accountId': thisUser['accountId'],
+                'appletId': applet['_id'],
+                'roles': 'user',
+                'MRN': {'$in': userMRNs}
+            }, {'MRN': 1})
+        }
+        for i, row in enumerate(rows):
+            if i not in errors and row['role'] == 'user' and row['MRN'] in duplicatedMRNs:
+                errors[i] = t('mrn_is_duplicated', row['lang'])
+
+        emails = {rows[i]['email']: UserModel().hash(rows[i]['email']) for i in range(len(rows)) if i not in errors}
+        hashes = {encrypted: email for email, encrypted in emails.items()}
+        invitedUsers = {}
+        for user in UserModel().find({
+            '$or': [
+                {'email': {'$in': list(hashes.keys())}, 'email_encrypted': True},
+                {'email': {'$in': list(emails.keys())}, 'email_encrypted': {'$ne': True}}
+            ]
+        }, fields=['_id', 'email', 'email_encrypted']):
+            invitedUsers[hashes.get(user['email'], user['email'])] = user
+
+        # the template context shared by every invitation
+        web_url = os.getenv('WEB_URI') or 'localhost:8081'
+        appletName = applet['meta']['applet'].get('displayName', applet.get('displayName', 'applet'))
+        context = {
+            'coordinatorName': thisUser['firstName'],
+            'appletName': appletName,
+            'managers': mail_utils.htmlUserList(
+                AppletModel().listUsers(applet, 'manager', force=True)),
+            'coordinators': mail_utils.htmlUserList(
+                AppletModel().listUsers(applet, 'coordinator', force=True)),
+            'reviewers': mail_utils.htmlUserList(
+                AppletModel().listUsers(applet, 'reviewer', force=True))
+        }
+
+        def result(i, **kwargs):
+            return (json.dumps(dict(row=i + 1, email=rows[i]['email'], **kwargs)) + '\n').encode('utf8')
+
+        def stream():
+            batchSize = 500
+            for start in range(0, len(rows), batchSize):
+                batch = range(start, min(start + batchSize, len(rows)))
+                for i in batch:
+                    if i in errors:
+                        yield result(i, error=errors[i])
+
+                batch = [i for i in batch if i not in errors]
+                created = InvitationModel().createInvitationsForSpecifiedUsers(applet, thisUser, [{
+                    'role': rows[i]['role'],
+                    'user': invitedUsers.get(rows[i]['email']),
+                    'firstName': rows[i]['firstName'],
+                    'lastName': rows[i]['lastName'],
+                    'nickName': rows[i]['nickName'],
+                    'lang': rows[i]['lang'],
+                    'MRN': rows[i]['MRN'],
+                    'userEmail': emails[rows[i]['email']],
+                    'accessibleUsers': rows[i]['users']
+                } for i in batch])
+
+                for i, invitation in zip(batch, created):
+                    row = rows[i]
+                    url = f'https://{web_url}/invitation/{str(invitation["_id"])}?lang={row["lang"]}'
+                    try:
+                        html = mail_utils.renderTemplate(f'userInvite.{row["lang"]}.mako', dict(
+                            context,
+                            url=url,
+                            userName=row['firstName'] + " " + row['lastName'],
+                            MRN=row['MRN'],
+                            role=row['role'],
+                            newUser=bool(invitedUsers.get(row['email']))
+                        ))
+                        mail_utils.sendMail(
+                            appletName + ' ' + t('invite_email_subject', row['lang']),
+                            html,
+                            [row['email']]
+                        )
+                    except Exception as e:
+                        yield result(i, invitationId=str(invitation['_id']), error=str(e))
+                        continue
+
+                    yield result(i, invitationId=str(invitation['_id']))
+
+        setRawResponse()
+        setResponseHeader('Content-Type', 'application/x-ndjson')
+        return stream
+
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
@@ -2523,50 +2718,69 @@ class Applet(Resource):
             )
 
         events = schedule.get('events', [])
-        assigned = {}
 
         for event in events:
             if 'id' in event:
                 event['id'] = ObjectId(event['id'])
-                assigned[event['id']] = True
             if 'schedule' in event:
                 if 'start' in event['schedule']:
                     event.get('schedule')['start'] = _convert_to_utc(event['schedule']['start'], tz)
                 if 'end' in event['schedule']:
                     event.get('schedule')['end'] = _convert_to_utc(event['schedule']['end'], tz)
 
-        if rewrite:
-            original = EventsModel().getSchedule(applet['_id'])
-
-            if 'events' in original:
-                for event in original['events']:
-                    original_id = event.get('id')
-                    if original_id not in assigned:
-                        EventsModel().deleteEvent(ObjectId(original_id))
-        else:
-            if isinstance(deleted, list):
-                for event_id in deleted:
-                    EventsModel().deleteEvent(ObjectId(event_id))
-
-        if 'events' in schedule:
-            # insert and update events/notifications
-            events = list(schedule['events'])
-            previous_device_ids = EventsModel().get_applet_device_ids(applet['_id'])
-            for event in schedule['events']:
-                savedEvent = EventsModel().upsertEvent(event, applet, event.get('id', None))
-                event['id'] = savedEvent['_id']
-            if events:
-                EventsModel().notify_user_about_event_changes(schedule['events'], applet)
-            else:
-                EventsModel().notify_user_about_event_changes(
-                    schedule['events'],
-                    applet,
-                    previous_device_ids
-                )
+        changed = EventsModel().replaceSchedule(
+            applet,
+            schedule.get('events', []),
+            deleted if isinstance(deleted, list) else None,
+            rewrite
+        )
+        if changed:
+            EventsModel().notify_user_about_event_changes(changed, applet)
 
         return schedule if rewrite else EventsModel().getSchedule(applet['_id'])
 
 
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get a bundle of formatted applet content by its hash.')
+        .notes(
+            'The hashes are listed in the content field of the applets returned '
+            'by GET /user/applets with manifest=true. <br>'
+            'Bundles never change, so they are served with a strong ETag and '
+            'can be cached forever by the client. Only users with a role on an '
+            'applet of the bundle can read it.'
+        )
+        .param('hash', 'The sha256 hash of the bundle.', paramType='path')
+        .errorResponse('Content not found.', 404)
+        .errorResponse('Read access was denied for the applet.', 403)
+    )
+    def getAppletContent(self, hash):
+        from girderformindlogger.models.applet_content import AppletContent
+        from ..rest import etagMatches, setRawResponse, setResponseHeader
+
+        etag = '"%s"' % hash
+        notModified = etagMatches(etag)
+
+        content = AppletContent().findOne(
+            {'_id': hash}, fields=['applets'] if notModified else ['applets', 'data'])
+        if not content:
+            raise RestException('Content not found.', code=404)
+        if not AppletContent().canRead(content, self.getCurrentUser()):
+            raise AccessException('You do not have access to this content.')
+
+        setRawResponse()
+        setResponseHeader('ETag', etag)
+        setResponseHeader('Cache-Control', 'private, max-age=31536000, immutable')
+        cherrypy.response.headers.pop('Pragma', None)
+        cherrypy.response.headers.pop('Expires', None)
+
+        if notModified:
+            cherrypy.response.status = 304
+            return b''
+
+        setResponseHeader('Content-Type', 'application/json')
+        return bytes(content['data'])
+
     # @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
         Description('Set or update the id of the theme to style the applet with')
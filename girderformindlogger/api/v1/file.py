@@ -4,7 +4,7 @@ import errno
 import six
 
 from ..describe import Description, autoDescribeRoute, describeRoute
-from ..rest import Resource, filtermodel
+from ..rest import Resource, filtermodel, setResponseHeader
 from ...constants import AccessType, TokenScope
 from girderformindlogger.exceptions import AccessException, GirderException, RestException
 from girderformindlogger.models.assetstore import Assetstore
@@ -269,6 +269,11 @@ class File(Resource):
         rangeHeader = cherrypy.lib.httputil.get_ranges(
             cherrypy.request.headers.get('Range'), file.get('size', 0))
 
+        # get_ranges returns an empty list for an unsatisfiable range
+        if rangeHeader is not None and not len(rangeHeader):
+            setResponseHeader('Content-Range', 'bytes */%d' % file.get('size', 0))
+            raise RestException('Requested range not satisfiable.', code=416)
+
         # The HTTP Range header takes precedence over query params
         if rangeHeader and len(rangeHeader):
             # Currently we only support a single range.
@@ -4,6 +4,7 @@ import random
 import cherrypy
 import json
 import bson
+import six
 import time
 
 from pyfcm import FCMNotification
@@ -21,7 +22,8 @@ from girderformindlogger.models.pushNotification import PushNotification as Push
     ProgressState
 from girderformindlogger.models.setting import Setting
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import JsonEncoder
+from girderformindlogger.utility import JsonEncoder, config, parseTimestamp
+from girderformindlogger.utility.notification_broker import RESYNC, getBroker, recipientKey
 from girderformindlogger.api import access
 from girderformindlogger.exceptions import ValidationException
 
@@ -32,10 +34,12 @@ from rq_scheduler import Scheduler
 from girderformindlogger.models.notification_log import NotificationLog
 
 DEFAULT_STREAM_TIMEOUT = 300
-# When new events are seen, we will poll at the minimum interval
-MIN_POLL_INTERVAL = 0.5
-# The interval increases when no new events are seen, capping at this value
-MAX_POLL_INTERVAL = 2
+# Idle streams send a comment every this many seconds to keep the connection open
+HEARTBEAT_INTERVAL = 15
+# Streams opened beyond this number (per process, see max_streams in the
+# [notification] config section) are refused, so that they cannot take every
+# thread of the server
+DEFAULT_MAX_STREAMS = 50
 
 
 def sseMessage(event):
@@ -69,12 +73,13 @@ class Notification(Resource):
     @access.token(cookie=True)
     @autoDescribeRoute(
         Description('Stream notifications for a given user via the SSE protocol.')
-            .notes('This uses long-polling to keep the connection open for '
-                   'several minutes at a time (or longer) and should be requested '
-                   'with an EventSource object or other SSE-capable client. '
-                   '<p>Notifications are returned within a few seconds of when '
-                   'they occur.  When no notification occurs for the timeout '
-                   'duration, the stream is closed. '
+            .notes('This keeps the connection open for several minutes at a '
+                   'time (or longer) and should be requested with an EventSource '
+                   'object or other SSE-capable client. '
+                   '<p>Notifications are pushed as soon as they occur, and a '
+                   'heartbeat comment is sent while the stream is idle.  When no '
+                   'notification occurs for the timeout duration, the stream is '
+                   'closed. '
                    '<p>This connection can stay open indefinitely long.')
             .param('timeout', 'The duration without a notification before the stream is closed.',
                    dataType='integer', required=False, default=DEFAULT_STREAM_TIMEOUT)
@@ -83,7 +88,8 @@ class Notification(Resource):
             .produces('text/event-stream')
             .errorResponse()
             .errorResponse('You are not logged in.', 403)
-            .errorResponse('The notification stream is not enabled.', 503)
+            .errorResponse('The notification stream is not enabled, or too many '
+                           'streams are open.', 503)
     )
     def stream(self, timeout, params):
         if not Setting().get(SettingKey.ENABLE_NOTIFICATION_STREAM):
@@ -97,22 +103,51 @@ class Notification(Resource):
         if since is not None:
             since = datetime.datetime.utcfromtimestamp(since)
 
+        broker = getBroker()
+        maxStreams = int(config.getConfig().get('notification', {}).get(
+            'max_streams', DEFAULT_MAX_STREAMS))
+        if broker.streamCount() >= maxStreams:
+            raise RestException('Too many open notification streams.', code=503)
+        key = recipientKey({'userId': user['_id']} if user else {'tokenId': token['_id']})
+
         def streamGen():
+            # subscribe before reading the database, so that nothing is missed
+            queue = broker.subscribe(key)
             lastUpdate = since
-            start = time.time()
-            wait = MIN_POLL_INTERVAL
-            while cherrypy.engine.state == cherrypy.engine.states.STARTED:
-                wait = min(wait + MIN_POLL_INTERVAL, MAX_POLL_INTERVAL)
-                for event in NotificationModel().get(user, lastUpdate, token=token):
-                    if lastUpdate is None or event['updated'] > lastUpdate:
-                        lastUpdate = event['updated']
-                    wait = MIN_POLL_INTERVAL
-                    start = time.time()
+            deadline = time.time() + timeout
+            resync = True
+            try:
+                while cherrypy.engine.state == cherrypy.engine.states.STARTED:
+                    if resync:
+                        resync = False
+                        for event in NotificationModel().get(user, lastUpdate, token=token):
+                            if lastUpdate is None or event['updated'] > lastUpdate:
+                                lastUpdate = event['updated']
+                            deadline = time.time() + timeout
+                            yield sseMessage(event)
+
+                    wait = min(HEARTBEAT_INTERVAL, deadline - time.time())
+                    if wait <= 0:
+                        break
+                    try:
+                        event = queue.get(timeout=wait)
+                    except six.moves.queue.Empty:
+                        yield ': heartbeat\n\n'
+                        continue
+
+                    if event is RESYNC:
+                        resync = True
+                        continue
+                    # the database keeps milliseconds
+                    updated = parseTimestamp(event['updated'])
+                    updated = updated.replace(microsecond=updated.microsecond // 1000 * 1000)
+                    if lastUpdate is not None and updated <= lastUpdate:
+                        continue
+                    lastUpdate = updated
+                    deadline = time.time() + timeout
                     yield sseMessage(event)
-                if time.time() - start > timeout:
-                    break
-
-                time.sleep(wait)
+            finally:
+                broker.unsubscribe(key, queue)
 
         return streamGen
 
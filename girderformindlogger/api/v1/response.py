@@ -22,7 +22,7 @@ import pytz
 from datetime import timedelta, timezone
 
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource
+from ..rest import Resource, setResponseHeader
 from datetime import datetime
 from girderformindlogger.constants import AccessType, TokenScope
 from girderformindlogger.exceptions import AccessException, ValidationException
@@ -37,44 +37,49 @@ from girderformindlogger.models.account_profile import AccountProfile
 from girderformindlogger.models.response_tokens import ResponseTokens
 from girderformindlogger.models.item import Item as ItemModel
 from girderformindlogger.models.response_alerts import ResponseAlerts
+from girderformindlogger.models.response_statistics import ResponseStatistics
 from girderformindlogger.models.upload import Upload as UploadModel
 from girderformindlogger.models.note import Note as NoteModel
 from girderformindlogger.utility import mail_utils
 from girderformindlogger.utility import file_storage
+from girderformindlogger.utility.versions import versionKey, versionRange
 from bson import json_util
 from pymongo import DESCENDING
 from bson import ObjectId
-import boto3
 import os
 import string
 import random
-import base64
-import io
-import zipfile, tempfile
-from boto3.s3.transfer import TransferConfig
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
 
-DEFAULT_REGION = 'us-east-1'
-DEFAULT_CONTAINER_NAME = 'mindlogger'
+def _mediaKey(profile, applet, activity, contentType):
+    """
+    Create a random file name for a response media and the key it is stored
+    under in the bucket.
+    """
+    filename = "{}.{}".format(
+        ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(10)),
+        contentType.split('/')[-1]
+    )
+    return filename, f"{ObjectId(profile['_id'])}/{ObjectId(applet['_id'])}/{ObjectId(activity['_id'])}/{filename}"
+
+
+def _mediaStorage(applet):
+    owner_account = AccountProfile().findOne({
+        'applets.owner': applet.get('_id')
+    })
+    return file_storage.resolve_media_storage(owner_account)
+
 
 class ResponseItem(Resource):
 
     def __init__(self):
         super(ResponseItem, self).__init__()
         self.resourceName = 'response'
-        self.s3_client = boto3.client('s3', region_name=DEFAULT_REGION, aws_access_key_id=os.environ['ACCESS_KEY_ID'],
-                                aws_secret_access_key=os.environ['SECRET_ACCESS_KEY'])
-
-        self.s3_config = TransferConfig(multipart_threshold=1024 * 100,
-                        max_concurrency=10,
-                        multipart_chunksize=1024 * 100,
-                        use_threads=False)
-
         self._model = ResponseItemModel()
         self.route('GET', (':applet', 'checkFileUploaded'), self.checkFileUploaded)
         self.route('GET', (':applet', 'checkResponseExists'), self.checkResponseExists)
         self.route('GET', (':applet',), self.getResponsesForApplet)
         self.route('GET', ('last7Days', ':applet'), self.getLast7Days)
+        self.route('GET', (':applet', 'statistics'), self.getResponseStatistics)
         self.route('GET', ('tokens', ':applet'), self.getResponseTokens)
         self.route('POST', (':applet', ':activity'), self.createResponseItem)
         self.route('POST', ('report',), self.createPDFReport)
@@ -82,6 +87,8 @@ class ResponseItem(Resource):
         self.route('PUT', (':applet',), self.updateReponseHistory)
         self.route('GET', (':applet', 'reviews'), self.getReviewerResponses)
         self.route('POST', (':applet', 'downloadGCPData'), self.downloadGCPData)
+        self.route('GET', (':applet', 'uploadUrl'), self.getUploadUrl)
+        self.route('GET', (':applet', 'downloadUrl'), self.getDownloadUrl)
         self.route('POST', (':applet', 'note'), self.addNote)
         self.route('PUT', (':applet', 'note'), self.updateNote)
         self.route('GET', (':applet', 'notes'), self.getNotes)
@@ -312,6 +319,16 @@ class ResponseItem(Resource):
             required=False,
             default=True
         )
+        .param(
+            'fromVersion',
+            'Only retrieves responses (and tokens) to this applet version or later',
+            required=False
+        )
+        .param(
+            'toVersion',
+            'Only retrieves responses (and tokens) to this applet version or earlier',
+            required=False
+        )
         .errorResponse('ID was invalid.')
         .errorResponse(
             'Read access was denied for this applet for this user.',
@@ -326,6 +343,8 @@ class ResponseItem(Resource):
         fromDate=None,
         toDate=None,
         includeOldItems=True,
+        fromVersion=None,
+        toVersion=None
     ):
         from girderformindlogger.models.profile import Profile
         from girderformindlogger.models.account_profile import AccountProfile
@@ -377,6 +396,8 @@ class ResponseItem(Resource):
             'reports': []
         }
 
+        versions = versionRange(fromVersion, toVersion)
+
         # Get the responses for each users and generate the group responses data.
         owner_account = AccountProfile().findOne({
             'applets.owner': applet.get('_id')
@@ -393,6 +414,8 @@ class ResponseItem(Resource):
             }
             if activities:
                 query["meta.activity.@id"] = { "$in": activities },
+            if versions:
+                query["meta.applet.versionKey"] = versions
 
             responses = self._model.find(
                 query=query,
@@ -410,7 +433,8 @@ class ResponseItem(Resource):
                     )
                 )
 
-            tokens = ResponseTokens().getResponseTokens(user, retrieveUserKeys=True)
+            tokens = ResponseTokens().getResponseTokens(
+                user, retrieveUserKeys=True, fromVersion=fromVersion, toVersion=toVersion)
 
             add_latest_daily_response(data, responses, tokens)
 
@@ -420,6 +444,104 @@ class ResponseItem(Resource):
 
         return data
 
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description(
+            'Get response statistics of the participants of an applet.'
+        )
+        .notes(
+            'Returns, for each participant (and activity), the number of responses, '
+            'the number of days with responses, the completion rate (days with '
+            'responses / days in the range) and the times of the first and last '
+            'responses. Days are UTC days.'
+        )
+        .modelParam(
+            'applet',
+            model=AppletModel,
+            level=AccessType.READ,
+            destName='applet',
+            description='The ID of the applet'
+        )
+        .jsonParam(
+            'users',
+            'List of profile IDs. If given, it only returns the statistics of the given users',
+            required=False,
+            dataType='array',
+        )
+        .jsonParam(
+            'activities',
+            'List of activity IDs. If given, it only counts responses to the given activities',
+            required=False,
+            dataType='array',
+        )
+        .param(
+            'fromDate',
+            'First day of the range, by default the day of the first response',
+            required=False,
+            dataType='dateTime',
+        )
+        .param(
+            'toDate',
+            'Last day of the range, by default today',
+            required=False,
+            dataType='dateTime',
+        )
+        .param(
+            'perActivity',
+            'true to return the statistics of each activity separately',
+            dataType='boolean',
+            required=False,
+            default=True
+        )
+        .errorResponse('ID was invalid.')
+        .errorResponse(
+            'Read access was denied for this applet for this user.',
+            403
+        )
+    )
+    def getResponseStatistics(
+        self,
+        applet,
+        users=None,
+        activities=None,
+        fromDate=None,
+        toDate=None,
+        perActivity=True
+    ):
+        from girderformindlogger.models.profile import Profile
+
+        for name, ids in (('users', users), ('activities', activities)):
+            if ids is not None and (not isinstance(ids, list) or
+                                    not all(ObjectId.is_valid(id) for id in ids)):
+                raise ValidationException('%s must be a list of IDs.' % name, name)
+
+        user = self.getCurrentUser()
+
+        if not AppletModel().isCoordinator(applet['_id'], user):
+            if not AppletModel().isReviewer(applet['_id'], user):
+                raise AccessException('You don\'t have access to the requested resource.')
+
+            # reviewers only see the statistics of their reviewees
+            profile = Profile().findOne({'appletId': applet['_id'], 'userId': user['_id']})
+            reviewees = [
+                reviewee['_id'] for reviewee in Profile().find({
+                    'appletId': applet['_id'],
+                    'reviewers': profile['_id']
+                }, fields=['_id'])
+            ]
+            users = [
+                userId for userId in (users or reviewees) if ObjectId(userId) in reviewees
+            ]
+
+        return ResponseStatistics().getStatistics(
+            applet['_id'],
+            startDate=fromDate,
+            endDate=toDate,
+            subjectIds=users,
+            activityIds=activities,
+            perActivity=perActivity
+        )
+
     @access.user(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
         Description(
@@ -438,11 +560,23 @@ class ResponseItem(Resource):
             required=False,
             dataType='dateTime',
         )
+        .param(
+            'fromVersion',
+            'Only retrieves tokens saved with this applet version or later',
+            required=False
+        )
+        .param(
+            'toVersion',
+            'Only retrieves tokens saved with this applet version or earlier',
+            required=False
+        )
     )
     def getResponseTokens(
         self,
         applet=None,
-        startDate=None
+        startDate=None,
+        fromVersion=None,
+        toVersion=None
     ):
         from girderformindlogger.models.profile import Profile
 
@@ -452,7 +586,8 @@ class ResponseItem(Resource):
             'userId': user['_id']
         })
 
-        return ResponseTokens().getResponseTokens(profile, startDate, retrieveUserKeys=False)
+        return ResponseTokens().getResponseTokens(
+            profile, startDate, retrieveUserKeys=False, fromVersion=fromVersion, toVersion=toVersion)
 
     @access.user(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
@@ -882,7 +1017,8 @@ class ResponseItem(Resource):
                     'url',
                     applet.get('meta', {}).get('applet', {}).get('url')
                 ),
-                "version": metadata['applet']['schemaVersion']
+                "version": metadata['applet']['schemaVersion'],
+                "versionKey": versionKey(metadata['applet']['schemaVersion'])
             }
             metadata['activity'] = {
                 "@id": activity.get('_id'),
@@ -964,36 +1100,9 @@ class ResponseItem(Resource):
                 'applets.owner': applet.get('_id')
             })
 
-            blob_service_client=None
-
             if owner_account and owner_account.get('db', None):
                 self._model.reconnectToDb(db_uri=owner_account.get('db', None))
 
-            if owner_account and owner_account.get('s3Bucket', None) and owner_account.get('accessKeyId', None):
-                bucketType = owner_account.get('bucketType', None)
-                if bucketType and 'GCP' in bucketType or 'gcp' in bucketType:
-                    self.s3_client = boto3.client(
-                        's3',
-                        region_name=DEFAULT_REGION,
-                        endpoint_url="https://storage.googleapis.com",
-                        aws_access_key_id=owner_account.get('accessKeyId', None),
-                        aws_secret_access_key=owner_account.get('secretAccessKey', None)
-                    )
-                elif bucketType and 'Azure' in bucketType or 'azure' in bucketType:
-                    blob_service_client = BlobServiceClient.from_connection_string(owner_account.get('secretAccessKey', None))
-                    try:
-                        container_client = blob_service_client.create_container(DEFAULT_CONTAINER_NAME)
-                    except Exception as ex:
-                        print('Azure CON Exception:')
-                        print(ex)
-                else:
-                    self.s3_client = boto3.client(
-                        's3',
-                        region_name=DEFAULT_REGION,
-                        aws_access_key_id=owner_account.get('accessKeyId', None),
-                        aws_secret_access_key=owner_account.get('secretAccessKey', None)
-                    )
-
             try:
                 newItem = self._model.createResponseItem(
                     folder=AppletSubjectResponsesFolder,
@@ -1010,36 +1119,25 @@ class ResponseItem(Resource):
                     "Couldn't find activity name for this response"
                 )
 
-            # for each blob in the parameter, upload it to a File under the item.
+            # upload each blob in the parameter concurrently, streaming it to
+            # the storage of the applet owner.
+            uploads = []
             for key, value in params.items():
-                fileId = value.filename
-                # upload the value (a blob)
-                um = UploadModel()
-                filename = "{}.{}".format(
-                    ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(10)),
-                    metadata['responses'][key]['type'].split('/')[-1]
+                filename, _file_obj_key = _mediaKey(
+                    profile, applet, activity, metadata['responses'][key]['type'])
+                uploads.append((key, value, filename, _file_obj_key))
+
+            if uploads:
+                storage = file_storage.resolve_media_storage(owner_account)
+                uris = file_storage.upload_parts(
+                    storage,
+                    [(value, _file_obj_key) for _, value, _, _file_obj_key in uploads]
                 )
-                _file_obj_key=f"{ObjectId(profile['_id'])}/{ObjectId(applet['_id'])}/{ObjectId(activity['_id'])}/{filename}"
-
-                file_data = value.file.read()
-
-                if owner_account and owner_account.get('s3Bucket', None):
-                    if blob_service_client:
-                        blob_client = blob_service_client.get_blob_client(container=DEFAULT_CONTAINER_NAME, blob=_file_obj_key)
-                        blob_client.upload_blob(file_data)
-                    else:
-                        self.s3_client.upload_fileobj(
-                            io.BytesIO(file_data),owner_account.get('s3Bucket',
-                            os.environ['S3_MEDIA_BUCKET']),
-                            _file_obj_key,
-                        )
-                else:
-                    self.s3_client.upload_fileobj(
-                        io.BytesIO(file_data),
-                        os.environ['S3_MEDIA_BUCKET'],
-                        _file_obj_key,
-                    )
+            else:
+                uris = []
 
+            for (key, value, filename, _), uri in zip(uploads, uris):
+                fileId = value.filename
 
                 value={}
                 if fileId is not None:
@@ -1048,15 +1146,7 @@ class ResponseItem(Resource):
                 value['fromLibrary']=False
                 value['size']=metadata['responses'][key]['size']
                 value['type']=metadata['responses'][key]['type']
-                if owner_account and owner_account.get('s3Bucket', None):
-                    if bucketType and 'GCP' in bucketType or 'gcp' in bucketType:
-                        value['uri']="gs://{}/{}".format(owner_account.get('s3Bucket', None),_file_obj_key)
-                    elif bucketType and 'Azure' in bucketType or 'azure' in bucketType.lower():
-                        value['uri']="https://{}.blob.core.windows.net/mindlogger/{}".format(owner_account.get('s3Bucket', None),_file_obj_key)
-                    else:
-                        value['uri']="s3://{}/{}".format(owner_account.get('s3Bucket', None),_file_obj_key)
-                else:
-                    value['uri']="s3://{}/{}".format(os.environ['S3_MEDIA_BUCKET'],_file_obj_key)
+                value['uri']=uri
                 # now, replace the metadata key with a link to this upload
                 metadata['responses'][key]['value'] = value
                 del metadata['responses'][key]['size']
@@ -1120,15 +1210,7 @@ class ResponseItem(Resource):
                             )
 
                 if metadata.get('alerts', []):
-                    alerts = metadata.get('alerts', [])
-
-                    for alert in alerts:
-                        ResponseAlerts().addResponseAlerts(
-                            profile,
-                            alert['id'],
-                            alert['schema'],
-                            alert['message']
-                        )
+                    ResponseAlerts().queueResponseAlerts(profile, metadata['alerts'])
 
                 if 'reviewing' in metadata:
                     responseId = metadata['reviewing'].get('responseId')
@@ -1147,57 +1229,18 @@ class ResponseItem(Resource):
             #self._model.reconnectToDb()
 
             # update profile activity
-            profile = Profile()
-            data = profile.findOne(query={
-                "_id": subject_id
-            })
-
-            updated = False
-            if metadata.get('activityFlow'):
-                for activityFlow in data['activity_flows']:
-                    if str(activityFlow['activity_flow_id']) == str(metadata['activityFlow']['@id']):
-                        activityFlow["last_activity"] = activity['_id']
-                        activityFlow["completed_time"] = now
-                        updated = True
-
-                if updated == False:
-                    data['activity_flows'].append({
-                        'activity_flow_id': metadata['activityFlow']['@id'],
-                        'last_activity': activity['_id'],
-                        'completed_time': now
-                    })
-
-            else:
-                for activity in data['completed_activities']:
-                    if activity["activity_id"] == metadata['activity']['@id']:
-                        activity["completed_time"] = now
-                        updated = True
-
-                if updated == False:
-                    data['completed_activities'].append({
-                        "activity_id": metadata['activity']['@id'],
-                        "completed_time": now
-                    })
-
-            if 'identifier' in metadata['subject']:
-                if 'identifiers' not in data:
-                    data['identifiers'] = []
-
-                if metadata['subject']['identifier'] not in data['identifiers']:
-                    data['identifiers'].append(metadata['subject']['identifier'])
-
-            if metadata.get('token'):
-                data['tokenTimes'] = data.get('tokenTimes', [])
-                data['tokenTimes'].append(now)
-
-            if event:
-                if not data.get('finished_events'):
-                    data['finished_events'] = {}
-
-                data['finished_events'][event['id']] = event['finishedTime']
+            Profile().recordActivityCompletion(
+                subject_id,
+                now,
+                metadata['activity']['@id'],
+                activityFlowId=metadata['activityFlow']['@id'] if metadata.get('activityFlow') else None,
+                identifier=metadata['subject'].get('identifier'),
+                tokenTime=now if metadata.get('token') else None,
+                event=event
+            )
 
-            data['updated'] = now
-            profile.save(data, validate=False)
+            ResponseStatistics().recordResponse(
+                applet['_id'], subject_id, activity['_id'], now)
 
             if log is not None:
                 ResponseLogModel().markSuccess(log)
@@ -1233,6 +1276,10 @@ class ResponseItem(Resource):
             'isAzure',
             'Azure check',
             required=False, default=False)
+        .param(
+            'raw',
+            'Stream the file as is instead of base64-encoding it.',
+            required=False, default=False, dataType='boolean')
         .errorResponse()
         .errorResponse('Write access was denied on the parent folder.', 403)
     )
@@ -1241,53 +1288,138 @@ class ResponseItem(Resource):
         applet,
         bucket,
         key,
-        isAzure
+        isAzure,
+        raw
     ):
+        owner_account = AccountProfile().findOne({
+            'applets.owner': applet.get('_id')
+        })
+
+        if not owner_account or not owner_account.get('s3Bucket', None):
+            raise ValidationException(
+                "Couldn't find owner account for this response"
+            )
+
+        if isAzure:
+            owner_account = dict(owner_account, bucketType='azure')
+        elif owner_account.get('accessKeyId', None):
+            owner_account = dict(owner_account, bucketType='gcp')
+        else:
+            raise ValidationException(
+                "Couldn't find credentials for this bucket"
+            )
+
+        chunks = file_storage.resolve_from_account(owner_account).download(key, bucket)
+
+        if raw:
+            self.setRawResponse()
+            setResponseHeader('Content-Type', 'application/octet-stream')
+            setResponseHeader(
+                'Content-Disposition', 'attachment; filename="%s"' % key.split('/')[-1])
+            return lambda: chunks
+
+        return b''.join(file_storage.base64_chunks(chunks))
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Get a presigned url for uploading a response media.')
+        .notes(
+            'The client uploads the file directly to the bucket with a PUT '
+            'request to the returned url, then submits the response with the '
+            'returned uri as the value of the item.'
+        )
+        .modelParam(
+            'applet',
+            model=AppletModel,
+            level=AccessType.READ,
+            destName='applet',
+            description='The ID of the Applet this response is to.'
+        )
+        .modelParam(
+            'activity',
+            model=ActivityModel,
+            level=AccessType.READ,
+            destName='activity',
+            description='The ID of the Activity this response is to.',
+            paramType='query'
+        )
+        .param('contentType', 'The MIME type of the file.', required=True)
+        .errorResponse('The applet ID was invalid.')
+        .errorResponse(
+            'Read access was denied for this applet for this user.',
+            403
+        )
+    )
+    def getUploadUrl(self, applet, activity, contentType):
         from girderformindlogger.models.profile import Profile
-        from girderformindlogger.models.account_profile import AccountProfile
-        try:
-            owner_account = AccountProfile().findOne({
-                'applets.owner': applet.get('_id')
-            })
 
-            if not owner_account or not owner_account.get('s3Bucket', None):
-                raise ValidationException(
-                    "Couldn't find owner account for this response"
-                )
-            file_path = './girderformindlogger/media/'+key.split('/')[-1]
-
-            if isAzure:
-                container_client = ContainerClient.from_connection_string(conn_str=owner_account.get('secretAccessKey', None), container_name=DEFAULT_CONTAINER_NAME)
-                blob_client = container_client.get_blob_client(key)
-                blob_name = key.split('/')[-1]
-                with open(file_path, "wb") as blob_data:
-                    # Download the file from Azure into a stream
-                    stream = blob_client.download_blob()
-                    # Write the stream to the local file
-                    blob_data.write(stream.readall())
-
-            elif owner_account and owner_account.get('s3Bucket', None) and owner_account.get('accessKeyId', None):
-                self.s3_client = boto3.resource(
-                    's3',
-                    region_name=DEFAULT_REGION,
-                    endpoint_url="https://storage.googleapis.com",
-                    aws_access_key_id=owner_account.get('accessKeyId', None),
-                    aws_secret_access_key=owner_account.get('secretAccessKey', None)
-                )
-                self.s3_client.Bucket(bucket).download_file(key, file_path)
+        thisUser = self.getCurrentUser()
+        profile = Profile().findOne({
+            'appletId': applet['_id'],
+            'userId': thisUser['_id']
+        })
+        if not profile or not AppletModel().isUser(applet['_id'], thisUser):
+            raise AccessException('Read access was denied for this applet for this user.')
 
-            with open(file_path, "rb") as image_file:
-                data = base64.b64encode(image_file.read())
+        storage = _mediaStorage(applet)
+        filename, key = _mediaKey(profile, applet, activity, contentType)
 
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        return {
+            'filename': filename,
+            'uri': storage.uri(key),
+            'url': storage.presigned_url(key, 'PUT', contentType),
+            'method': 'PUT',
+            'headers': {'Content-Type': contentType},
+            'expires': file_storage.PRESIGNED_URL_EXPIRES
+        }
 
-            return(data)
-        except:
-            import sys, traceback
-            print(sys.exc_info())
-            print(traceback.print_tb(sys.exc_info()[2]))
-            return(str(traceback.print_tb(sys.exc_info()[2])))
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Get a presigned url for downloading a response media.')
+        .modelParam(
+            'applet',
+            model=AppletModel,
+            level=AccessType.READ,
+            destName='applet',
+            description='The ID of the Applet the response belongs to.'
+        )
+        .param('uri', 'The uri of the media, as stored in the response.', required=True)
+        .errorResponse('The applet ID was invalid.')
+        .errorResponse('Read access was denied for this file.', 403)
+    )
+    def getDownloadUrl(self, applet, uri):
+        storage = _mediaStorage(applet)
+        key = storage.key(uri)
+
+        # media keys are {profile}/{applet}/{activity}/{filename}
+        parts = key.split('/') if key else []
+        if len(parts) != 4 or parts[1] != str(applet['_id']):
+            raise AccessException('Read access was denied for this file.')
+
+        thisUser = self.getCurrentUser()
+        if not AppletModel().isCoordinator(applet['_id'], thisUser):
+            from girderformindlogger.models.profile import Profile
+
+            # participants read their own media, reviewers the media of their reviewees
+            owner = Profile().findOne({
+                '_id': ObjectId(parts[0]) if ObjectId.is_valid(parts[0]) else None,
+                'appletId': applet['_id']
+            }, fields=['userId', 'reviewers'])
+            if not owner:
+                raise AccessException('Read access was denied for this file.')
+
+            if owner.get('userId') != thisUser['_id']:
+                profile = Profile().findOne({
+                    'appletId': applet['_id'],
+                    'userId': thisUser['_id']
+                }, fields=['_id']) if AppletModel().isReviewer(applet['_id'], thisUser) else None
+                if not profile or profile['_id'] not in owner.get('reviewers', []):
+                    raise AccessException('Read access was denied for this file.')
+
+        return {
+            'url': storage.presigned_url(key, 'GET'),
+            'expires': file_storage.PRESIGNED_URL_EXPIRES
+        }
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
@@ -1337,16 +1469,8 @@ class ResponseItem(Resource):
 
         # upload pdf to s3
         fileKey=f"{ObjectId(profile['_id'])}/{emailConfig.get('attachment')}.pdf"
-        pdfData = pdf.file.read()
-
-        self.s3_client.upload_fileobj(
-            io.BytesIO(pdfData),
-            os.environ['S3_REPORT_BUCKET'],
-            fileKey,
-        )
-
-
-        uri = "s3://{}/{}".format(os.environ['S3_REPORT_BUCKET'], fileKey)
+        [uri] = file_storage.upload_parts(
+            file_storage.resolve_report_storage(), [(pdf, fileKey)])
 
         # update response item with report
         responseItem['meta']['report'] = {
@@ -20,6 +20,7 @@ from girderformindlogger.models.setting import Setting
 from girderformindlogger.models.token import Token
 from girderformindlogger.models.user import User as UserModel
 from girderformindlogger.models.account_profile import AccountProfile
+from girderformindlogger.models.applet_membership import AppletMembership
 from girderformindlogger.models.response_alerts import ResponseAlerts
 from girderformindlogger.models.notification import Notification
 from girderformindlogger.settings import SettingKey
@@ -652,6 +653,16 @@ class User(Resource):
             default=None,
             required=False,
         )
+        .param(
+            'manifest',
+            'if true, activities and items are not paged in the response. '
+            'Instead, the hash of the content of each activity is returned in '
+            'the content field of each applet; the content itself is served by '
+            'GET /applet/content/{hash}.',
+            default=False,
+            required=False,
+            dataType='boolean'
+        )
         .errorResponse('ID was invalid.')
         .errorResponse(
             'You do not have permission to see any of this user\'s applets.',
@@ -670,7 +681,8 @@ class User(Resource):
         groupByDateActivity=True,
         retrieveLastResponseTime=False,
         currentApplet=None,
-        nextActivity=None
+        nextActivity=None,
+        manifest=False
     ):
         from bson.objectid import ObjectId
         from girderformindlogger.utility.jsonld_expander import loadCache
@@ -694,22 +706,27 @@ class User(Resource):
                 'Invalid user role.',
                 'role'
             )
+        accountId = None if getAllApplets else self.getAccountProfile()['accountId']
         applet_ids = []
-        if not getAllApplets:
-            accountProfile = self.getAccountProfile()
-            applet_ids = accountProfile.get('applets', {}).get(role, [])
-        else:
-            accounts = AccountProfile().getAccounts(reviewer['_id'])
-            for account in accounts:
-                for applet in account.get('applets', {}).get(role, []):
-                    applet_ids.append(ObjectId(applet))
-
-        applets = [AppletModel().load(applet_id, AccessType.READ) for applet_id in applet_ids]
-
-        welcomeApplets = AppletModel().find({ 'meta.welcomeApplet': True })
-        for applet in welcomeApplets:
-            if applet['_id'] not in applet_ids:
+        AppletMembership().syncAccounts(reviewer['_id'], accountId)
+        for membership in AppletMembership().getApplets(reviewer['_id'], role, accountId):
+            if membership['appletId'] not in applet_ids:
+                applet_ids.append(membership['appletId'])
+
+        # the applets of the user and the welcome applets, in a single query
+        loaded = {
+            applet['_id']: applet for applet in AppletModel().find({'$or': [
+                {'_id': {'$in': applet_ids}},
+                {'meta.welcomeApplet': True}
+            ]})
+        }
+        applets = []
+        for applet_id in applet_ids:
+            if applet_id in loaded:
+                applet = loaded.pop(applet_id)
+                AppletModel().requireAccess(applet, None, AccessType.READ)
                 applets.append(applet)
+        applets.extend(applet for applet in loaded.values() if applet['meta'].get('welcomeApplet'))
 
         result = []
         bufferSize = MAX_PULL_SIZE
@@ -739,6 +756,7 @@ class User(Resource):
                     localInfo=localInfo.get(str(currentAppletId), {}) if localInfo else {},
                     nextActivity=nextActivity,
                     bufferSize=bufferSize,
+                    manifest=manifest
                 )
 
                 bufferSize = remaining
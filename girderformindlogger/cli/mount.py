@@ -9,6 +9,7 @@ import stat
 import sys
 import threading
 import time
+from collections import OrderedDict
 
 import girderformindlogger
 from girderformindlogger import events, logger, logprint
@@ -24,6 +25,64 @@ from girderformindlogger.utility import path as path_util
 from girderformindlogger.utility.server import configureServer
 
 
+# Number of documents fetched per query when listing large directories.
+LIST_PAGE_SIZE = 1000
+# Listings with more entries than this are not cached.
+LIST_CACHE_MAX_ENTRIES = 10000
+# Bytes read from the file handle beyond the requested block.
+READ_AHEAD_SIZE = 1024 * 1024
+
+
+class MetadataCache(object):
+    """
+    A thread-safe LRU cache whose entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxSize=10000, ttl=60):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def items(self):
+        """
+        Get a snapshot of the unexpired entries as ``(key, value)`` pairs.
+        """
+        now = time.time()
+        with self.lock:
+            return [(key, value) for key, (expires, value) in self.entries.items() if expires >= now]
+
+    def discard(self, predicate):
+        """
+        Remove every entry for which ``predicate(key, value)`` is true.
+        """
+        with self.lock:
+            for key in [key for key, (_, value) in self.entries.items() if predicate(key, value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
 class ServerFuse(fuse.Operations):
     """
     This class handles FUSE operations that are non-default.  It exposes the
@@ -34,11 +93,16 @@ class ServerFuse(fuse.Operations):
 
     use_ns = True
 
-    def __init__(self, stat=None):
+    def __init__(self, stat=None, cacheTTL=60, cacheSize=10000):
         """
         Instantiate the operations class.  This sets up tracking for open
         files and file descriptor numbers (handles).
 
+        Resolved paths and directory listings are cached for `cacheTTL`
+        seconds.  Changes made through this process invalidate the cache
+        via model events; changes made by other processes (e.g. the API
+        server) become visible when the entries expire.
+
         :param stat: the results of an os.stat call which should be used as
             default values for files in the FUSE.  Files in the FUSE will have
             the same uid, gid, and atime.  If the resource lacks both an
@@ -56,6 +120,40 @@ class ServerFuse(fuse.Operations):
         self.nextFH = 1
         self.openFiles = {}
         self.openFilesLock = threading.Lock()
+        # path -> {model, document}
+        self.pathCache = MetadataCache(cacheSize, cacheTTL)
+        # path -> list of entry names
+        self.listCache = MetadataCache(max(1, cacheSize // 10), cacheTTL)
+        for model in ('user', 'collection', 'folder', 'item', 'file'):
+            for event in ('save.after', 'remove'):
+                events.bind('model.%s.%s' % (model, event), 'server_fuse', self._invalidate)
+
+    def _invalidate(self, event):
+        """
+        Drop the cached paths and listings affected by a saved or removed
+        resource.  Descendants of a changed resource are dropped too, since
+        its name may have changed.
+        """
+        doc = event.info
+        if not isinstance(doc, dict) or '_id' not in doc:
+            return
+        parentIds = {doc.get(key) for key in ('parentId', 'folderId', 'itemId')} - {None}
+
+        changed, parents = set(), set()
+        for path, resource in self.pathCache.items():
+            if resource['document']['_id'] == doc['_id']:
+                changed.add(path)
+                parents.add(path.rsplit('/', 1)[0])
+            elif resource['document']['_id'] in parentIds:
+                parents.add(path)
+        if event.name.startswith(('model.user.', 'model.collection.')):
+            parents.add('/' + event.name.split('.')[1])
+
+        def affected(path):
+            return path in changed or any(path.startswith(prefix + '/') for prefix in changed)
+
+        self.pathCache.discard(lambda path, resource: affected(path))
+        self.listCache.discard(lambda path, entries: path in parents or affected(path))
 
     def __call__(self, op, path, *args, **kwargs):
         """
@@ -93,13 +191,25 @@ class ServerFuse(fuse.Operations):
         # If asked about a file in top level directory or the top directory,
         # return that it doesn't exist.  Other methods should handle '',
         # '/user', and 'collection' before calling this method.
-        if '/' not in path.rstrip('/')[1:]:
+        path = path.rstrip('/')
+        if '/' not in path[1:]:
             raise fuse.FuseOSError(errno.ENOENT)
+        resource = self.pathCache.get(path)
+        if resource is not None:
+            return resource
         try:
-            # We can't filter the resource, since that removes files'
-            # assetstore information and users' size information.
-            resource = path_util.lookUpPath(
-                path.rstrip('/'), filter=False, force=True)
+            # Resolve only the last component if the parent is known, rather
+            # than walking the whole hierarchy.
+            parentPath, name = path.rsplit('/', 1)
+            parent = self.pathCache.get(parentPath) if parentPath.count('/') > 1 else None
+            if parent is not None:
+                document, model = path_util.lookUpToken(
+                    name, parent['model'], parent['document'])
+                resource = {'model': model, 'document': document}
+            else:
+                # We can't filter the resource, since that removes files'
+                # assetstore information and users' size information.
+                resource = path_util.lookUpPath(path, filter=False, force=True)
         except (path_util.NotFoundException, AccessException):
             raise fuse.FuseOSError(errno.ENOENT)
         except ValidationException:
@@ -107,6 +217,7 @@ class ServerFuse(fuse.Operations):
         except Exception:
             logger.exception('ServerFuse server internal error')
             raise fuse.FuseOSError(errno.EROFS)
+        self.pathCache.set(path, resource)
         return resource   # {model, document}
 
     def _stat(self, doc, model):
@@ -166,20 +277,68 @@ class ServerFuse(fuse.Operations):
         """
         entries = []
         if model in ('collection', 'user', 'folder'):
-            folderList = Folder().find({
+            for folder in self._pages('folder', {
                 'parentId': doc['_id'],
                 'parentCollection': model.lower()
-            })
-            for folder in folderList:
+            }):
                 entries.append(self._name(folder, 'folder'))
         if model == 'folder':
-            for item in Folder().childItems(doc):
+            for item in self._pages('item', {'folderId': doc['_id']}):
                 entries.append(self._name(item, 'item'))
         elif model == 'item':
-            for file in Item().childFiles(doc):
+            for file in self._pages('file', {'itemId': doc['_id']}):
                 entries.append(self._name(file, 'file'))
         return entries
 
+    def _pages(self, model, query):
+        """
+        Iterate over the documents matching a query, fetching only their
+        names, one page of LIST_PAGE_SIZE documents at a time.
+
+        :param model: the girderformindlogger model.
+        :param query: the query to run.
+        """
+        fields = ['login'] if model == 'user' else ['name']
+        lastId = None
+        while True:
+            pageQuery = dict(query)
+            if lastId is not None:
+                pageQuery['_id'] = {'$gt': lastId}
+            page = list(ModelImporter.model(model).find(
+                pageQuery, fields=fields, sort=[('_id', 1)], limit=LIST_PAGE_SIZE))
+            for doc in page:
+                yield doc
+            if len(page) < LIST_PAGE_SIZE:
+                return
+            lastId = page[-1]['_id']
+
+    def _listPath(self, path, model, doc=None):
+        """
+        List a directory, using the cache when possible.  Listings are
+        generated lazily so that huge directories are streamed to FUSE page
+        by page; only listings of up to LIST_CACHE_MAX_ENTRIES are cached.
+        """
+        entries = self.listCache.get(path)
+        if entries is not None:
+            for entry in entries:
+                yield entry
+            return
+
+        if doc is None:
+            names = (self._name(doc, model) for doc in self._pages(model, {}))
+        else:
+            names = iter(self._list(doc, model))
+
+        entries = []
+        for name in names:
+            if entries is not None:
+                entries.append(name)
+                if len(entries) > LIST_CACHE_MAX_ENTRIES:
+                    entries = None
+            yield name
+        if entries is not None:
+            self.listCache.set(path, entries)
+
     # We don't handle extended attributes or ioctl.
     getxattr = None
     listxattr = None
@@ -255,9 +414,17 @@ class ServerFuse(fuse.Operations):
                 raise fuse.FuseOSError(errno.EBADF)
             info = self.openFiles[fh]
         with info['lock']:
+            # Serve sequential reads from a read-ahead buffer, so that the
+            # many small reads issued by FUSE don't each reach the assetstore.
+            bufferOffset, buffer = info['buffer']
+            if bufferOffset <= offset and offset + size <= bufferOffset + len(buffer):
+                start = offset - bufferOffset
+                return buffer[start:start + size]
             handle = info['handle']
             handle.seek(offset)
-            return handle.read(size)
+            data = handle.read(max(size, READ_AHEAD_SIZE))
+            info['buffer'] = (offset, data)
+            return data[:size]
 
     def readdir(self, path, fh):
         """
@@ -273,13 +440,10 @@ class ServerFuse(fuse.Operations):
         if path == '':
             result.extend([u'collection', u'user'])
         elif path in ('/user', '/collection'):
-            model = path[1:]
-            docList = ModelImporter.model(model).find({}, sort=None)
-            for doc in docList:
-                result.append(self._name(doc, model))
+            return result + list(self._listPath(path, path[1:]))
         else:
             resource = self._getPath(path)
-            result.extend(self._list(resource['document'], resource['model']))
+            result.extend(self._listPath(path, resource['model'], resource['document']))
         return result
 
     def open(self, path, flags):
@@ -301,6 +465,7 @@ class ServerFuse(fuse.Operations):
             'path': path,
             'handle': File().open(resource['document']),
             'lock': threading.Lock(),
+            'buffer': (0, b''),
         }
         with self.openFilesLock:
             fh = self.nextFH
@@ -413,15 +578,22 @@ def unmountServer(path, lazy=False, quiet=False):
     '-l', '-z', '--lazy', 'lazy', is_flag=True, default=False,
     help='Lazy unmount.')
 @click.option('--plugins', default=None, help='Comma separated list of plugins to import.')
-def main(path, database, fuseOptions, quiet, unmount, lazy, plugins):
+@click.option(
+    '--cache-ttl', 'cacheTTL', type=float, default=60, show_default=True,
+    help='Seconds to cache resolved paths and directory listings.')
+@click.option(
+    '--cache-size', 'cacheSize', type=int, default=10000, show_default=True,
+    help='Maximum number of cached paths.')
+def main(path, database, fuseOptions, quiet, unmount, lazy, plugins, cacheTTL, cacheSize):
     if unmount or lazy:
         result = unmountServer(path, lazy, quiet)
         sys.exit(result)
     mountServer(path=path, database=database, fuseOptions=fuseOptions,
-                quiet=quiet, plugins=plugins)
+                quiet=quiet, plugins=plugins, cacheTTL=cacheTTL, cacheSize=cacheSize)
 
 
-def mountServer(path, database=None, fuseOptions=None, quiet=False, plugins=None):
+def mountServer(path, database=None, fuseOptions=None, quiet=False, plugins=None,
+                cacheTTL=60, cacheSize=10000):
     """
     Perform the mount.
 
@@ -435,6 +607,8 @@ def mountServer(path, database=None, fuseOptions=None, quiet=False, plugins=None
     :param quiet: if True, suppress Girder logs.
     :param plugins: an optional list of plugins to enable.  If None, use the
         plugins that are configured.
+    :param cacheTTL: seconds to cache resolved paths and directory listings.
+    :param cacheSize: maximum number of cached paths.
     """
     if quiet:
         curConfig = config.getConfig()
@@ -448,7 +622,7 @@ def mountServer(path, database=None, fuseOptions=None, quiet=False, plugins=None
     webroot, appconf = configureServer(plugins=plugins)
     girderformindlogger._setupCache()
 
-    opClass = ServerFuse(stat=os.stat(path))
+    opClass = ServerFuse(stat=os.stat(path), cacheTTL=cacheTTL, cacheSize=cacheSize)
     options = {
         # By default, we run in the background so the mount command returns
         # immediately.  If we run in the foreground, a SIGTERM will shut it
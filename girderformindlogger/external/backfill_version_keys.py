@@ -0,0 +1,71 @@
+# store the packed version keys (see girderformindlogger/utility/versions.py)
+# on the applets, history references, responses and response tokens created
+# before they were introduced. Safe to run several times.
+
+from pymongo import UpdateOne
+
+from girderformindlogger.models.account_profile import AccountProfile
+from girderformindlogger.models.applet import Applet
+from girderformindlogger.models.item import Item
+from girderformindlogger.models.response_folder import ResponseItem
+from girderformindlogger.models.response_tokens import ResponseTokens
+from girderformindlogger.utility.versions import versionKey
+
+BATCH_SIZE = 1000
+
+
+def backfill(collection, query, field, getUpdate):
+    """
+    Set the version keys of the documents matching a query, in batches.
+
+    :returns: The number of updated documents.
+    """
+    count = 0
+    requests = []
+    for document in collection.find(query, {field: True}):
+        requests.append(UpdateOne({'_id': document['_id']}, {'$set': getUpdate(document)}))
+        if len(requests) == BATCH_SIZE:
+            count += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        count += collection.bulk_write(requests, ordered=False).modified_count
+    return count
+
+
+def backfillResponses():
+    return backfill(ResponseItem().collection, {
+        'meta.applet.version': {'$exists': True},
+        'meta.applet.versionKey': {'$exists': False}
+    }, 'meta.applet.version', lambda response: {
+        'meta.applet.versionKey': versionKey(response['meta']['applet']['version'])
+    })
+
+
+if __name__ == '__main__':
+    print('applets: %d' % backfill(Applet().collection, {
+        'meta.applet.version': {'$exists': True},
+        'meta.applet.versionKey': {'$exists': False}
+    }, 'meta.applet.version', lambda applet: {
+        'meta.applet.versionKey': versionKey(applet['meta']['applet']['version'])
+    }))
+
+    print('history references: %d' % backfill(Item().collection, {
+        'meta.history': {'$elemMatch': {'versionKey': {'$exists': False}}}
+    }, 'meta.history', lambda reference: {
+        'meta.history': [
+            dict(entry, versionKey=versionKey(entry.get('version')))
+            for entry in reference['meta']['history']
+        ]
+    }))
+
+    print('response tokens: %d' % backfill(ResponseTokens().collection, {
+        'version': {'$exists': True},
+        'versionKey': {'$exists': False}
+    }, 'version', lambda token: {'versionKey': versionKey(token['version'])}))
+
+    # responses are stored in the database of the applet owner, if it has one
+    print('responses: %d' % backfillResponses())
+    for db in AccountProfile().collection.distinct('db', {'db': {'$nin': [None, '']}}):
+        ResponseItem().reconnectToDb(db_uri=db)
+        print('responses in %s: %d' % (db.split('@')[-1], backfillResponses()))
+    ResponseItem().reconnectToDb()
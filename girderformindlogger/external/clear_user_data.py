@@ -4,6 +4,7 @@ from bson import ObjectId
 from girderformindlogger.models.item import Item
 from girderformindlogger.models.applet import Applet
 from girderformindlogger.models.account_profile import AccountProfile
+from girderformindlogger.models.response_statistics import ResponseStatistics
 
 
 RETENTION_SET = {
@@ -51,8 +52,10 @@ for applet in applets:
     })
 
     if items:
-        _item.remove({'_id': {
+        query = {'_id': {
             '$in': [ObjectId(item['_id']) for item in items]
-        }})
+        }}
+        ResponseStatistics().removeResponses(query, _item)
+        _item.remove(query)
 
     print(f'Responses were removed for applet id - {applet.get("_id")}')
@@ -0,0 +1,150 @@
+"""
+Compare the per-request overhead of the compiled parameter binding of
+``autoDescribeRoute`` with the loop it replaced, on the parameters of the
+response upload route.
+
+    python girderformindlogger/external/describe_benchmark.py --size 4 --repeat 20
+
+``--size`` is the size of the ``metadata`` JSON in MB.
+"""
+import argparse
+import json
+import time
+
+import bson.json_util
+import jsonschema
+import six
+
+from girderformindlogger.api.describe import Description, autoDescribeRoute
+from girderformindlogger.exceptions import RestException
+
+
+class FakeModel(object):
+    name = 'applet'
+
+    def load(self, id, force=False, **kwargs):
+        return {'_id': id}
+
+
+def uploadDescription(schema=None):
+    return (
+        Description('Create a new user response item.')
+        .modelParam('applet', model=FakeModel, force=True, destName='applet')
+        .modelParam('activity', model=FakeModel, force=True, destName='activity')
+        .param('subject_id', 'The subject.', required=False, default=None)
+        .param('pending', 'In progress.', required=False, default=False)
+        .param('deviceId', 'The device.', paramType='formData', required=False)
+        .param('activityStartedAt', 'timestamp', required=False, default=None,
+               dataType='integer')
+        .jsonParam('metadata', 'The metadata.', paramType='form', requireObject=True,
+                   required=True, schema=schema)
+    )
+
+
+def legacyRoute(description, fun):
+    route = autoDescribeRoute(description)
+    route._inspectFunSignature(fun)
+
+    def getModel(name):
+        if name not in description.modelParams:
+            return
+        info = description.modelParams[name]
+        return info['model']()
+
+    def loadJson(name, info, value):
+        try:
+            val = bson.json_util.loads(value)
+        except ValueError:
+            raise RestException('Parameter %s must be valid JSON.' % name)
+        if info.get('schema') is not None:
+            jsonschema.validate(val, info['schema'])
+        elif info['requireObject'] and not isinstance(val, dict):
+            raise RestException('Parameter %s must be a JSON object.' % name)
+        return val
+
+    def wrapped(*args, **kwargs):
+        params = {k: v for k, v in six.viewitems(kwargs) if k != 'params'}
+        params.update(kwargs.get('params', {}))
+        kwargs['params'] = kwargs.get('params', {})
+
+        for descParam in description.params:
+            if 'type' not in descParam and 'schema' not in descParam:
+                continue
+            name = descParam['name']
+            model = getModel(name)
+            if name in params:
+                if name in description.jsonParams:
+                    info = description.jsonParams[name]
+                    route._passArg(fun, kwargs, name, loadJson(name, info, params[name]))
+                elif name in description.modelParams:
+                    info = description.modelParams[name]
+                    kwargs.pop(name, None)
+                    val = route._loadModel(name, info, params[name], model)
+                    route._passArg(fun, kwargs, route._destName(info, model), val)
+                else:
+                    val = route._validateParam(name, descParam, params[name])
+                    route._passArg(fun, kwargs, name, val)
+            elif 'default' in descParam:
+                route._passArg(fun, kwargs, name, descParam['default'])
+            elif descParam['required']:
+                raise RestException('Parameter "%s" is required.' % name)
+            else:
+                route._passArg(fun, kwargs, name, None)
+
+        route._mungeKwargs(kwargs, fun)
+        return fun(*args, **kwargs)
+
+    return wrapped
+
+
+def handler(applet, activity, metadata, subject_id, deviceId, activityStartedAt, pending,
+            params):
+    return metadata
+
+
+def metadataOfSize(size):
+    responses = {}
+    i = 0
+    while len(json.dumps(responses)) < size:
+        for j in range(1000):
+            responses['https://example.org/items/item-%d' % (i + j)] = {
+                'value': [i + j, 'option %d' % (i + j)], 'text': 'response text ' * 4
+            }
+        i += 1000
+    return {'responses': responses, 'subject': {'timezone': 0}}
+
+
+def timed(route, params, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        route(**dict(params, params={}))
+    return (time.time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='autoDescribeRoute benchmark')
+    parser.add_argument('--size', type=float, default=4, help='metadata size in MB')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    metadata = metadataOfSize(int(args.size * 1024 * 1024))
+    schema = {'type': 'object', 'required': ['responses']}
+    for name, body in (
+        ('small metadata', json.dumps({'responses': {}})),
+        ('%.1f MB metadata' % args.size, json.dumps(metadata))
+    ):
+        for schemaName, routeSchema in (('', None), (', with schema', schema)):
+            params = {
+                'applet': '5e0000000000000000000000', 'activity': '5e0000000000000000000001',
+                'activityStartedAt': '1600000000', 'metadata': body
+            }
+            repeat = args.repeat if len(body) > 1024 else args.repeat * 1000
+            legacy = timed(legacyRoute(uploadDescription(routeSchema), handler), params, repeat)
+            compiled = timed(autoDescribeRoute(uploadDescription(routeSchema))(handler),
+                             params, repeat)
+            print('%s%s: legacy %.1fus, compiled %.1fus per request (%.1fx)' % (
+                name, schemaName, legacy * 1e6, compiled * 1e6, legacy / compiled))
+
+
+if __name__ == '__main__':
+    main()
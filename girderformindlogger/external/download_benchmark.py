@@ -0,0 +1,113 @@
+"""
+Compare the throughput of the assetstore download generators with the
+generators they replaced.
+
+    python girderformindlogger/external/download_benchmark.py --size 512
+
+The filesystem test reads a temporary file; the GridFS test streams
+in-memory chunks, with ``--latency`` seconds of simulated database latency
+per batch of chunks.
+"""
+import argparse
+import mmap
+import os
+import tempfile
+import time
+
+from girderformindlogger.utility.filesystem_assetstore_adapter import BUF_SIZE, \
+    DOWNLOAD_CHUNK_SIZE
+from girderformindlogger.utility.gridfs_assetstore_adapter import CHUNK_SIZE, \
+    PREFETCH_CHUNKS, _prefetch, _streamChunks
+
+
+def legacyFilesystem(path, offset, endByte):
+    bytesRead = offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            readLen = min(BUF_SIZE, endByte - bytesRead)
+            if readLen <= 0:
+                break
+            data = f.read(readLen)
+            bytesRead += readLen
+            if not data:
+                break
+            yield data
+
+
+def mappedFilesystem(path, offset, endByte):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        end = min(endByte, len(data))
+        for position in range(offset, end, DOWNLOAD_CHUNK_SIZE):
+            yield data[position:min(position + DOWNLOAD_CHUNK_SIZE, end)]
+
+
+def chunkCursor(chunks, latency):
+    for i, chunk in enumerate(chunks):
+        if i % PREFETCH_CHUNKS == 0:
+            time.sleep(latency)
+        yield chunk
+
+
+def legacyGridFs(chunks, offset, endByte, chunkOffset=0):
+    co = chunkOffset
+    position = offset
+    for chunk in chunks:
+        chunkLen = len(chunk['data'])
+        shouldBreak = False
+        if position + chunkLen - co > endByte:
+            chunkLen = endByte - position + co
+            shouldBreak = True
+        yield chunk['data'][co:chunkLen]
+        if shouldBreak:
+            break
+        position += chunkLen - co
+        co = 0
+
+
+def measure(name, generator, size):
+    start = time.time()
+    total = 0
+    for data in generator:
+        total += len(data)
+    elapsed = time.time() - start
+    assert total == size, (name, total, size)
+    print('%-25s %8.1f MB/s' % (name, size / elapsed / 1024 ** 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download throughput benchmark')
+    parser.add_argument('--size', type=int, default=256, help='file size in MB')
+    parser.add_argument('--latency', type=float, default=0.002)
+    args = parser.parse_args()
+    size = args.size * 1024 ** 2
+
+    with tempfile.NamedTemporaryFile() as f:
+        block = os.urandom(1024 ** 2)
+        for _ in range(args.size):
+            f.write(block)
+        f.flush()
+
+        measure('filesystem (read)', legacyFilesystem(f.name, 0, size), size)
+        measure('filesystem (mmap)', mappedFilesystem(f.name, 0, size), size)
+
+        chunks = []
+        for position in range(0, size, CHUNK_SIZE):
+            f.seek(position)
+            chunks.append({'data': f.read(CHUNK_SIZE)})
+
+    measure('gridfs (slices)', legacyGridFs(chunkCursor(chunks, args.latency), 0, size), size)
+    measure('gridfs (prefetch)', _streamChunks(
+        _prefetch(chunkCursor(chunks, args.latency)), 0, size), size)
+
+    # a range starting and ending in the middle of chunks
+    offset = CHUNK_SIZE // 2
+    endByte = size - CHUNK_SIZE // 2
+    measure('gridfs range (slices)', legacyGridFs(
+        chunkCursor(chunks, args.latency), offset, endByte, offset), endByte - offset)
+    measure('gridfs range (prefetch)', _streamChunks(
+        _prefetch(chunkCursor(chunks, args.latency)), offset, endByte, offset), endByte - offset)
+
+
+if __name__ == '__main__':
+    main()
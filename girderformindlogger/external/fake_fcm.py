@@ -0,0 +1,158 @@
+"""
+A local stand-in for the FCM legacy HTTP endpoint, used for load tests of the
+push notification sender.
+
+Run the server alone and point the API or the rq workers at it:
+
+    python girderformindlogger/external/fake_fcm.py --port 8765
+    export FCM_END_POINT=http://localhost:8765/fcm/send
+
+or run a self-contained load test against it:
+
+    python girderformindlogger/external/fake_fcm.py --load-test 100000
+
+Device tokens starting with ``invalid`` are answered with ``NotRegistered``,
+tokens starting with ``canonical`` get a new ``registration_id`` and tokens
+starting with ``unavailable`` fail once with ``Unavailable``.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+import uuid
+
+from aiohttp import web
+
+
+def create_app(latency=0.0, throttle_every=0):
+    """
+    Create the fake FCM application.
+
+    :param latency: Seconds to wait before answering each request.
+    :param throttle_every: If set, every n-th request is answered with a 503
+        and a `Retry-After` header.
+    """
+    stats = {'requests': 0, 'messages': 0, 'throttled': 0}
+    seen = set()
+    counter = itertools.count(1)
+
+    def result(token):
+        if token.startswith('invalid'):
+            return {'error': 'NotRegistered'}
+        if token.startswith('unavailable') and token not in seen:
+            seen.add(token)
+            return {'error': 'Unavailable'}
+
+        result = {'message_id': '0:%d' % next(counter)}
+        if token.startswith('canonical'):
+            result['registration_id'] = 'renewed-' + token
+        return result
+
+    async def send(request):
+        stats['requests'] += 1
+        if latency:
+            await asyncio.sleep(latency)
+
+        if throttle_every and stats['requests'] % throttle_every == 0:
+            stats['throttled'] += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+
+        if not request.headers.get('Authorization', '').startswith('key='):
+            return web.Response(status=401)
+
+        payload = await request.json()
+        if 'registration_ids' in payload:
+            tokens = payload['registration_ids']
+        elif 'to' in payload and not payload['to'].startswith('/topics/'):
+            tokens = [payload['to']]
+        else:
+            stats['messages'] += 1
+            return web.json_response({'message_id': next(counter)})
+
+        stats['messages'] += len(tokens)
+        results = [result(token) for token in tokens]
+        success = len([r for r in results if 'message_id' in r])
+        return web.json_response({
+            'multicast_id': uuid.uuid4().int >> 65,
+            'success': success,
+            'failure': len(results) - success,
+            'canonical_ids': len([r for r in results if 'registration_id' in r]),
+            'results': results
+        })
+
+    async def getStats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app['stats'] = stats
+    app.router.add_post('/fcm/send', send)
+    app.router.add_get('/stats', getStats)
+    return app
+
+
+async def start(app, host='127.0.0.1', port=0):
+    """
+    Start serving `app` on the running loop. Returns the runner and the url
+    of the send endpoint.
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://%s:%d/fcm/send' % (host, port)
+
+
+async def load_test(devices, concurrency=32, rate=1000, latency=0.05):
+    from girderformindlogger.utility.notification import FCMSender
+
+    app = create_app(latency=latency)
+    runner, endpoint = await start(app)
+    pruned = []
+
+    sender = FCMSender(
+        'fake-key', endpoint=endpoint, concurrency=concurrency, rate=rate,
+        on_invalid_tokens=lambda invalid, canonical: pruned.extend(invalid)
+    )
+    tokens = [
+        ('invalid-%d' if i % 100 == 0 else 'device-%d') % i for i in range(devices)
+    ]
+    messages = [{
+        'registration_ids': tokens[i:i + 500],
+        'notification': {'title': 'Load test', 'body': 'Hello'}
+    } for i in range(0, devices, 500)]
+
+    start_time = time.time()
+    response = await sender.send_async(messages)
+    elapsed = time.time() - start_time
+    await runner.cleanup()
+
+    print('devices: %d, requests: %d, elapsed: %.2fs, %.0f messages/s' % (
+        devices, app['stats']['requests'], elapsed, devices / elapsed))
+    print('success: %d, failure: %d, pruned: %d' % (
+        response['success'], response['failure'], len(pruned)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake FCM server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--load-test', type=int, default=0, metavar='DEVICES')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--rate', type=float, default=1000)
+    args = parser.parse_args()
+
+    if args.load_test:
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(load_test(
+            args.load_test, args.concurrency, args.rate, args.latency))
+        loop.close()
+    else:
+        web.run_app(
+            create_app(args.latency, args.throttle_every), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
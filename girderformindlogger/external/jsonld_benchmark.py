@@ -0,0 +1,147 @@
+"""
+Compare the JSON-LD normaliser with the recursive implementation it
+replaced, on real protocol documents.
+
+    python girderformindlogger/external/jsonld_benchmark.py --repeat 20 [FILE ...]
+
+Each document (by default the HBN protocol in ``test/expected``) is also
+benchmarked in its expanded form, with every ``reprolib:`` prefix written
+out as a url. The outputs of both implementations are compared.
+"""
+import argparse
+import json
+import os
+import time
+
+from girderformindlogger.constants import KEYS_TO_DELANGUAGETAG, \
+    KEYS_TO_DEREFERENCE, REPROLIB_CANONICAL, REPROLIB_PREFIXES
+from girderformindlogger.utility import jsonld_normalize
+
+DEFAULT_DOCUMENT = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'test', 'expected', 'test_1_HBN.jsonld')
+
+
+def legacyReprolibPrefix(s):
+    if isinstance(s, str):
+        for prefix in REPROLIB_PREFIXES:
+            if s.startswith(prefix) and s != prefix:
+                return s.replace(prefix, 'reprolib:')
+    return s
+
+
+def legacySchemaPrefix(s):
+    if isinstance(s, str) and s.startswith('http://schema.org/'):
+        return s.replace('http://schema.org/', 'schema:')
+    return s
+
+
+def legacyCanonize(s):
+    if isinstance(s, str):
+        return legacyReprolibPrefix(s).replace('reprolib:', REPROLIB_CANONICAL)
+    elif isinstance(s, list):
+        return [legacyCanonize(ls) for ls in s]
+    elif isinstance(s, dict):
+        return {legacyCanonize(k): legacyCanonize(v) for k, v in s.items()}
+    return s
+
+
+def legacyDereference(prefixed):
+    if isinstance(prefixed, str):
+        return legacyCanonize(prefixed)
+    elif isinstance(prefixed, dict):
+        return {k: legacyDereference(v) for k, v in prefixed.items()}
+    elif isinstance(prefixed, list):
+        return [legacyDereference(li) for li in prefixed]
+    return prefixed
+
+
+def legacyFixUpFormat(obj):
+    if isinstance(obj, dict):
+        newObj = {}
+        for k in obj.keys():
+            rk = legacyReprolibPrefix(k)
+            if k in KEYS_TO_DELANGUAGETAG:
+                newObj[rk] = legacyCanonize(jsonld_normalize.delanguage_tag(obj[k]))
+            elif k in KEYS_TO_DEREFERENCE:
+                newObj[rk] = legacyDereference(obj[k])
+            elif isinstance(obj[k], list):
+                newObj[rk] = [legacyFixUpFormat(li) for li in obj[k]]
+            elif isinstance(obj[k], dict):
+                newObj[rk] = legacyFixUpFormat(obj[k])
+            else:
+                newObj[rk] = obj[k]
+            if isinstance(obj[k], str) and k not in KEYS_TO_DEREFERENCE:
+                newObj[rk] = legacyReprolibPrefix(obj[k])
+            s2k = legacySchemaPrefix(rk)
+            if s2k != rk:
+                newObj[s2k] = newObj.pop(rk)
+        if "@context" in newObj:
+            newObj["@context"] = legacyCanonize(newObj["@context"])
+        for k in ["schema:url", "http://schema.org/url"]:
+            if k in newObj and newObj[k] is not None:
+                newObj["url"] = newObj["schema:url"] = newObj[k]
+        return newObj
+    elif isinstance(obj, str):
+        return legacyReprolibPrefix(obj)
+    return obj
+
+
+def expanded(obj):
+    if isinstance(obj, str):
+        return obj.replace('reprolib:', REPROLIB_CANONICAL)
+    elif isinstance(obj, list):
+        return [expanded(li) for li in obj]
+    elif isinstance(obj, dict):
+        return {expanded(k): expanded(v) for k, v in obj.items()}
+    return obj
+
+
+def documents(obj):
+    """
+    Yield the applet, protocol, activities and items of a formatted applet.
+    """
+    for key in ('applet', 'protocol'):
+        if isinstance(obj.get(key), dict):
+            yield obj[key]
+    for key in ('activities', 'items'):
+        for document in (obj.get(key) or {}).values():
+            yield document
+
+
+def timed(fn, docs, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        result = [fn(doc) for doc in docs]
+    return time.time() - start, result
+
+
+def benchmark(name, docs, repeat):
+    legacyTime, legacy = timed(legacyFixUpFormat, docs, repeat)
+    newTime, normalized = timed(jsonld_normalize.normalize, docs, repeat)
+    twiceTime, _ = timed(
+        lambda doc: jsonld_normalize.normalize(jsonld_normalize.normalize(doc), copy=False),
+        docs, repeat)
+
+    print('%s: %d documents x %d, legacy %.3fs, normalize %.3fs (%.1fx), '
+          'normalize twice %.3fs, identical: %s' % (
+              name, len(docs), repeat, legacyTime, newTime, legacyTime / newTime,
+              twiceTime, legacy == normalized))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON-LD normaliser benchmark')
+    parser.add_argument('files', nargs='*', default=[DEFAULT_DOCUMENT])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for path in args.files:
+        with open(path) as f:
+            obj = json.load(f)
+        docs = list(documents(obj)) or [obj]
+
+        benchmark(os.path.basename(path), docs, args.repeat)
+        benchmark(os.path.basename(path) + ' (expanded)', expanded(docs), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
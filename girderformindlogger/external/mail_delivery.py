@@ -0,0 +1,73 @@
+"""
+Deliver the mail queue from a dedicated process. Set ``workers = 0`` in the
+``[mail]`` config section of the API servers so that they only enqueue.
+
+Run a throughput benchmark against a local ``aiosmtpd`` sink with:
+
+    python girderformindlogger/external/mail_delivery.py --benchmark 10000
+"""
+import argparse
+import time
+
+from girderformindlogger.models.mail_queue import MailQueue
+from girderformindlogger.utility import config
+from girderformindlogger.utility.mail_utils import MailDelivery
+
+
+def benchmark(messages, workers, batchSize):
+    from aiosmtpd.controller import Controller
+
+    class Sink(object):
+        received = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            self.received += 1
+            return '250 OK'
+
+    sink = Sink()
+    controller = Controller(sink, hostname='127.0.0.1', port=8025)
+    controller.start()
+
+    queue = MailQueue()
+    body = 'Subject: Benchmark\r\n\r\n' + 'x' * 2000
+    for i in range(messages):
+        queue.enqueue(body, 'benchmark@localhost', ['user-%d@localhost' % i])
+
+    delivery = MailDelivery(
+        queue=queue, workers=workers, batchSize=batchSize, pollInterval=0.1,
+        settings=lambda: {'host': '127.0.0.1', 'port': 8025})
+    start = time.time()
+    delivery.start()
+    while sink.received < messages:
+        time.sleep(0.1)
+    elapsed = time.time() - start
+    delivery.stop()
+    controller.stop()
+
+    print('messages: %d, workers: %d, elapsed: %.2fs, %.0f messages/s' % (
+        messages, workers, elapsed, messages / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mail queue delivery')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--benchmark', type=int, default=0, metavar='MESSAGES')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.workers or 4, args.batch_size or 20)
+        return
+
+    workers = args.workers or int(config.getConfig().get('mail', {}).get('workers', 0) or 4)
+    delivery = MailDelivery(workers=workers, batchSize=args.batch_size)
+    delivery.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        delivery.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,45 @@ import datetime
 
 from bson import ObjectId
 from pyfcm import FCMNotification
+from girderformindlogger import logger
+from girderformindlogger.utility import config, toBool
 from girderformindlogger.utility.notification import FirebaseNotification
 from collections import defaultdict
 
+
+def prune_device_ids(invalid, canonical):
+    """
+    Remove device ids rejected by FCM from users and profiles, and replace the
+    ones FCM reported a canonical id for.
+    """
+    from girderformindlogger.models.profile import Profile
+    from girderformindlogger.models.user import User as UserModel
+
+    if invalid:
+        for model in (UserModel(), Profile()):
+            model.update({'deviceId': {'$in': invalid}}, {'$set': {'deviceId': ''}})
+
+    for device_id, canonical_id in canonical.items():
+        for model in (UserModel(), Profile()):
+            model.update({'deviceId': device_id}, {'$set': {'deviceId': canonical_id}})
+
+
 push_service = FirebaseNotification(
         api_key='AAAAJOyOEz4:APA91bFudM5Cc1Qynqy7QGxDBa-2zrttoRw6ZdvE9PQbfIuAB9SFvPje7DcFMmPuX1IizR1NAa7eHC3qXmE6nmOpgQxXbZ0sNO_n1NITc1sE5NH3d8W9ld-cfN7sXNr6IAOuodtEwQy-',
-        proxy_dict={})
+        proxy_dict={},
+        on_invalid_tokens=prune_device_ids)
 
 AMOUNT_MESSAGES_PER_REQUEST = 1000
 
 
+def push_enabled():
+    """
+    Scheduled push notifications are turned off unless `push_enabled` is set
+    in the [notification] section of the config.
+    """
+    return toBool(config.getConfig().get('notification', {}).get('push_enabled', False))
+
+
 # this handles notifications for activities
 def send_push_notification(applet_id, event_id, activity_id=None, activity_flow_id=None, send_time=None, reminder=False ,type_="event-alert"):
     return
@@ -138,6 +167,40 @@ def send_push_notification(applet_id, event_id, activity_id=None, activity_flow_
         #     eventsModel.save(event)
 
 
+# this handles batches collected by the notification dispatcher
+def send_push_notification_batch(device_ids, user_ids, applet_id, event_id, activity_id=None, activity_flow_id=None, type_="event-alert"):
+    from girderformindlogger.models.profile import Profile
+
+    if not push_enabled():
+        logger.info('Push notifications are disabled, skipping %d devices of event %s',
+                    len(device_ids), event_id)
+        return
+
+    title = 'Tap to update the schedule.'
+    body = 'Your schedule has been changed, tap to update.'
+
+    result = push_service.notify_multiple_devices(
+        registration_ids=device_ids,
+        message_title=title,
+        message_body=body,
+        time_to_live=0,
+        data_message={
+            "event_id": str(event_id),
+            "applet_id": str(applet_id),
+            "activity_id": str(activity_id),
+            "activity_flow_id": str(activity_flow_id),
+            "type": type_,
+            "is_server": True
+        },
+        extra_kwargs={"apns_expiration": "0"},
+    )
+
+    logger.info('Notifications of event %s: %s succeeded, %s failed',
+                event_id, result['success'], result['failure'])
+
+    Profile().updateProfileBadgets([{'userId': user_id} for user_id in user_ids])
+
+
 def send_notification(title:str, body:str, type_:str, device_ids:list):
     result = push_service.notify_multiple_devices(
         registration_ids=device_ids,
@@ -0,0 +1,181 @@
+import datetime
+import time
+
+from bson import ObjectId
+from collections import defaultdict
+from rq import Queue
+
+from girderformindlogger.external.notification import send_push_notification_batch, \
+    AMOUNT_MESSAGES_PER_REQUEST
+from girderformindlogger.models import getRedisConnection
+from girderformindlogger.models.events import Events
+from girderformindlogger.models.profile import Profile
+from girderformindlogger.utility import reconnect
+from girderformindlogger.utility.timing_wheel import TimingWheel
+
+# Ticks older than this are skipped when the dispatcher was down for a while.
+MAX_CATCH_UP = datetime.timedelta(minutes=15)
+TICK = datetime.timedelta(minutes=1)
+
+EVENT_FIELDS = [
+    'applet_id', 'individualized', 'data.users', 'data.activity_id',
+    'data.activity_flow_id', 'data.reminder'
+]
+PROFILE_FIELDS = [
+    '_id', 'appletId', 'userId', 'deviceId', 'individual_events',
+    'completed_activities', 'activity_flows'
+]
+
+
+def _is_pending(profile, key, id_field, target_id, range_start, now):
+    """
+    Check that the activity (flow) was not completed in the given range.
+    """
+    for entry in profile.get(key) or []:
+        if entry.get(id_field) != target_id:
+            continue
+
+        completed_time = entry.get('completed_time')
+        if completed_time is None or not range_start < completed_time < now:
+            return True
+    return False
+
+
+class NotificationDispatcher(object):
+    """
+    Sends the scheduled notifications of all applets from a single process.
+
+    Every minute the dispatcher advances the timing wheel, collects every
+    trigger due in any timezone, resolves the recipients with one profile
+    query per timezone bucket and enqueues deduplicated batches of device ids
+    for the rq workers.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection or getRedisConnection()
+        self.wheel = TimingWheel(self.connection)
+        self.queue = Queue('default', connection=self.connection)
+
+    def run(self):
+        while True:
+            now = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+            cursor = self.wheel.get_cursor()
+            tick = max(cursor + TICK, now - MAX_CATCH_UP) if cursor else now
+
+            while tick <= now:
+                self.dispatch(tick)
+                self.wheel.set_cursor(tick)
+                tick += TICK
+
+            time.sleep(max(0, (now + TICK - datetime.datetime.utcnow()).total_seconds()))
+
+    def dispatch(self, tick):
+        """
+        Send the notifications due at a UTC tick.
+
+        :param tick: The UTC minute to process.
+        :type tick: datetime.datetime
+        :returns: The number of batches enqueued.
+        """
+        if not self.wheel.claim(tick):
+            return 0
+
+        due = self.wheel.collect(tick)
+        if not due:
+            return 0
+
+        event_ids = {
+            trigger['event'] for triggers in due.values() for trigger, _ in triggers
+        }
+        events = {
+            str(event['_id']): event for event in Events().find(
+                {'_id': {'$in': [ObjectId(event_id) for event_id in event_ids]}},
+                fields=EVENT_FIELDS
+            )
+        }
+
+        batches = defaultdict(dict)
+        for timezone, triggers in due.items():
+            triggers = [
+                (trigger, events[trigger['event']]) for trigger, _ in triggers
+                if trigger['event'] in events
+            ]
+            if not triggers:
+                continue
+
+            profiles = defaultdict(list)
+            for profile in Profile().get_notification_recipients(
+                {event['applet_id'] for _, event in triggers},
+                timezone,
+                fields=PROFILE_FIELDS
+            ):
+                profiles[profile['appletId']].append(profile)
+
+            for trigger, event in triggers:
+                batch = batches[(trigger['event'], trigger['reminder'], trigger['type'])]
+                for profile in self._recipients(event, trigger, profiles[event['applet_id']], tick):
+                    batch.setdefault(profile['deviceId'], profile['userId'])
+
+        count = 0
+        for (event_id, _, type_), recipients in batches.items():
+            event = events[event_id]
+            device_ids = list(recipients.keys())
+
+            for i in range(0, len(device_ids), AMOUNT_MESSAGES_PER_REQUEST):
+                chunk = device_ids[i:i + AMOUNT_MESSAGES_PER_REQUEST]
+                self.queue.enqueue_call(
+                    func=send_push_notification_batch,
+                    kwargs={
+                        'device_ids': chunk,
+                        'user_ids': list({recipients[device_id] for device_id in chunk}),
+                        'applet_id': event['applet_id'],
+                        'event_id': event['_id'],
+                        'activity_id': event['data'].get('activity_id', None),
+                        'activity_flow_id': event['data'].get('activity_flow_id', None),
+                        'type_': type_
+                    }
+                )
+                count += 1
+
+        return count
+
+    def _recipients(self, event, trigger, profiles, now):
+        activity_id = event['data'].get('activity_id', None)
+        activity_flow_id = event['data'].get('activity_flow_id', None)
+
+        range_start = now - datetime.timedelta(hours=12)
+        if trigger['reminder']:
+            reminder = event['data'].get('reminder', {})
+            days = int(reminder.get('days', 0))
+            reminder_time = reminder.get('time', '00:00')
+
+            range_start = now - datetime.timedelta(
+                days=days, hours=int(reminder_time[:2]), minutes=int(reminder_time[-2:]))
+
+        users = set(event['data'].get('users') or [])
+
+        for profile in profiles:
+            if event['individualized']:
+                if profile.get('individual_events', 0) < 1 or profile['_id'] not in users:
+                    continue
+            elif profile.get('individual_events', 0) != 0:
+                continue
+
+            if activity_id and not _is_pending(
+                    profile, 'completed_activities', 'activity_id', activity_id, range_start, now):
+                continue
+
+            if not activity_id and activity_flow_id and not _is_pending(
+                    profile, 'activity_flows', 'activity_flow_id', activity_flow_id, range_start, now):
+                continue
+
+            yield profile
+
+
+@reconnect(name='NotificationDispatcher')
+def start():
+    NotificationDispatcher().run()
+
+
+if __name__ == '__main__':
+    start()
@@ -0,0 +1,9 @@
+# rebuild the applet membership index from the account profiles; run it once
+# after upgrading, and whenever the index may have drifted.
+
+from girderformindlogger.models.applet_membership import AppletMembership
+
+
+if __name__ == '__main__':
+    count = AppletMembership().rebuild()
+    print('indexed the applets of %d account profiles' % count)
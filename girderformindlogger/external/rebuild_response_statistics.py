@@ -0,0 +1,39 @@
+# recompute the response statistics of applets from their responses; run it
+# once to backfill the statistics, and to repair them after responses were
+# deleted outside of the API.
+#
+#   python girderformindlogger/external/rebuild_response_statistics.py [--applet <id> ...]
+
+import argparse
+
+from bson.objectid import ObjectId
+
+from girderformindlogger.models.account_profile import AccountProfile
+from girderformindlogger.models.applet import Applet
+from girderformindlogger.models.response_folder import ResponseItem
+from girderformindlogger.models.response_statistics import ResponseStatistics
+
+
+def rebuild(appletId):
+    # responses are stored in the database of the applet owner, if it has one
+    owner_account = AccountProfile().findOne({'applets.owner': appletId})
+    if owner_account and owner_account.get('db', None):
+        ResponseItem().reconnectToDb(db_uri=owner_account['db'])
+
+    try:
+        return ResponseStatistics().rebuild(appletId)
+    finally:
+        ResponseItem().reconnectToDb()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='rebuild response statistics')
+    parser.add_argument('--applet', action='append', default=[], help='applet id')
+    args = parser.parse_args()
+
+    appletIds = [ObjectId(id) for id in args.applet] or [
+        applet['_id'] for applet in Applet().find(
+            {'meta.applet': {'$exists': True}}, fields=['_id'])
+    ]
+    for appletId in appletIds:
+        print('%s: %d statistics' % (appletId, rebuild(appletId)))
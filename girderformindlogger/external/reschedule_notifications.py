@@ -1,13 +1,129 @@
+"""
+Recompute the notification triggers of every event, e.g. after a deploy
+which changed the recurrence rules.
+
+    python girderformindlogger/external/reschedule_notifications.py
+
+Events are rescheduled in batches of ``--batch-size``, with one bulk write and
+one redis pipeline per batch. Measure the throughput on synthetic events with:
+
+    python girderformindlogger/external/reschedule_notifications.py --benchmark 100000
+
+The benchmark inserts the events under a new applet id in the configured
+database and removes them (and their triggers) afterwards.
+"""
+import argparse
 import datetime
+import time
 
 from bson import ObjectId
 from girderformindlogger.models.events import Events as EventsModel
-from girderformindlogger.models.account_profile import AccountProfile
+from girderformindlogger.utility.recurrence import build_triggers
+
+BATCH_SIZE = 1000
+EVENT_FIELDS = ['data', 'schedule', 'schedulers']
+
+
+def reschedule(query=None, batchSize=BATCH_SIZE):
+    model = EventsModel()
+    now = datetime.datetime.utcnow()
+    batch = []
+    count = 0
+
+    for event in model.find(query or {}, fields=EVENT_FIELDS):
+        batch.append(event)
+        if len(batch) >= batchSize:
+            count += model.rescheduleEvents(batch, now)
+            batch = []
+    count += model.rescheduleEvents(batch, now)
+
+    return count
+
+
+def synthetic_event(applet_id, i):
+    start = datetime.datetime(2021, 1, 1) + datetime.timedelta(days=i % 365)
+    event_type = ['', 'Daily', 'Weekly', 'Monthly'][i % 4]
+
+    return {
+        'applet_id': applet_id,
+        'individualized': False,
+        'schedulers': [],
+        'sendTime': [],
+        'data': {
+            'eventType': event_type,
+            'useNotifications': True,
+            'notifications': [{
+                'start': '%02d:%02d' % (i % 24, i % 60),
+                'end': '%02d:%02d' % (i % 24, 59),
+                'random': i % 10 == 0
+            }, {
+                'start': '%02d:30' % ((i + 12) % 24),
+                'end': None,
+                'random': False
+            }],
+            'reminder': {'valid': i % 3 == 0, 'days': 1, 'time': '09:00'}
+        },
+        'schedule': {
+            'start': start.timestamp() * 1000,
+            'end': (start + datetime.timedelta(days=90)).timestamp() * 1000,
+            'year': [start.year],
+            'month': [start.month - 1],
+            'dayOfMonth': [start.day],
+            'dayOfWeek': [start.isoweekday() % 7]
+        }
+    }
+
+
+def benchmark(events, batchSize):
+    model = EventsModel()
+    applet_id = ObjectId()
+    query = {'applet_id': applet_id}
+    docs = [synthetic_event(applet_id, i) for i in range(events)]
+
+    start = time.time()
+    for event in docs:
+        build_triggers(event)
+    elapsed = time.time() - start
+    print('triggers: %d events, %.2fs, %.0f events/s' % (events, elapsed, events / elapsed))
+
+    for i in range(0, events, batchSize):
+        model.collection.insert_many(docs[i:i + batchSize])
+
+    try:
+        sample = list(model.find(query, fields=EVENT_FIELDS, limit=min(events, 1000)))
+        start = time.time()
+        for event in sample:
+            model.setSchedule(event)
+            model.save(event)
+        elapsed = time.time() - start
+        print('one by one: %d events, %.2fs, %.0f events/s' % (
+            len(sample), elapsed, len(sample) / elapsed))
+
+        start = time.time()
+        count = reschedule(query, batchSize)
+        elapsed = time.time() - start
+        print('bulk: %d events, %.2fs, %.0f events/s' % (count, elapsed, count / elapsed))
+    finally:
+        events = [dict(event, data={}) for event in model.find(query, fields=['_id'])]
+        for i in range(0, len(events), batchSize):
+            model.rescheduleEvents(events[i:i + batchSize])
+        model.removeWithQuery(query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reschedule event notifications')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--benchmark', type=int, default=0, metavar='EVENTS')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.batch_size)
+        return
 
-model = EventsModel()
-events = model.find({})
+    start = time.time()
+    count = reschedule(batchSize=args.batch_size)
+    print('rescheduled %d events in %.2fs' % (count, time.time() - start))
 
-for event in events:
-    model.setSchedule(event)
-    model.save(event)
 
+if __name__ == '__main__':
+    main()
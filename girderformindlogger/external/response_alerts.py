@@ -0,0 +1,149 @@
+import json
+import os
+import socket
+import time
+
+from girderformindlogger import logger
+from girderformindlogger.models import getRedisConnection
+from girderformindlogger.models.response_alerts import ResponseAlerts, ALERT_QUEUE_KEY
+from girderformindlogger.utility import reconnect
+
+PROCESSING_KEY = 'responseAlerts:processing:{}'
+# Set while the worker of the processing list with the same name is alive.
+HEARTBEAT_KEY = 'responseAlerts:worker:{}'
+# Entries which could not be delivered after `MAX_ATTEMPTS` tries.
+DEAD_LETTER_KEY = 'responseAlerts:dead'
+
+# Alerts queued within this many seconds of each other are sent as one digest.
+DIGEST_WINDOW = 60
+BATCH_SIZE = 500
+# Seconds to wait before retrying entries which could not be delivered.
+RETRY_DELAY = 30
+MAX_ATTEMPTS = 20
+# Seconds after which the entries of a worker without heartbeat are queued again.
+HEARTBEAT_TTL = 600
+
+
+class ResponseAlertWorker(object):
+    """
+    Saves and sends the alerts queued by `ResponseAlerts.queueResponseAlerts`.
+
+    The worker waits for the first queued entry, lets the digest window pass
+    and then takes up to `batchSize` entries at once. Entries are moved to a
+    list owned by the worker while they are processed. Workers refresh a
+    heartbeat, and the lists of workers whose heartbeat expired are queued
+    again by the other workers, so the entries of a worker that died are not
+    lost even though a restarted worker has a new name.
+    """
+
+    def __init__(self, connection=None, name=None, window=DIGEST_WINDOW, batchSize=BATCH_SIZE,
+                 retryDelay=RETRY_DELAY, maxAttempts=MAX_ATTEMPTS, heartbeatTTL=HEARTBEAT_TTL):
+        self.connection = connection or getRedisConnection()
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.processing = PROCESSING_KEY.format(self.name)
+        self.window = window
+        self.batchSize = batchSize
+        self.retryDelay = retryDelay
+        self.maxAttempts = maxAttempts
+        self.heartbeatTTL = heartbeatTTL
+        self.lastReap = 0
+
+    def heartbeat(self):
+        self.connection.set(HEARTBEAT_KEY.format(self.name), 1, ex=self.heartbeatTTL)
+
+    def recover(self, processing=None):
+        while self.connection.rpoplpush(processing or self.processing, ALERT_QUEUE_KEY):
+            pass
+
+    def reap(self):
+        """
+        Queue again the entries of the workers whose heartbeat expired.
+        """
+        prefix = PROCESSING_KEY.format('')
+        for processing in self.connection.scan_iter(match=prefix + '*'):
+            if isinstance(processing, bytes):
+                processing = processing.decode('utf8')
+            name = processing[len(prefix):]
+            if name != self.name and not self.connection.exists(HEARTBEAT_KEY.format(name)):
+                logger.warning('Queueing again the response alerts of worker %s', name)
+                self.recover(processing)
+        self.lastReap = time.time()
+
+    def claim(self, timeout=5):
+        self.heartbeat()
+        first = self.connection.brpoplpush(ALERT_QUEUE_KEY, self.processing, timeout)
+        if not first:
+            return []
+
+        time.sleep(self.window)
+        self.heartbeat()
+        pipe = self.connection.pipeline(transaction=False)
+        for _ in range(self.batchSize - 1):
+            pipe.rpoplpush(ALERT_QUEUE_KEY, self.processing)
+
+        return [json.loads(entry) for entry in [first] + pipe.execute() if entry]
+
+    def retry(self, entries):
+        """
+        Queue failed entries again, or move them to the dead letter list once
+        they failed `maxAttempts` times, and release the processing list.
+        """
+        pipe = self.connection.pipeline(transaction=True)
+        for entry in entries:
+            entry['attempts'] = entry.get('attempts', 0) + 1
+            if entry['attempts'] >= self.maxAttempts:
+                logger.error('Giving up the response alerts of profile %s after %d attempts',
+                             entry.get('profileId'), entry['attempts'])
+                pipe.lpush(DEAD_LETTER_KEY, json.dumps(entry))
+            else:
+                pipe.lpush(ALERT_QUEUE_KEY, json.dumps(entry))
+        pipe.delete(self.processing)
+        pipe.execute()
+
+    def process(self, model):
+        """
+        Deliver one batch of queued alerts. If the batch fails, its entries
+        are delivered one by one, so that a bad entry does not hold back the
+        others; the entries which still fail are retried after `retryDelay`
+        seconds.
+        """
+        entries = self.claim()
+        if not entries:
+            return
+
+        try:
+            model.deliverQueuedAlerts(entries)
+        except Exception:
+            logger.exception('Could not deliver a batch of %d response alerts, '
+                             'delivering them one by one', len(entries))
+            failed = []
+            for entry in entries:
+                try:
+                    model.deliverQueuedAlerts([entry])
+                except Exception:
+                    logger.exception('Could not deliver the response alerts of profile %s',
+                                     entry.get('profileId'))
+                    failed.append(entry)
+            self.retry(failed)
+            if failed:
+                time.sleep(self.retryDelay)
+        else:
+            self.connection.delete(self.processing)
+
+    def run(self):
+        self.recover()
+        model = ResponseAlerts()
+
+        while True:
+            if time.time() - self.lastReap > self.heartbeatTTL:
+                self.reap()
+            self.process(model)
+
+
+@reconnect(name='ResponseAlertWorker')
+def start():
+    ResponseAlertWorker().run()
+
+
+if __name__ == '__main__':
+    start()
@@ -38,6 +38,23 @@ class AccountProfile(AccessControlledModel):
 
         return document
 
+    def save(self, document, *args, **kwargs):
+        """
+        Save an account profile and update the applet memberships of its user.
+        """
+        from girderformindlogger.models.applet_membership import AppletMembership
+
+        document = super(AccountProfile, self).save(document, *args, **kwargs)
+        if document.get('accountId'):
+            AppletMembership().syncProfile(document)
+        return document
+
+    def remove(self, document, **kwargs):
+        from girderformindlogger.models.applet_membership import AppletMembership
+
+        super(AccountProfile, self).remove(document, **kwargs)
+        AppletMembership().removeProfile(document)
+
     def validateDBURL(self, db_uri: str):
         match = re.fullmatch(r'^mongodb://\w+:\w+@\w+:\d+/\w+', db_uri)
         # if not match:
@@ -41,8 +41,9 @@ from girderformindlogger.models.group import Group as GroupModel
 from girderformindlogger.models.item import Item as ItemModel
 from girderformindlogger.models.profile import Profile
 from girderformindlogger.models.user import User as UserModel
-from girderformindlogger.utility import mail_utils, theme
+from girderformindlogger.utility import mail_utils, role_resolver, theme
 from girderformindlogger.utility.redis import cache
+from girderformindlogger.utility.versions import versionKey
 
 RETENTION_SET = {
     'day': 1,
@@ -57,6 +58,27 @@ class Applet(FolderModel):
     Applets are access-controlled Folders, each of which links to an
     Protocol and contains any relevant constraints.
     """
+    def save(self, document, *args, **kwargs):
+        """
+        Save an applet and copy its update time and cache id to the applet
+        memberships.
+        """
+        from girderformindlogger.models.applet_membership import AppletMembership
+
+        document = super(Applet, self).save(document, *args, **kwargs)
+        if document.get('meta', {}).get('applet') is not None:
+            AppletMembership().syncApplets([document])
+        return document
+
+    def update(self, query, update, multi=True):
+        from girderformindlogger.models.applet_membership import AppletMembership
+
+        result = super(Applet, self).update(query, update, multi)
+        fields = update.get('$set', {})
+        if 'updated' in fields or 'cached' in fields:
+            AppletMembership().syncApplets(self.find(query, fields=['updated', 'cached']))
+        return result
+
     def createApplet(
         self,
         name,
@@ -584,6 +606,7 @@ class Applet(FolderModel):
         from girderformindlogger.utility import mail_utils
         from girderformindlogger.models.group import Group
         from girderformindlogger.models.response_folder import ResponseItem
+        from girderformindlogger.models.response_statistics import ResponseStatistics
         from girderformindlogger.models.invitation import Invitation
         from girderformindlogger.utility import jsonld_expander
 
@@ -630,6 +653,10 @@ class Applet(FolderModel):
 
             Profile().remove(user)
 
+        ResponseStatistics().removeResponses({
+            "baseParentType": 'user',
+            "meta.applet.@id": applet['_id']
+        })
         ResponseItem().removeWithQuery(
             query={
                 "baseParentType": 'user',
@@ -979,6 +1006,7 @@ class Applet(FolderModel):
             currentApplet = applet
         )
         applet['meta']['applet']['version'] = protocol['schema:schemaVersion'][0].get('@value', '0.0.0') if 'schema:schemaVersion' in protocol else '0.0.0'
+        applet['meta']['applet']['versionKey'] = versionKey(applet['meta']['applet']['version'])
         applet['meta']['applet'].update(Protocol().getImageAndDescription(protocol))
         applet['updated'] = now
 
@@ -1223,6 +1251,7 @@ class Applet(FolderModel):
 
         applet['meta']['applet']['editing'] = False
         applet['meta']['applet']['version'] = content.get('schema:version', '0.0.0')
+        applet['meta']['applet']['versionKey'] = versionKey(applet['meta']['applet']['version'])
 
         self.setMetadata(applet, applet['meta'])
 
@@ -1552,11 +1581,8 @@ class Applet(FolderModel):
     def isCoordinator(self, appletId, user):
 
         try:
-            user = Profile()._canonicalUser(appletId, user)
-            return(any([
-                self._hasRole(appletId, user, 'coordinator'),
-                self.isManager(appletId, user)
-            ]))
+            roles = role_resolver.getAppletRoles(appletId, user)
+            return 'coordinator' in roles or 'manager' in roles
         except:
             return(False)
 
@@ -1570,11 +1596,7 @@ class Applet(FolderModel):
         return self._hasRole(appletId, user, 'reviewer')
 
     def _hasRole(self, appletId, user, role):
-
-        user = Profile()._canonicalUser(appletId, user)
-        profile = Profile().findOne({'appletId': ObjectId(appletId), 'userId': user['_id']})
-
-        return (profile and not profile.get('deactivated', False) and role in profile.get('roles', []))
+        return role_resolver.hasRole(appletId, user, role)
 
     def getAppletsForGroup(self, role, groupId, active=True):
         """
@@ -1677,34 +1699,16 @@ class Applet(FolderModel):
         :type active: bool
         :returns: list of dicts
         """
-        user = UserModel().load(
-            id=ObjectId(user["userId"]),
-            force=True
-        ) if "userId" in user else UserModel().load(
-            id=ObjectId(user["_id"]),
-            force=True
-        ) if "_id" in user else user
+        appletIds = role_resolver.getAppletIds(
+            user['userId'] if 'userId' in user else user['_id'], role, active)
 
-        query = {
-            'userId': user['_id'],
-            'profile': True,
-            'roles': role
+        applets = {
+            applet['_id']: applet for applet in self.find({
+                '_id': {'$in': appletIds}
+            }, fields=['_id'] if idOnly else None)
         }
 
-        if active:
-            query['deactivated'] = {
-                '$ne': True
-            }
-
-        profiles = list(Profile().find(query))
-
-        applets = []
-        for profile in profiles:
-            applets.append(self.findOne({
-                '_id': profile['appletId']
-            }, fields = ['_id'] if idOnly else None))
-
-        return(applets)
+        return([applets[appletId] for appletId in appletIds if appletId in applets])
 
     def listUsers(self, applet, role, user=None, force=False):
         if not force:
@@ -1736,10 +1740,21 @@ class Applet(FolderModel):
         retrieveLastResponseTime=False,
         localInfo={},
         nextActivity=None,
-        bufferSize=None
+        bufferSize=None,
+        manifest=False
     ):
+        """
+        Format an applet for the app or the admin panel.
+
+        :param manifest: Instead of the formatted activities and items, return
+            in ``content`` the hash of the content bundle of every activity,
+            which is served by ``GET /applet/content/{hash}``.
+        :returns: ``(nextIRI, formatted, bufferSize)``, where `nextIRI` is the
+            activity to continue from when the buffer is full.
+        """
         from girderformindlogger.utility import jsonld_expander
         from girderformindlogger.utility.response import last7Days
+        from girderformindlogger.models.applet_content import AppletContent
         from girderformindlogger.models.protocol import Protocol
 
         formatted = {}
@@ -1749,7 +1764,7 @@ class Applet(FolderModel):
             localVersion = localInfo.get('appletVersion', None)
             updates = None
 
-            if localVersion:
+            if localVersion and not manifest:
                 (isInitialVersion, updates) = Protocol().compareProtocols(
                     applet.get('meta', {}).get('protocol', {}).get('_id', '').split('/')[-1],
                     localVersion,
@@ -1798,7 +1813,10 @@ class Applet(FolderModel):
             formatted['removedActivities'] = []
             formatted['removedItems'] = []
 
-            if not localVersion or isInitialVersion:
+            if manifest:
+                formatted['content'] = AppletContent().activityManifest(
+                    formatted['activities'], applet['_id'])
+            elif not localVersion or isInitialVersion:
                 currentVersion = formatted['applet'].get('schema:schemaVersion', [])
 
                 if len(currentVersion):
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+from girderformindlogger.models.cache import Cache as CacheModel
+from girderformindlogger.models.model_base import Model
+from girderformindlogger.utility import JsonEncoder
+
+
+class AppletContent(Model):
+    """
+    Immutable, content-addressed bundles of formatted applet content. Each
+    bundle is stored once under the sha256 of its serialized JSON, so it can
+    be served with a strong ETag and cached indefinitely by clients.
+
+    A bundle remembers the cache entries (id and update time) it was built
+    from, so an unchanged activity is never formatted twice.
+    """
+
+    def initialize(self):
+        self.name = 'appletContent'
+        self.ensureIndices([
+            ([('sources', ASCENDING)], {}),
+        ])
+
+    def validate(self, document):
+        return document
+
+    def put(self, data, source=None, appletId=None):
+        """
+        Store a bundle.
+
+        :param data: The content, which must be JSON-serializable.
+        :param source: A key identifying what the content was built from.
+        :type source: str
+        :param appletId: The applet the content belongs to. Only the users of
+            the applets of a bundle can read it.
+        :returns: The hash of the bundle.
+        """
+        body = json.dumps(data, sort_keys=True, allow_nan=False, cls=JsonEncoder).encode('utf8')
+        contentHash = hashlib.sha256(body).hexdigest()
+
+        update = {
+            '$setOnInsert': {
+                'data': Binary(body),
+                'size': len(body),
+                'created': datetime.datetime.utcnow()
+            }
+        }
+        addToSet = {}
+        if source:
+            addToSet['sources'] = source
+        if appletId:
+            addToSet['applets'] = ObjectId(appletId)
+        if addToSet:
+            update['$addToSet'] = addToSet
+
+        self.collection.update_one({'_id': contentHash}, update, upsert=True)
+        return contentHash
+
+    def activityManifest(self, activities, appletId=None):
+        """
+        Get the bundle hash of the formatted content (activity and items) of
+        activities, building the bundles of the activities that changed.
+
+        Activities are formatted with `formatLdObject` like the paged applet
+        content, so a bundle holds the same activity and items. Activities
+        without a cache are formatted (and cached) on the way.
+
+        :param activities: The activity ids, keyed by activity IRI.
+        :type activities: dict
+        :param appletId: The applet of the activities.
+        :returns: The bundle hashes, keyed by activity IRI.
+        """
+        from girderformindlogger.models.activity import Activity as ActivityModel
+        from girderformindlogger.utility.jsonld_expander import formatLdObject
+
+        def bundle(formatted):
+            formatted = formatted or {}
+            return {
+                'activity': formatted.get('activity', {}),
+                'items': formatted.get('items', {})
+            }
+
+        cached = {
+            activity['_id']: activity for activity in ActivityModel().find({
+                '_id': {'$in': [ObjectId(activityId) for activityId in activities.values()]}
+            }, fields=['cached', 'meta.schema'])
+        }
+        cacheUpdated = {
+            cache['_id']: cache['updated'] for cache in CacheModel().find({
+                '_id': {'$in': [
+                    ObjectId(activity['cached']) for activity in cached.values()
+                    if activity.get('cached')
+                ]}
+            }, fields=['updated'])
+        }
+
+        sources = {}
+        manifest = {}
+        for activityIRI, activityId in activities.items():
+            activity = cached.get(ObjectId(activityId))
+            if not activity:
+                continue
+
+            cacheId = activity.get('cached')
+            if cacheId and ObjectId(cacheId) in cacheUpdated:
+                sources[activityIRI] = '%s:%s' % (
+                    cacheId, cacheUpdated[ObjectId(cacheId)].isoformat())
+            else:
+                activity = ActivityModel().findOne({'_id': ObjectId(activityId)})
+                activity.pop('cached', None)
+                manifest[activityIRI] = self.put(
+                    bundle(formatLdObject(activity, 'activity')), appletId=appletId)
+
+        hashes = {}
+        for content in self.find({'sources': {'$in': list(sources.values())}}, fields=['sources']):
+            for source in content['sources']:
+                hashes[source] = content['_id']
+
+        for activityIRI, source in sources.items():
+            if source not in hashes:
+                activity = cached[ObjectId(activities[activityIRI])]
+                hashes[source] = self.put(
+                    bundle(formatLdObject(activity, 'activity')), source, appletId)
+            manifest[activityIRI] = hashes[source]
+
+        if appletId and manifest:
+            self.collection.update_many({
+                '_id': {'$in': list(set(manifest.values()))},
+                'applets': {'$ne': ObjectId(appletId)}
+            }, {'$addToSet': {'applets': ObjectId(appletId)}})
+
+        return manifest
+
+    def canRead(self, content, user):
+        """
+        Whether a user has an active role on one of the applets of a bundle.
+        """
+        from girderformindlogger.utility import role_resolver
+
+        return any(
+            role_resolver.getAppletRoles(appletId, user)
+            for appletId in content.get('applets', [])
+        )
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DeleteMany, UpdateMany, UpdateOne
+
+from girderformindlogger.models.model_base import Model
+
+
+class AppletMembership(Model):
+    """
+    Denormalised index of the applets of each account profile: one document
+    per (user, account, applet) with the roles of the user on the applet, and
+    the update time and cache id of the applet.
+
+    It is maintained from `AccountProfile.save` / `remove` (role grants and
+    revocations) and from applet writes, so that the applets of a user with a
+    given role can be listed with a single indexed query. Every indexed
+    account profile also has a marker document without applet, so account
+    profiles saved before the index existed can be told apart.
+    """
+
+    def initialize(self):
+        self.name = 'appletMembership'
+        self.ensureIndices([
+            ([('userId', ASCENDING), ('accountId', ASCENDING), ('appletId', ASCENDING)],
+             {'unique': True}),
+            ([('userId', ASCENDING), ('roles', ASCENDING), ('created', ASCENDING)], {}),
+            'appletId',
+        ])
+
+    def validate(self, document):
+        return document
+
+    def syncProfile(self, profile):
+        """
+        Update the memberships of an account profile to match its applets.
+
+        :param profile: The account profile.
+        :type profile: dict
+        """
+        from girderformindlogger.models.folder import Folder
+
+        roles = {}
+        for role, appletIds in (profile.get('applets') or {}).items():
+            for appletId in appletIds or []:
+                roles.setdefault(ObjectId(appletId), []).append(role)
+
+        applets = {
+            applet['_id']: applet for applet in Folder().find(
+                {'_id': {'$in': list(roles)}}, fields=['updated', 'cached'])
+        } if roles else {}
+
+        now = datetime.datetime.utcnow()
+        requests = [
+            UpdateOne({
+                'userId': profile['userId'],
+                'accountId': profile['accountId'],
+                'appletId': appletId
+            }, {
+                '$set': {
+                    'roles': sorted(appletRoles),
+                    'updated': applets.get(appletId, {}).get('updated'),
+                    'cached': applets.get(appletId, {}).get('cached'),
+                    'synced': now
+                },
+                '$setOnInsert': {'created': now}
+            }, upsert=True)
+            for appletId, appletRoles in roles.items()
+        ]
+        requests.append(UpdateOne({
+            'userId': profile['userId'],
+            'accountId': profile['accountId'],
+            'appletId': None
+        }, {
+            '$set': {'synced': now},
+            '$setOnInsert': {'created': now}
+        }, upsert=True))
+        requests.append(DeleteMany({
+            'userId': profile['userId'],
+            'accountId': profile['accountId'],
+            'appletId': {'$nin': list(roles) + [None]}
+        }))
+        self.collection.bulk_write(requests, ordered=False)
+
+    def syncAccounts(self, userId, accountId=None):
+        """
+        Index the account profiles of a user which are not indexed yet, i.e.
+        which were last saved before the index existed.
+
+        :param userId: The user id.
+        :param accountId: Only check this account, or None for every account.
+        """
+        from girderformindlogger.models.account_profile import AccountProfile
+
+        query = {'userId': userId}
+        if accountId is not None:
+            query['accountId'] = ObjectId(accountId)
+
+        indexed = {
+            marker['accountId'] for marker in self.find(
+                dict(query, appletId=None), fields=['accountId'])
+        }
+        missing = [
+            profile['_id'] for profile in AccountProfile().find(query, fields=['accountId'])
+            if profile.get('accountId') and profile['accountId'] not in indexed
+        ]
+        if missing:
+            for profile in AccountProfile().find(
+                    {'_id': {'$in': missing}}, fields=['userId', 'accountId', 'applets']):
+                self.syncProfile(profile)
+
+    def removeProfile(self, profile):
+        self.removeWithQuery({'userId': profile['userId'], 'accountId': profile['accountId']})
+
+    def syncApplets(self, applets):
+        """
+        Copy the update time and cache id of applets to their memberships.
+
+        :param applets: The applets, with their updated and cached fields.
+        :type applets: iterable of dict
+        """
+        requests = [
+            UpdateMany({'appletId': applet['_id']}, {'$set': {
+                'updated': applet.get('updated'),
+                'cached': applet.get('cached')
+            }}) for applet in applets
+        ]
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+
+    def getApplets(self, userId, role, accountId=None):
+        """
+        List the memberships of a user with a role, in the order they were
+        granted.
+
+        :param userId: The user id.
+        :param role: The role.
+        :param accountId: The account to list, or None for every account.
+        :returns: The memberships (appletId, updated and cached).
+        """
+        query = {'userId': userId, 'roles': role}
+        if accountId is not None:
+            query['accountId'] = ObjectId(accountId)
+
+        return self.find(
+            query, fields=['appletId', 'updated', 'cached'],
+            sort=[('created', ASCENDING), ('appletId', ASCENDING)])
+
+    def updatedSince(self, userId, role, since, accountId=None):
+        """
+        Whether any applet of a user with a role was updated after a time.
+
+        :param since: The time.
+        :type since: datetime.datetime
+        """
+        query = {'userId': userId, 'roles': role, 'updated': {'$gt': since}}
+        if accountId is not None:
+            query['accountId'] = ObjectId(accountId)
+
+        return self.findOne(query, fields=['_id']) is not None
+
+    def rebuild(self):
+        """
+        Rebuild the index from every account profile. Memberships are upserted
+        in place, so the index stays readable while it is rebuilt, and the
+        memberships of account profiles which no longer exist are removed at
+        the end.
+
+        :returns: The number of account profiles indexed.
+        """
+        from girderformindlogger.models.account_profile import AccountProfile
+
+        started = datetime.datetime.utcnow()
+        count = 0
+        for profile in AccountProfile().find({}, fields=['userId', 'accountId', 'applets']):
+            self.syncProfile(profile)
+            count += 1
+
+        self.collection.delete_many({'$or': [
+            {'synced': {'$lt': started}},
+            {'synced': {'$exists': False}}
+        ]})
+        return count
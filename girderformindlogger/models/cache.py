@@ -63,6 +63,23 @@ class Cache(Model):
             return json_util.loads(document.get('cache_data'))
         return None
 
+    def getCachesData(self, ids):
+        """
+        Load the data of several caches with one query.
+
+        :param ids: The cache ids.
+        :returns: dict of cache id (as a string) to its data.
+        """
+        ids = [ObjectId(_id) for _id in ids if _id]
+        if not ids:
+            return {}
+
+        return {
+            str(document['_id']): json_util.loads(document['cache_data'])
+            if document.get('cache_data') else None
+            for document in self.find({'_id': {'$in': ids}})
+        }
+
     def getFromSourceID(self, collection_name, source_id):
         document = self.findOne(query={'collection_name': collection_name, 'source_id': source_id})
         if document.get('cache_data'):
@@ -10,13 +10,17 @@ from girderformindlogger import events
 from girderformindlogger.constants import AccessType
 from girderformindlogger.exceptions import ValidationException, GirderException
 from girderformindlogger.external.notification import send_notification
+from girderformindlogger.models import getRedisConnection
 from girderformindlogger.models.model_base import AccessControlledModel, Model
 from girderformindlogger.models.push_notification import PushNotification as PushNotificationModel
 from girderformindlogger.models.profile import Profile
 from girderformindlogger.models.folder import Folder
 from girderformindlogger.utility.model_importer import ModelImporter
 from girderformindlogger.utility.progress import noProgress, setResponseTimeLimit
+from girderformindlogger.utility.recurrence import build_triggers
+from girderformindlogger.utility.timing_wheel import TimingWheel
 from bson import json_util
+from pymongo import DeleteMany, InsertOne, ReplaceOne, UpdateOne
 from girderformindlogger.models.profile import Profile as ProfileModel
 from dateutil.relativedelta import relativedelta
 import calendar
@@ -92,36 +96,11 @@ class Events(Model):
             self.deleteEvent(event.get('_id'))
 
     def upsertEvent(self, event, applet, event_id=None):
-        newEvent = {
-            'applet_id': applet['_id'],
-            'individualized': False,
-            'schedulers': [],
-            'sendTime': [],
-            'data': {}
-        }
         existed_event = self.findOne({'_id': ObjectId(event_id)}, fields=['_id', 'schedulers', 'data'])
+        newEvent = self._eventDocument(event, applet, existed_event if event_id else None)
 
-        if event_id and existed_event:
-            newEvent['_id'] = ObjectId(event_id)
-            newEvent['schedulers'] = existed_event.get('schedulers', [])
-
-        if 'data' in event:
-            newEvent['data'] = event['data']
-
-            if 'activity_id' in newEvent['data']:
-                newEvent['data']['activity_id'] = ObjectId(newEvent['data']['activity_id'])
-
-            if 'activity_flow_id' in newEvent['data']:
-                newEvent['data']['activity_flow_id'] = ObjectId(newEvent['data']['activity_flow_id'])
-
-            if 'users' in event['data'] and isinstance(event['data']['users'], list):
-                newEvent['individualized'] = True
-                event['data']['users'] = [ObjectId(profile_id) for profile_id in event['data']['users']]
-
-                self.updateIndividualSchedulesParameter(newEvent, existed_event)
-
-        if 'schedule' in event:
-            newEvent['schedule'] = event['schedule']
+        if newEvent['individualized']:
+            self.updateIndividualSchedulesParameter(newEvent, existed_event)
 
         newEvent['updated'] = datetime.datetime.utcnow()
 
@@ -133,27 +112,21 @@ class Events(Model):
         return newEvent
 
     def notify_user_about_event_changes(self, event_list, applet, previous_device_ids=None):
-        if previous_device_ids is None:
-            previous_device_ids = []
-        device_ids = set()
-        if event_list:
-            for event in event_list:
-                if event['data'].get('users'):
-                    device_ids.update(
-                        self.get_applet_device_ids(applet['_id'], event['data']['users'])
-                    )
-                else:
-                    device_ids.update(self.get_applet_device_ids(applet['_id']))
-        else:
-            current_device_ids = self.get_applet_device_ids(applet['_id'])
-            for current_device_id in current_device_ids:
-                device_ids.add(current_device_id)
+        users = set()
+        for event in event_list or []:
+            if not event['data'].get('users'):
+                users = None
+                break
+            users.update(event['data']['users'])
+
+        # The device ids of all the users are loaded with a single query.
+        device_ids = self.get_applet_device_ids(applet['_id'], list(users) if users else None)
         if device_ids:
             send_notification(
                 'Tap to update the schedule.',
                 'Your schedule has been changed, tap to update.',
                 'schedule-updated',
-                list(device_ids)
+                device_ids
             )
 
     @staticmethod
@@ -226,16 +199,215 @@ class Events(Model):
 
         return events
 
-    def setSchedule(self, event):
-        push_notification = PushNotificationModel(event=event)
-        push_notification.remove_schedules()
+    @staticmethod
+    def hasNotifications(event):
         useNotifications = event.get('data', {}).get('useNotifications', False)
         notifications = event.get('data', {}).get('notifications', [])
         hasNotifications = len(notifications) > 0
 
-        if useNotifications and hasNotifications and (event['data'].get('reminder', {}).get('valid', False) or notifications[0]['start']):
+        return bool(useNotifications and hasNotifications and (
+            event['data'].get('reminder', {}).get('valid', False) or notifications[0]['start']))
+
+    def setSchedule(self, event):
+        push_notification = PushNotificationModel(event=event)
+        push_notification.remove_schedules()
+
+        if self.hasNotifications(event):
             push_notification.set_schedules()
 
+    def rescheduleEvents(self, events, now=None):
+        """
+        Recompute the notification triggers of many events at once. The timing
+        wheel is updated with pipelined redis commands and the send times are
+        saved with a single bulk write.
+
+        :param events: The events to reschedule, with at least their
+            ``data``, ``schedule`` and ``schedulers`` fields.
+        :type events: list
+        :param now: The current (UTC) time, defaults to now.
+        :returns: The number of events rescheduled.
+        """
+        if not events:
+            return 0
+
+        pipe = self._scheduleNotifications(events, now=now)
+        pipe.execute()
+        self.collection.bulk_write([
+            UpdateOne({'_id': event['_id']}, {'$set': {
+                'schedulers': event['schedulers'],
+                'sendTime': event['sendTime']
+            }}) for event in events
+        ], ordered=False)
+
+        return len(events)
+
+    def _scheduleNotifications(self, events, removed=(), now=None):
+        """
+        Queue the timing wheel updates of events on a redis pipeline and set
+        their ``sendTime``. The triggers of the `removed` events are cleared.
+
+        :returns: The pipeline, to be executed by the caller.
+        """
+        now = now or datetime.datetime.utcnow()
+        connection = getRedisConnection()
+        pipe = connection.pipeline(transaction=False)
+        schedules = []
+
+        for event, remove in [(event, False) for event in events] + [(event, True) for event in removed]:
+            triggers, sendTime = build_triggers(event, now) \
+                if not remove and self.hasNotifications(event) else ([], [])
+            schedules.append((event['_id'], triggers))
+
+            # Jobs created before the timing wheel was introduced.
+            for job in event.get('schedulers') or []:
+                pipe.zrem('rq:scheduler:scheduled_jobs', job)
+                pipe.lrem('rq:queue:default', 0, job)
+                pipe.delete('rq:job:' + job)
+
+            event['schedulers'] = []
+            event['sendTime'] = sendTime
+
+        TimingWheel(connection).replace(schedules, pipe)
+        return pipe
+
+    def _eventDocument(self, event, applet, existing=None):
+        newEvent = {
+            'applet_id': applet['_id'],
+            'individualized': False,
+            'schedulers': [],
+            'sendTime': [],
+            'data': {}
+        }
+
+        if existing:
+            newEvent['_id'] = existing['_id']
+            newEvent['schedulers'] = existing.get('schedulers', [])
+
+        if 'data' in event:
+            newEvent['data'] = event['data']
+
+            if 'activity_id' in newEvent['data']:
+                newEvent['data']['activity_id'] = ObjectId(newEvent['data']['activity_id'])
+
+            if 'activity_flow_id' in newEvent['data']:
+                newEvent['data']['activity_flow_id'] = ObjectId(newEvent['data']['activity_flow_id'])
+
+            if 'users' in event['data'] and isinstance(event['data']['users'], list):
+                newEvent['individualized'] = True
+                event['data']['users'] = [ObjectId(profile_id) for profile_id in event['data']['users']]
+
+        if 'schedule' in event:
+            newEvent['schedule'] = event['schedule']
+
+        return newEvent
+
+    def replaceSchedule(self, applet, events, deleted=None, rewrite=False):
+        """
+        Save the events of an applet schedule in one pass. The incoming
+        events are compared with the stored ones: unchanged events are left
+        alone, the others are inserted, replaced or deleted with a single bulk
+        write, their notifications are rescheduled in one batch and the
+        individual event counters of the affected profiles are recomputed with
+        one aggregation.
+
+        :param applet: The applet.
+        :param events: The events to save. Events with the ``id`` of a stored
+            event replace it; the ``id`` of new events is set.
+        :type events: list
+        :param deleted: Ids of events to delete.
+        :param rewrite: Whether the stored events missing from `events` are
+            deleted.
+        :returns: The inserted, changed and deleted events.
+        """
+        stored = {
+            event['_id']: event for event in self.find({'applet_id': applet['_id']}, fields=[
+                '_id', 'schedulers', 'data', 'schedule', 'individualized'
+            ])
+        }
+
+        if rewrite:
+            assigned = {event.get('id') for event in events}
+            removed = [event for event_id, event in stored.items() if event_id not in assigned]
+        else:
+            deleted = {ObjectId(event_id) for event_id in deleted or []}
+            removed = [event for event_id, event in stored.items() if event_id in deleted]
+
+        now = datetime.datetime.utcnow()
+        changed = []
+        ops = []
+        for event in events:
+            existing = stored.get(event.get('id'))
+            newEvent = self._eventDocument(event, applet, existing)
+
+            if existing and all(
+                    newEvent.get(key) == existing.get(key)
+                    for key in ('data', 'schedule', 'individualized')):
+                continue
+
+            newEvent['updated'] = now
+            if not existing:
+                newEvent['_id'] = ObjectId()
+                event['id'] = newEvent['_id']
+            changed.append((newEvent, existing))
+
+        pipe = self._scheduleNotifications(
+            [newEvent for newEvent, _ in changed], removed, now)
+
+        for newEvent, existing in changed:
+            ops.append(ReplaceOne({'_id': newEvent['_id']}, newEvent) if existing
+                       else InsertOne(newEvent))
+        if removed:
+            ops.append(DeleteMany({'_id': {'$in': [event['_id'] for event in removed]}}))
+
+        if not ops:
+            return []
+
+        self.collection.bulk_write(ops, ordered=False)
+        pipe.execute()
+
+        if removed:
+            ProfileModel().update(query={
+                'appletId': applet['_id']
+            }, update={
+                '$unset': {
+                    f'finished_events.{str(event["_id"])}': '' for event in removed
+                }
+            })
+
+        affected = set()
+        for event in removed + [e for pair in changed for e in pair if e]:
+            affected.update(event.get('data', {}).get('users', []) if event.get('individualized') else [])
+        self.updateIndividualEventCounts(applet['_id'], affected)
+
+        return [newEvent for newEvent, _ in changed] + removed
+
+    def updateIndividualEventCounts(self, applet_id, profile_ids):
+        """
+        Recompute the number of individualized events of some profiles of an
+        applet.
+        """
+        if not profile_ids:
+            return
+
+        counts = {
+            row['_id']: row['count'] for row in self.collection.aggregate([
+                {'$match': {
+                    'applet_id': applet_id,
+                    'individualized': True,
+                    'data.users': {'$in': list(profile_ids)}
+                }},
+                {'$unwind': '$data.users'},
+                {'$match': {'data.users': {'$in': list(profile_ids)}}},
+                {'$group': {'_id': '$data.users', 'count': {'$sum': 1}}}
+            ])
+        }
+
+        ProfileModel().collection.bulk_write([
+            UpdateOne({'_id': profile_id}, {'$set': {
+                'individual_events': counts.get(profile_id, 0)
+            }}) for profile_id in profile_ids
+        ], ordered=False)
+
     def getSchedule(self, applet_id):
         events = list(self.find({'applet_id': ObjectId(applet_id)}, fields=['data', 'schedule', 'updated']))
 
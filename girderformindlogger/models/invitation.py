@@ -232,6 +232,81 @@ class Invitation(AESEncryption):
 
         return self.save(invitation, validate=False)
 
+    def createInvitationsForSpecifiedUsers(self, applet, coordinator, invitations):
+        """
+        Create many invitations at once. Existing invitations of the same
+        users are replaced, the others are inserted in a single batch.
+
+        :param invitations: Dicts with the arguments of
+            `createInvitationForSpecifiedUser` other than applet and
+            coordinator, i.e. role, user, firstName, lastName, nickName, lang,
+            MRN, userEmail and accessibleUsers.
+        :type invitations: list
+        :returns: The invitations, in the same order.
+        """
+        from girderformindlogger.models.profile import Profile
+        from pymongo import ReplaceOne
+
+        if not invitations:
+            return []
+
+        userIds = [row['user']['_id'] for row in invitations if row.get('user')]
+        emails = [row['userEmail'] for row in invitations if not row.get('user')]
+        existing = {}
+        for invitation in self.collection.find({
+            'appletId': applet['_id'],
+            '$or': [
+                {'userId': {'$in': userIds}},
+                {'userEmail': {'$in': emails}}
+            ]
+        }, {'_id': 1, 'userId': 1, 'userEmail': 1, 'created': 1}):
+            key = invitation.get('userId') or invitation.get('userEmail')
+            existing[key] = invitation
+
+        now = datetime.datetime.utcnow()
+        invitedBy = Profile().coordinatorProfile(applet['_id'], coordinator)
+
+        documents = []
+        for row in invitations:
+            user = row.get('user')
+            previous = existing.get(user['_id'] if user else row['userEmail'])
+
+            invitation = {
+                'appletId': applet['_id'],
+                'created': previous['created'] if previous else now,
+                'inviterId': coordinator['_id'],
+                'role': row['role'],
+                'firstName': row['firstName'],
+                'lastName': row['lastName'],
+                'nickName': row.get('nickName', ''),
+                'lang': row['lang'],
+                'MRN': row.get('MRN', ''),
+                'updated': now,
+                'size': 0,
+                'userEmail': row['userEmail'],
+                'invitedBy': copy.deepcopy(invitedBy),
+                'accessibleUsers': row.get('accessibleUsers', []) if row['role'] == 'reviewer' else None
+            }
+            if previous:
+                invitation['_id'] = previous['_id']
+            if user:
+                invitation['userId'] = user['_id']
+
+            self.encryptFields(invitation, self.fields)
+            documents.append(invitation)
+
+        new = [document for document in documents if '_id' not in document]
+        replaced = [
+            ReplaceOne({'_id': document['_id']}, document)
+            for document in documents if '_id' in document
+        ]
+        if new:
+            self.collection.insert_many(new, ordered=False)
+        if replaced:
+            self.collection.bulk_write(replaced, ordered=False)
+
+        return [self.decryptFields(document, self.fields) for document in documents]
+
     def acceptInvitation(self, invitation, user, userEmail = ''): # we need to save coordinator/manager's email as plain text
         from girderformindlogger.models.applet import Applet
         from girderformindlogger.models.ID_code import IDCode
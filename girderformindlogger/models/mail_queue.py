@@ -0,0 +1,152 @@
+import datetime
+
+from pymongo import ASCENDING, ReturnDocument
+
+from girderformindlogger.models.model_base import Model
+
+
+class MailQueue(Model):
+    """
+    Persistent queue of outgoing emails. Each message keeps the delivery
+    status of every recipient so that a retry only goes to the recipients
+    which were not accepted yet.
+
+    A message being sent is leased to a worker until ``sendAfter``; if the
+    worker dies, the message is picked up again once the lease expires.
+    """
+
+    def initialize(self):
+        self.name = 'mail_queue'
+        self.ensureIndices([
+            ([('status', ASCENDING), ('sendAfter', ASCENDING)], {}),
+        ])
+
+    def validate(self, document):
+        return document
+
+    def enqueue(self, message, fromAddress, recipients):
+        """
+        Queue a message for delivery.
+
+        :param message: The serialized message.
+        :type message: str
+        :param fromAddress: The envelope sender.
+        :param recipients: The envelope recipients.
+        :type recipients: list
+        """
+        now = datetime.datetime.utcnow()
+        return self.save({
+            'message': message,
+            'fromAddress': fromAddress,
+            'recipients': [{
+                'address': address,
+                'status': 'queued'
+            } for address in recipients],
+            'status': 'queued',
+            'attempts': 0,
+            'created': now,
+            'updated': now,
+            'sendAfter': now
+        })
+
+    def claim(self, limit=1, lease=300):
+        """
+        Lease up to `limit` messages which are due for delivery.
+
+        :param lease: Seconds before the message is handed out again if the
+            worker does not report a result.
+        :returns: The claimed messages.
+        """
+        messages = []
+        for _ in range(limit):
+            now = datetime.datetime.utcnow()
+            message = self.collection.find_one_and_update({
+                'status': {'$in': ['queued', 'sending']},
+                'sendAfter': {'$lte': now}
+            }, {
+                '$set': {
+                    'status': 'sending',
+                    'sendAfter': now + datetime.timedelta(seconds=lease),
+                    'updated': now
+                },
+                '$inc': {'attempts': 1}
+            }, sort=[('sendAfter', ASCENDING)], return_document=ReturnDocument.AFTER)
+
+            if not message:
+                break
+            messages.append(message)
+        return messages
+
+    def pendingRecipients(self, message):
+        return [
+            recipient['address'] for recipient in message['recipients']
+            if recipient['status'] == 'queued'
+        ]
+
+    def markDelivered(self, message, refused=None, maxAttempts=5, backoff=30):
+        """
+        Record the result of a delivery attempt which reached the server.
+
+        :param refused: The recipients refused by the server, mapped to their
+            ``(code, response)``. Recipients refused with a permanent (5xx)
+            error are marked as failed, the others are retried.
+        :type refused: dict
+        """
+        refused = refused or {}
+        retry = False
+        for recipient in message['recipients']:
+            if recipient['status'] != 'queued':
+                continue
+
+            if recipient['address'] not in refused:
+                recipient['status'] = 'sent'
+                continue
+
+            code, response = refused[recipient['address']]
+            if isinstance(response, bytes):
+                response = response.decode('utf8', 'replace')
+            recipient['error'] = '%s %s' % (code, response)
+
+            if code >= 500 or message['attempts'] >= maxAttempts:
+                recipient['status'] = 'failed'
+            else:
+                retry = True
+
+        if retry:
+            self._retry(message, backoff)
+        elif any(recipient['status'] == 'sent' for recipient in message['recipients']):
+            self._finish(message, 'sent')
+        else:
+            self._finish(message, 'failed')
+
+    def markFailed(self, message, error, maxAttempts=5, backoff=30):
+        """
+        Record a delivery attempt which failed as a whole, e.g. because the
+        server could not be reached. The message is retried with exponential
+        backoff until `maxAttempts` is reached.
+        """
+        message['error'] = str(error)
+        if message['attempts'] < maxAttempts:
+            self._retry(message, backoff)
+            return
+
+        for recipient in message['recipients']:
+            if recipient['status'] == 'queued':
+                recipient['status'] = 'failed'
+        self._finish(message, 'failed')
+
+    def _retry(self, message, backoff):
+        delay = backoff * 2 ** (message['attempts'] - 1)
+        self._finish(
+            message, 'queued',
+            sendAfter=datetime.datetime.utcnow() + datetime.timedelta(seconds=delay))
+
+    def _finish(self, message, status, **fields):
+        fields.update({
+            'status': status,
+            'recipients': message['recipients'],
+            'updated': datetime.datetime.utcnow()
+        })
+        if message.get('error'):
+            fields['error'] = message['error']
+        self.update({'_id': message['_id']}, {'$set': fields}, multi=False)
@@ -2,15 +2,136 @@
 import datetime
 import json
 import os
+import threading
+import time
 
+import cherrypy
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from girderformindlogger import logger
 from girderformindlogger.constants import AccessType, DEFINED_RELATIONS, PROFILE_FIELDS
 from girderformindlogger.exceptions import ValidationException, AccessException
 from girderformindlogger.models.aes_encrypt import AESEncryption, AccessControlledModel
+from girderformindlogger.utility import config, role_resolver, toBool
 from girderformindlogger.utility.progress import noProgress
 from girderformindlogger.constants import USER_ROLES
 
 
+def _idVariants(id):
+    """
+    Activity (flow) ids are stored as ObjectIds by newer code and as strings
+    by older code, match both.
+    """
+    return [ObjectId(id), str(id)] if ObjectId.is_valid(id) else [id]
+
+
+class _ActivityWriteBehind(object):
+    """
+    Coalesces the activity completions of each profile and writes them with a
+    single bulk operation every `interval` seconds, so that bursty submitters
+    cost one profile update per interval instead of one per response.
+
+    The completions of a profile which could not be written are retried at
+    the next flush, and dropped after ``activity_flush_attempts`` failed
+    flushes.
+
+    Enabled with ``activity_write_behind`` in the ``[profile]`` config section.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.attempts = {}
+        self.thread = None
+
+    def enabled(self):
+        return toBool(config.getConfig().get('profile', {}).get('activity_write_behind', False))
+
+    def add(self, model, profileId, change):
+        with self.lock:
+            Profile._mergeActivityCompletion(self.pending.setdefault(profileId, {}), **change)
+
+            if self.thread is None:
+                self.model = model
+                self.interval = float(
+                    config.getConfig().get('profile', {}).get('activity_flush_interval', 1.0))
+                self.maxAttempts = int(
+                    config.getConfig().get('profile', {}).get('activity_flush_attempts', 5))
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+                cherrypy.engine.subscribe('stop', self.flush)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        ops = []
+        owners = []
+        for profileId, completion in pending.items():
+            profileOps = Profile._activityCompletionOps(profileId, completion)
+            ops.extend(profileOps)
+            owners.extend([profileId] * len(profileOps))
+        if not ops:
+            return
+
+        try:
+            self.model.collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # the other operations were applied, retry the profiles with errors
+            failed = {owners[error['index']] for error in e.details.get('writeErrors', [])}
+            self._requeue({profileId: pending[profileId] for profileId in failed})
+            self._forget(set(pending) - failed)
+            raise
+        except Exception:
+            # the operations are idempotent, so the whole batch can be retried
+            self._requeue(pending)
+            raise
+        self._forget(pending)
+
+    def _forget(self, profileIds):
+        with self.lock:
+            for profileId in profileIds:
+                self.attempts.pop(profileId, None)
+
+    def _requeue(self, failed):
+        """
+        Put back completions which could not be written, under the ones added
+        since, so the latest completion of an activity wins. The completions
+        of profiles which failed `maxAttempts` times are dropped.
+        """
+        with self.lock:
+            for profileId, completion in failed.items():
+                self.attempts[profileId] = self.attempts.get(profileId, 0) + 1
+                if self.attempts[profileId] >= self.maxAttempts:
+                    logger.error('Dropping the activity completions of profile %s after %d '
+                                 'failed writes', profileId, self.attempts.pop(profileId))
+                    continue
+
+                newer = self.pending.get(profileId, {})
+                for key in ('activities', 'flows', 'events'):
+                    if key in newer:
+                        completion.setdefault(key, {}).update(newer[key])
+                for key in ('identifiers', 'tokenTimes'):
+                    for value in newer.get(key, []):
+                        if value not in completion.setdefault(key, []):
+                            completion[key].append(value)
+                if 'updated' in newer:
+                    completion['updated'] = newer['updated']
+                self.pending[profileId] = completion
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write activity completions, retrying')
+
+
+_activityWriteBehind = _ActivityWriteBehind()
+
+
 class Profile(AESEncryption, dict):
     """
     Profiles store customizable information specific to both users and applets.
@@ -22,6 +143,7 @@ class Profile(AESEncryption, dict):
         self.ensureIndices(
             (
                 'userId',
+                'deviceId',
                 'individual_events',
                 'completed_activities',
                 'reviewers',
@@ -32,6 +154,18 @@ class Profile(AESEncryption, dict):
                     ('appletId', 1),
                     ('roles', 1),
                     ('MRN', 1),
+                ], {}),
+                ([
+                    ('timezone', 1),
+                    ('appletId', 1),
+                ], {}),
+                ([
+                    ('appletId', 1),
+                    ('userId', 1),
+                ], {}),
+                ([
+                    ('userId', 1),
+                    ('roles', 1),
                 ], {})
             )
         )
@@ -50,6 +184,14 @@ class Profile(AESEncryption, dict):
             ('cachedDisplay.manager.displayName', 64)
         ])
 
+    def save(self, document, *args, **kwargs):
+        role_resolver.profilesChanged()
+        return super(Profile, self).save(document, *args, **kwargs)
+
+    def update(self, query, update, multi=True):
+        role_resolver.profilesChanged()
+        return super(Profile, self).update(query, update, multi)
+
     def display(self, p, role):
         """
         :param p: Profile
@@ -389,6 +531,118 @@ class Profile(AESEncryption, dict):
         except ValueError as e:
             print("Error  while updating Profile")
 
+    def recordActivityCompletion(self, profileId, completedTime, activityId,
+                                 activityFlowId=None, identifier=None,
+                                 tokenTime=None, event=None):
+        """
+        Record a completed activity (or activity of a flow) on a profile with
+        targeted atomic updates instead of rewriting the whole document.
+
+        :param profileId: The _id of the subject's profile.
+        :param completedTime: When the response was received.
+        :type completedTime: datetime
+        :param activityId: The completed activity.
+        :param activityFlowId: The activity flow the activity belongs to, if any.
+        :param identifier: Subject identifier to add to the profile.
+        :param tokenTime: Time of a token update, if the response had tokens.
+        :param event: The finished event (``id`` and ``finishedTime``), if any.
+        """
+        change = {
+            'completedTime': completedTime,
+            'activityId': activityId,
+            'activityFlowId': activityFlowId,
+            'identifier': identifier,
+            'tokenTime': tokenTime,
+            'event': event
+        }
+
+        if _activityWriteBehind.enabled():
+            _activityWriteBehind.add(self, profileId, change)
+            return
+
+        completion = {}
+        self._mergeActivityCompletion(completion, **change)
+        self.collection.bulk_write(
+            self._activityCompletionOps(profileId, completion), ordered=True)
+
+    @staticmethod
+    def _mergeActivityCompletion(completion, completedTime, activityId,
+                                 activityFlowId=None, identifier=None,
+                                 tokenTime=None, event=None):
+        if activityFlowId:
+            completion.setdefault('flows', {})[activityFlowId] = (completedTime, activityId)
+        else:
+            completion.setdefault('activities', {})[activityId] = completedTime
+
+        if identifier and identifier not in completion.setdefault('identifiers', []):
+            completion['identifiers'].append(identifier)
+        if tokenTime:
+            completion.setdefault('tokenTimes', []).append(tokenTime)
+        if event:
+            completion.setdefault('events', {})[str(event['id'])] = event['finishedTime']
+
+        completion['updated'] = completedTime
+
+    @staticmethod
+    def _activityCompletionOps(profileId, completion):
+        """
+        Build the update operations for merged activity completions. Missing
+        entries are pushed first (guarded so concurrent requests can't add
+        duplicates), then every entry is set through array filters.
+        """
+        ops = []
+        update = {
+            '$set': {
+                'updated': completion['updated']
+            }
+        }
+        arrayFilters = []
+
+        for i, (activityId, completedTime) in enumerate(completion.get('activities', {}).items()):
+            ids = _idVariants(activityId)
+            ops.append(UpdateOne({
+                '_id': profileId,
+                'completed_activities.activity_id': {'$nin': ids}
+            }, {
+                '$push': {
+                    'completed_activities': {
+                        'activity_id': activityId,
+                        'completed_time': completedTime
+                    }
+                }
+            }))
+            update['$set']['completed_activities.$[a%d].completed_time' % i] = completedTime
+            arrayFilters.append({'a%d.activity_id' % i: {'$in': ids}})
+
+        for i, (activityFlowId, (completedTime, lastActivity)) in enumerate(completion.get('flows', {}).items()):
+            ids = _idVariants(activityFlowId)
+            ops.append(UpdateOne({
+                '_id': profileId,
+                'activity_flows.activity_flow_id': {'$nin': ids}
+            }, {
+                '$push': {
+                    'activity_flows': {
+                        'activity_flow_id': activityFlowId,
+                        'last_activity': lastActivity,
+                        'completed_time': completedTime
+                    }
+                }
+            }))
+            update['$set']['activity_flows.$[f%d].completed_time' % i] = completedTime
+            update['$set']['activity_flows.$[f%d].last_activity' % i] = lastActivity
+            arrayFilters.append({'f%d.activity_flow_id' % i: {'$in': ids}})
+
+        for eventId, finishedTime in completion.get('events', {}).items():
+            update['$set']['finished_events.%s' % eventId] = finishedTime
+        # sets rather than pushes, so that retried updates are idempotent
+        for key in ('identifiers', 'tokenTimes'):
+            if completion.get(key):
+                update.setdefault('$addToSet', {})[key] = {'$each': completion[key]}
+
+        ops.append(UpdateOne(
+            {'_id': profileId}, update, array_filters=arrayFilters or None))
+        return ops
+
     def updateProfileBadgets(self, profiles):
         self.increment(query={
             'userId': {
@@ -480,6 +734,7 @@ class Profile(AESEncryption, dict):
 
         # Delete this folder
         AccessControlledModel.remove(self, folder, progress=progress, **kwargs)
+        role_resolver.profilesChanged()
         if progress:
             progress.update(increment=1, message='Deleted profile %s' %
                             folder['name'])
@@ -1268,6 +1523,30 @@ class Profile(AESEncryption, dict):
             }
         ))
 
+    def get_notification_recipients(self, applet_ids, timezone, fields=None):
+        """
+        Get the profiles of all participants of the given applets which are
+        in the given timezone and have a registered device.
+
+        :param applet_ids: The applets to resolve recipients for.
+        :type applet_ids: list
+        :param timezone: The timezone bucket (hour offset).
+        :type timezone: float
+        """
+        return self.find(
+            query={
+                'appletId': {
+                    '$in': list(applet_ids)
+                },
+                'timezone': timezone,
+                'profile': True,
+                'deviceId': {
+                    '$nin': [None, '']
+                }
+            },
+            fields=fields
+        )
+
     def get_profiles_by_ids(self, profile_ids):
         return self.find(
             query={
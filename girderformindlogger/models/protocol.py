@@ -34,6 +34,7 @@ from girderformindlogger.models.account_profile import AccountProfile
 from girderformindlogger.models.user import User as UserModel
 from bson import json_util
 from girderformindlogger.utility.progress import noProgress, setResponseTimeLimit
+from girderformindlogger.utility.versions import versionKey
 from girderformindlogger.models.activity import Activity as ActivityModel
 from pymongo import DESCENDING, ASCENDING
 
@@ -396,20 +397,14 @@ class Protocol(FolderModel):
                         )
 
     def compareVersions(self, version1, version2):
-        vs1 = version1.split('.')
-        vs2 = version2.split('.')
+        key1 = versionKey(version1)
+        key2 = versionKey(version2)
 
-        for i in range(0, len(vs1)):
-            if vs1[i] < vs2[i]:
-                return -1
-            if vs1[i] > vs2[i]:
-                return 1
-
-        return 0
+        return (key1 > key2) - (key1 < key2)
 
     def getHistoryDataFromItemIRIs(self, protocolId, IRIGroup):
-        from girderformindlogger.models.item import Item as ItemModel
-        from girderformindlogger.utility import jsonld_expander
+        from girderformindlogger.models.cache import Cache as CacheModel
+        from girderformindlogger.models.protocol_history import ProtocolHistory
 
         protocol = self.load(protocolId, force=True)
 
@@ -429,47 +424,50 @@ class Protocol(FolderModel):
         if 'referenceId' not in historyFolder.get('meta', {}):
             return result
 
-        referencesFolder = FolderModel().load(historyFolder['meta']['referenceId'], force=True)
-        itemModel = ItemModel()
+        intervals = ProtocolHistory().getIntervals(historyFolder['meta']['referenceId'], IRIGroup)
 
         for IRI in IRIGroup:
-            reference = itemModel.findOne({ 'folderId': referencesFolder['_id'], 'meta.identifier': IRI })
-            if not reference:
+            if IRI not in intervals:
                 continue
 
-            history = reference['meta']['history']
-
             for version in IRIGroup[IRI]:
-                if version not in itemReferences:
-                    itemReferences[version] = {}
-
-                inserted = False
-                for i in range(0, len(history)):
-                    if self.compareVersions(version, history[i]['version']) <= 0:
-                        if not history[i].get('reference', None):
-                            continue
-
-                        if history[i]['reference'] not in items:
-                            (modelType, referenceId) = history[i]['reference'].split('/')
-                            model = MODELS()[modelType]().findOne({
-                                '_id': ObjectId(referenceId)
-                            })
-                            items[history[i]['reference']] = jsonld_expander.loadCache(model['cached'])
-
-                            activityId = str(model['meta']['activityId'])
-
-                            if activityId not in activities:
-                                activities[activityId] = jsonld_expander.loadCache(
-                                    FolderModel().load(activityId, force=True)['cached']
-                                )
-                        if history[i]['reference']:
-                            itemReferences[version][IRI] = history[i]['reference']
-                        inserted = True
+                # None is the same as latest version
+                itemReferences.setdefault(version, {})[IRI] = ProtocolHistory.resolve(
+                    intervals[IRI], version)
+
+        # load the referenced items and their activities in batches
+        referenceIds = {}
+        for references in itemReferences.values():
+            for reference in references.values():
+                if reference and reference not in items:
+                    (modelType, referenceId) = reference.split('/')
+                    referenceIds.setdefault(modelType, set()).add(ObjectId(referenceId))
+
+        models = {}
+        for modelType, ids in referenceIds.items():
+            for model in MODELS()[modelType]().find({
+                '_id': {'$in': list(ids)}
+            }, fields=['cached', 'meta.activityId']):
+                models['{}/{}'.format(modelType, model['_id'])] = model
+
+        activityIds = set(
+            model['meta']['activityId'] for model in models.values()
+            if model.get('meta', {}).get('activityId')
+            and str(model['meta']['activityId']) not in activities
+        )
+        activityModels = list(FolderModel().find({
+            '_id': {'$in': list(activityIds)}
+        }, fields=['cached'])) if activityIds else []
 
-                        break
+        caches = CacheModel().getCachesData(
+            [model['cached'] for model in models.values()] +
+            [activity['cached'] for activity in activityModels]
+        )
 
-                if not inserted:
-                    itemReferences[version][IRI] = None # this is same as latest version
+        for reference, model in models.items():
+            items[reference] = caches.get(str(model['cached']))
+        for activity in activityModels:
+            activities[str(activity['_id'])] = caches.get(str(activity['cached']))
 
         return result
 
@@ -493,25 +491,22 @@ class Protocol(FolderModel):
         if 'referenceId' not in historyFolder.get('meta', {}):
             return None
 
-        referencesFolder = FolderModel().load(historyFolder['meta']['referenceId'], force=True)
-
-        itemModel = ItemModel()
-
-        references = list(itemModel.find({
-            'folderId': referencesFolder['_id'],
-            'meta.lastVersion': localVersion
-        }))
-
-        updates = itemModel.find({
-            'folderId': referencesFolder['_id'],
-            'updated': {
-                '$gt': datetime.datetime.fromisoformat(localUpdateTime)
-            }
-        })
+        referencesId = ObjectId(historyFolder['meta']['referenceId'])
+
+        # each branch of the $or uses one of the folderId compound indices
+        references = ItemModel().find({
+            '$or': [{
+                'folderId': referencesId,
+                'meta.lastVersion': localVersion
+            }, {
+                'folderId': referencesId,
+                'updated': {
+                    '$gt': datetime.datetime.fromisoformat(localUpdateTime)
+                }
+            }]
+        }, fields=['meta.identifier', 'meta.modelType', 'meta.history'])
 
-        for reference in updates:
-            if reference['meta'].get('lastVersion', None) != localVersion:
-                references.append(reference)
+        localVersionKey = versionKey(localVersion)
 
         for reference in references:
             history = reference['meta'].get('history')
@@ -530,7 +525,7 @@ class Protocol(FolderModel):
                     else:
                         modelType = 'screen' if '/' in str(reference['meta']['identifier']) else 'activity'
 
-                if self.compareVersions(history[0]['version'], localVersion) < 0:
+                if versionKey(history[0]['version']) < localVersionKey:
                     changeInfo[modelType][str(reference['meta']['identifier'])] = 'updated'
                 else:
                     changeInfo[modelType][str(reference['meta']['identifier'])] = 'created'
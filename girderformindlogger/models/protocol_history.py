@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import bisect
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+from girderformindlogger.models.model_base import Model
+from girderformindlogger.utility.versions import versionKey
+
+
+class ProtocolHistory(Model):
+    """
+    Index of the history of the activities and items of protocols: one
+    document per entry of the `meta.history` of the reference items of a
+    protocol, with the identifier (IRI) of the activity or item, the protocol
+    version, its packed sort key (see `versionKey`) and the reference to the
+    historical copy of the activity or item.
+
+    The entries of an IRI sorted by version are intervals: a version uses the
+    reference of the first entry at or after it, so the reference of any
+    version is found without scanning the reference items.
+    """
+
+    def initialize(self):
+        self.name = 'protocolHistory'
+        self.ensureIndices([
+            ([('referencesId', ASCENDING), ('identifier', ASCENDING),
+              ('versionKey', ASCENDING)], {}),
+        ])
+
+    def validate(self, document):
+        return document
+
+    def indexReferences(self, references):
+        """
+        Replace the entries of reference items by their history.
+
+        :param references: The reference items.
+        :type references: iterable of dict
+        """
+        references = list(references)
+        if not references:
+            return
+
+        self.collection.delete_many({'$or': [{
+            'referencesId': reference['folderId'],
+            'identifier': reference['meta']['identifier']
+        } for reference in references]})
+
+        entries = [{
+            'referencesId': reference['folderId'],
+            'identifier': reference['meta']['identifier'],
+            'version': entry['version'],
+            'versionKey': entry['versionKey'] if 'versionKey' in entry
+            else versionKey(entry['version']),
+            'reference': entry.get('reference'),
+            'seq': seq
+        } for reference in references
+            for seq, entry in enumerate(reference['meta'].get('history', []))]
+        if entries:
+            self.collection.insert_many(entries, ordered=False)
+
+    def getIntervals(self, referencesId, IRIs):
+        """
+        Get the history of activities or items, indexing the reference items
+        which are not indexed yet.
+
+        :param referencesId: The id of the references folder of the protocol.
+        :param IRIs: The identifiers of the activities or items.
+        :returns: dict of IRI to the list of (version key, reference) of the
+            entries with a reference, sorted by version key. IRIs without a
+            reference item are left out.
+        """
+        from girderformindlogger.models.item import Item as ItemModel
+
+        referencesId = ObjectId(referencesId)
+        IRIs = list(IRIs)
+
+        def load():
+            intervals = {}
+            for entry in self.find({
+                'referencesId': referencesId,
+                'identifier': {'$in': IRIs}
+            }, fields=['identifier', 'versionKey', 'reference'],
+                    sort=[('identifier', ASCENDING), ('versionKey', ASCENDING), ('seq', ASCENDING)]):
+                entries = intervals.setdefault(entry['identifier'], [])
+                if entry.get('reference'):
+                    entries.append((entry['versionKey'], entry['reference']))
+            return intervals
+
+        intervals = load()
+        missing = [IRI for IRI in IRIs if IRI not in intervals]
+        if missing:
+            references = list(ItemModel().find({
+                'folderId': referencesId,
+                'meta.identifier': {'$in': missing}
+            }, fields=['folderId', 'meta.identifier', 'meta.history']))
+            if references:
+                self.indexReferences(references)
+                intervals = load()
+
+        return intervals
+
+    @staticmethod
+    def resolve(intervals, version):
+        """
+        The reference of a version in the intervals of an IRI, or None if the
+        version is after the last entry (it is the same as the latest version).
+        """
+        i = bisect.bisect_left(intervals, (versionKey(version),))
+        return intervals[i][1] if i < len(intervals) else None
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import copy
+import hashlib
 import json
 import os
 import re
+import uuid
 
 import six
 
@@ -10,6 +12,7 @@ from bson.objectid import ObjectId
 from girderformindlogger import events
 from girderformindlogger.constants import AccessType
 from girderformindlogger.exceptions import ValidationException, GirderException
+from girderformindlogger.models import getRedisConnection
 from girderformindlogger.models.model_base import AccessControlledModel, Model
 from girderformindlogger.models.aes_encrypt import AESEncryption
 from girderformindlogger.models.profile import Profile
@@ -20,7 +23,13 @@ from girderformindlogger.constants import USER_ROLES
 from datetime import date, datetime, timedelta
 from girderformindlogger.utility import mail_utils
 from bson import json_util
-from pymongo import DESCENDING, ASCENDING
+from pymongo import DESCENDING, ASCENDING, UpdateOne
+
+ALERT_QUEUE_KEY = 'responseAlerts:queue'
+ALERT_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# Delivery progress of a queued entry, kept while it may still be retried.
+ALERT_PROGRESS_KEY = 'responseAlerts:progress:{}'
+ALERT_PROGRESS_TTL = 7 * 24 * 3600
 
 class ResponseAlerts(AESEncryption):
     """
@@ -45,51 +54,168 @@ class ResponseAlerts(AESEncryption):
         ])
 
     def addResponseAlerts(self, userProfile, itemId, itemSchema, alertMessage):
-        now = datetime.utcnow()
-
-        reviewers = list(userProfile.get('reviewers', []))
-
-        if 'reviewer' in userProfile['roles'] or 'manager' in userProfile['roles'] and userProfile['_id'] not in reviewers:
-            reviewers.append(userProfile['_id'])
-
-        for reviewerId in reviewers:
-            reviewer = Profile().findOne({ '_id': ObjectId(reviewerId) })
-
-            alert = {
-                'reviewerId': reviewer['userId'],
-                'accountId': userProfile['accountId'],
-                'itemId': ObjectId(itemId),
-                'itemSchema': itemSchema,
-                'alertMessage': alertMessage,
-                'appletId': userProfile['appletId'],
-                'profileId': userProfile['_id'],
-                'created': now,
-                'viewed': False
-            }
+        self.queueResponseAlerts(userProfile, [{
+            'id': itemId,
+            'schema': itemSchema,
+            'message': alertMessage
+        }])
 
-            self.save(alert)
+    def queueResponseAlerts(self, userProfile, alerts):
+        """
+        Queue the alerts raised by a response. They are saved and sent to the
+        reviewers of the user by the response alert worker
+        (`girderformindlogger/external/response_alerts.py`), so that the
+        submission does not wait for them.
 
-            reviewerEmail = reviewer.get('email', '') or reviewer.get('userDefined', {}).get('email', '')
+        :param userProfile: The profile of the user who submitted the response.
+        :type userProfile: dict
+        :param alerts: The alerts, with their item ``id``, ``schema`` and
+            ``message``.
+        :type alerts: list
+        """
+        reviewers = {str(reviewerId) for reviewerId in userProfile.get('reviewers', [])}
 
-            if reviewerEmail and userProfile['_id'] != reviewer['_id']:
-                reviewerInfo = User().findOne({
-                    '_id': reviewer['userId']
-                }, fields=['lang'])
+        if 'reviewer' in userProfile['roles'] or 'manager' in userProfile['roles']:
+            reviewers.add(str(userProfile['_id']))
 
-                admin_url = os.getenv('ADMIN_URI') or 'localhost:8082'
+        if not reviewers or not alerts:
+            return
 
-                lang = reviewerInfo.get("lang", "en")
-                url = f'https://{admin_url}/#/dashboard?lang={lang}_{"US" if lang == "en" else "FR"}'
+        getRedisConnection().lpush(ALERT_QUEUE_KEY, json.dumps({
+            'id': uuid.uuid4().hex,
+            'profileId': str(userProfile['_id']),
+            'accountId': str(userProfile['accountId']),
+            'appletId': str(userProfile['appletId']),
+            'reviewers': sorted(reviewers),
+            'alerts': [{
+                'itemId': str(alert['id']),
+                'itemSchema': alert['schema'],
+                'alertMessage': alert['message']
+            } for alert in alerts],
+            'created': datetime.utcnow().strftime(ALERT_DATE_FORMAT)
+        }))
+
+    @staticmethod
+    def queuedEntryKey(entry):
+        """
+        The key of a queued entry, which stays the same when it is retried.
+        Entries queued before they had an ``id`` are keyed by their content.
+        """
+        if entry.get('id'):
+            return entry['id']
+        content = {key: value for key, value in entry.items() if key != 'attempts'}
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf8')).hexdigest()
+
+    def deliverQueuedAlerts(self, entries):
+        """
+        Save and send a batch of queued alerts. Reviewer profiles and users
+        are loaded with one query each, every reviewer gets a single email for
+        the whole batch, and the email template is rendered once per language.
+
+        Delivering entries again is safe: alerts are saved with ids derived
+        from their entry, and the progress of each entry (saved, emailed
+        reviewers) is kept in redis, so a retried entry only does what is left.
+
+        :param entries: Entries as queued by `queueResponseAlerts`.
+        :type entries: list
+        :returns: The number of alerts saved.
+        """
+        connection = getRedisConnection()
+        keys = [ALERT_PROGRESS_KEY.format(self.queuedEntryKey(entry)) for entry in entries]
+        pipe = connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.smembers(key)
+        progress = [
+            {member.decode('utf8') if isinstance(member, bytes) else member for member in members}
+            for members in pipe.execute()
+        ]
+
+        reviewerIds = {
+            ObjectId(reviewerId) for entry in entries for reviewerId in entry['reviewers']
+        }
+        reviewers = {
+            reviewer['_id']: reviewer for reviewer in Profile().find({
+                '_id': {'$in': list(reviewerIds)}
+            }, fields=['userId', 'email', 'userDefined.email'])
+        }
+        langs = {
+            user['_id']: user.get('lang', 'en') for user in User().find({
+                '_id': {'$in': list({reviewer['userId'] for reviewer in reviewers.values()})}
+            }, fields=['lang'])
+        }
+
+        requests = []
+        saved = []
+        digests = {}
+
+        for i, entry in enumerate(entries):
+            profileId = ObjectId(entry['profileId'])
+            created = datetime.strptime(entry['created'], ALERT_DATE_FORMAT)
+            entryKey = self.queuedEntryKey(entry)
 
-                html = mail_utils.renderTemplate(f'responseAlert.{lang}.mako', {
+            for reviewerId in entry['reviewers']:
+                reviewer = reviewers.get(ObjectId(reviewerId))
+                if not reviewer:
+                    continue
+
+                if 'saved' not in progress[i]:
+                    for index, alert in enumerate(entry['alerts']):
+                        alertId = ObjectId(hashlib.sha1(
+                            f'{entryKey}:{reviewerId}:{index}'.encode('utf8')).digest()[:12])
+                        requests.append(UpdateOne({'_id': alertId}, {
+                            '$setOnInsert': self.encryptFields({
+                                'reviewerId': reviewer['userId'],
+                                'accountId': ObjectId(entry['accountId']),
+                                'itemId': ObjectId(alert['itemId']),
+                                'itemSchema': alert['itemSchema'],
+                                'alertMessage': alert['alertMessage'],
+                                'appletId': ObjectId(entry['appletId']),
+                                'profileId': profileId,
+                                'created': created,
+                                'viewed': False
+                            }, self.fields)
+                        }, upsert=True))
+
+                if reviewer['_id'] == profileId:
+                    continue
+
+                reviewerEmail = reviewer.get('email', '') or reviewer.get('userDefined', {}).get('email', '')
+                if reviewerEmail and 'mail:' + reviewerEmail not in progress[i]:
+                    digests.setdefault(reviewerEmail, (langs.get(reviewer['userId'], 'en'), []))[1].append(keys[i])
+
+            if 'saved' not in progress[i]:
+                saved.append(keys[i])
+
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+        if saved:
+            self._recordProgress(connection, saved, 'saved')
+
+        admin_url = os.getenv('ADMIN_URI') or 'localhost:8082'
+        templates = {}
+        for reviewerEmail, (lang, emailed) in digests.items():
+            if lang not in templates:
+                url = f'https://{admin_url}/#/dashboard?lang={lang}_{"US" if lang == "en" else "FR"}'
+                templates[lang] = mail_utils.renderTemplate(f'responseAlert.{lang}.mako', {
                     'url': url
                 })
 
-                mail_utils.sendMail(
-                    'Response Alert',
-                    html,
-                    reviewerEmail
-                )
+            mail_utils.sendMail(
+                'Response Alert',
+                templates[lang],
+                reviewerEmail
+            )
+            self._recordProgress(connection, emailed, 'mail:' + reviewerEmail)
+
+        return len(requests)
+
+    @staticmethod
+    def _recordProgress(connection, keys, step):
+        pipe = connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.sadd(key, step)
+            pipe.expire(key, ALERT_PROGRESS_TTL)
+        pipe.execute()
 
     def getResponseAlerts(self, reviewerId, accountId):
         alerts = list(
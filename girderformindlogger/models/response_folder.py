@@ -37,7 +37,9 @@ class ResponseItem(AESEncryption, Item):
     def initialize(self):
         self.name = 'item'
         self.ensureIndices(('folderId', 'name', 'lowerName', 'created',
-                            ([('folderId', 1), ('name', 1)], {})))
+                            ([('folderId', 1), ('name', 1)], {}),
+                            ([('meta.applet.@id', 1), ('meta.subject.@id', 1),
+                              ('meta.applet.versionKey', 1)], {})))
         self.ensureTextIndex({
             'name': 1,
             'description': 1
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, UpdateOne
+
+from girderformindlogger.models.model_base import Model
+
+
+def _utc(time):
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time
+
+
+class ResponseStatistics(Model):
+    """
+    Daily statistics of the responses to applets: one document per (applet,
+    subject, activity, day) with the number of responses and the times of the
+    first and the last of them. Days are UTC days, and subjects are applet
+    profile ids.
+
+    The statistics are updated on every response and when responses are
+    deleted, so dashboard summaries read a few documents per participant
+    instead of their responses.
+    """
+
+    def initialize(self):
+        self.name = 'responseStatistics'
+        self.ensureIndices([
+            ([('appletId', ASCENDING), ('subjectId', ASCENDING), ('activityId', ASCENDING),
+              ('day', ASCENDING)], {'unique': True}),
+            ([('appletId', ASCENDING), ('day', ASCENDING)], {}),
+        ])
+
+    def validate(self, document):
+        return document
+
+    def recordResponse(self, appletId, subjectId, activityId, time):
+        """
+        Count a response.
+
+        :param time: The time of the response.
+        :type time: datetime.datetime
+        """
+        time = _utc(time)
+        self.collection.update_one({
+            'appletId': ObjectId(appletId),
+            'subjectId': ObjectId(subjectId),
+            'activityId': ObjectId(activityId),
+            'day': datetime.datetime(time.year, time.month, time.day)
+        }, {
+            '$inc': {'count': 1},
+            '$min': {'first': time},
+            '$max': {'last': time}
+        }, upsert=True)
+
+    def getStatistics(self, appletId, startDate=None, endDate=None, subjectIds=None,
+                      activityIds=None, perActivity=True):
+        """
+        Summarise the responses to an applet over a range of days.
+
+        :param appletId: The applet id.
+        :param startDate: The first day, or None for the first response.
+        :type startDate: datetime.datetime
+        :param endDate: The last day, or None for today.
+        :type endDate: datetime.datetime
+        :param subjectIds: Only summarise the responses of these profiles.
+        :param activityIds: Only summarise the responses to these activities.
+        :param perActivity: Summarise each activity of a subject separately.
+        :type perActivity: bool
+        :returns: list of dicts, one per subject (and activity), with the number
+            of responses, the number of days with responses, the completion rate
+            (days with responses / days in the range) and the times of the first
+            and the last response.
+        """
+        query = {'appletId': ObjectId(appletId)}
+        if subjectIds is not None:
+            query['subjectId'] = {'$in': [ObjectId(id) for id in subjectIds]}
+        if activityIds is not None:
+            query['activityId'] = {'$in': [ObjectId(id) for id in activityIds]}
+
+        endDate = _utc(endDate or datetime.datetime.utcnow())
+        endDay = datetime.datetime(endDate.year, endDate.month, endDate.day)
+        query['day'] = {'$lte': endDay}
+        if startDate is not None:
+            startDate = _utc(startDate)
+            query['day']['$gte'] = datetime.datetime(
+                startDate.year, startDate.month, startDate.day)
+
+        group = {'subjectId': '$subjectId'}
+        if perActivity:
+            group['activityId'] = '$activityId'
+
+        statistics = []
+        for row in self.collection.aggregate([
+            {'$match': query},
+            {'$group': {
+                '_id': group,
+                'count': {'$sum': '$count'},
+                'days': {'$addToSet': '$day'},
+                'firstDay': {'$min': '$day'},
+                'first': {'$min': '$first'},
+                'last': {'$max': '$last'}
+            }}
+        ]):
+            rangeStart = query['day'].get('$gte', row['firstDay'])
+            rangeDays = (endDay - rangeStart).days + 1
+            row.update(row.pop('_id'))
+            row.pop('firstDay')
+            row['days'] = len(row['days'])
+            row['completionRate'] = float(row['days']) / rangeDays
+            statistics.append(row)
+
+        return statistics
+
+    def _countResponses(self, responses, query):
+        """
+        Count the response items matching a query per (applet, subject,
+        activity, day).
+        """
+        return responses.collection.aggregate([
+            {'$match': {
+                '$and': [query, {
+                    'meta.applet.@id': {'$exists': True},
+                    'meta.subject.@id': {'$exists': True},
+                    'meta.activity.@id': {'$exists': True}
+                }]
+            }},
+            {'$group': {
+                '_id': {
+                    'appletId': '$meta.applet.@id',
+                    'subjectId': '$meta.subject.@id',
+                    'activityId': '$meta.activity.@id',
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$created'}}
+                },
+                'count': {'$sum': 1},
+                'first': {'$min': '$created'},
+                'last': {'$max': '$created'}
+            }}
+        ], allowDiskUse=True)
+
+    @staticmethod
+    def _key(row):
+        return {
+            'appletId': row['_id']['appletId'],
+            'subjectId': row['_id']['subjectId'],
+            'activityId': row['_id']['activityId'],
+            'day': datetime.datetime.strptime(row['_id']['day'], '%Y-%m-%d')
+        }
+
+    def removeResponses(self, query, responses=None):
+        """
+        Uncount the responses matching a query; call it before deleting them.
+        The times of the first and the last response of a day are kept, and the
+        days without responses left are removed.
+
+        :param query: The query of the response items.
+        :type query: dict
+        :param responses: The response item model, connected to the database
+            the responses are stored in. ResponseItem by default.
+        """
+        if responses is None:
+            from girderformindlogger.models.response_folder import ResponseItem
+            responses = ResponseItem()
+
+        requests = []
+        appletIds = set()
+        for row in self._countResponses(responses, query):
+            requests.append(UpdateOne(self._key(row), {'$inc': {'count': -row['count']}}))
+            appletIds.add(row['_id']['appletId'])
+
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+            self.collection.delete_many({
+                'appletId': {'$in': list(appletIds)},
+                'count': {'$lte': 0}
+            })
+
+    def rebuild(self, appletId):
+        """
+        Recompute the statistics of an applet from its responses. The response
+        items must be read from the database of the applet owner.
+
+        The statistics are overwritten in place, so they can be read and
+        updated while they are rebuilt; a response recorded between the count
+        and the write of its day may be left out until the next rebuild. The
+        days without responses are removed at the end.
+
+        :returns: The number of statistics documents.
+        """
+        from girderformindlogger.models.response_folder import ResponseItem
+
+        appletId = ObjectId(appletId)
+        started = datetime.datetime.utcnow()
+
+        count = 0
+        requests = []
+        for row in self._countResponses(ResponseItem(), {'meta.applet.@id': appletId}):
+            requests.append(UpdateOne(self._key(row), {'$set': {
+                'count': row['count'],
+                'first': row['first'],
+                'last': row['last'],
+                'rebuilt': started
+            }}, upsert=True))
+            if len(requests) == 1000:
+                self.collection.bulk_write(requests, ordered=False)
+                count += len(requests)
+                requests = []
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+            count += len(requests)
+
+        # days without responses, unless a response was recorded meanwhile
+        self.collection.delete_many({
+            'appletId': appletId,
+            'rebuilt': {'$ne': started},
+            'last': {'$lt': started}
+        })
+        return count
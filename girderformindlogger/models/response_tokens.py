@@ -15,6 +15,7 @@ from girderformindlogger.models.model_base import AccessControlledModel, Model
 from girderformindlogger.models.aes_encrypt import AESEncryption
 from girderformindlogger.utility.model_importer import ModelImporter
 from girderformindlogger.utility.progress import noProgress, setResponseTimeLimit
+from girderformindlogger.utility.versions import versionKey, versionRange
 from datetime import date, datetime, timedelta, timezone
 from girderformindlogger.constants import USER_ROLES
 from pymongo import ASCENDING, DESCENDING
@@ -35,6 +36,11 @@ class ResponseTokens(AESEncryption, dict):
                     ('appletId', 1),
                     ('isCumulative', 1),
                     ('created', 1)
+                ], {}),
+                ([
+                    ('userId', 1),
+                    ('appletId', 1),
+                    ('versionKey', 1)
                 ], {})
             )
         )
@@ -100,6 +106,7 @@ class ResponseTokens(AESEncryption, dict):
 
         if version:
             tokenInfo['version'] = version
+            tokenInfo['versionKey'] = versionKey(version)
 
         if not tokenInfo.get('created', None):
             tokenInfo['created'] = now
@@ -109,7 +116,8 @@ class ResponseTokens(AESEncryption, dict):
 
         self.save(tokenInfo)
 
-    def getResponseTokens(self, profile, startDate=None, retrieveUserKeys=True):
+    def getResponseTokens(self, profile, startDate=None, retrieveUserKeys=True,
+                          fromVersion=None, toVersion=None):
         cumulativeToken = self.findOne({
             'userId': profile['userId'],
             'appletId': profile['appletId'],
@@ -127,6 +135,10 @@ class ResponseTokens(AESEncryption, dict):
                 "$gte": startDate,
             }
 
+        versions = versionRange(fromVersion, toVersion)
+        if versions:
+            query['versionKey'] = versions
+
         def convertTimeZone(tokens, profile):
             for token in tokens:
                 if 'created' in token:
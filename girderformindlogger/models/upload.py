@@ -423,7 +423,7 @@ class Upload(Model):
             if chunk is not None:
                 chunk += data
             else:
-                chunk = data
+                chunk = bytes(data)
             if len(chunk) >= chunkSize:
                 upload = self.handleChunk(upload, RequestBodyStream(six.BytesIO(chunk), len(chunk)))
                 progress.update(increment=len(chunk))
@@ -4,11 +4,9 @@ import datetime
 import dateutil.parser
 import errno
 import json
-import json5
 import os
 import pytz
 import re
-import requests
 import string
 import six
 import time
@@ -117,19 +115,10 @@ def firstLower(value):
 
 
 def loadJSON(url, urlType='protocol'):
-    from girderformindlogger.exceptions import ValidationException
+    from girderformindlogger.utility.document_fetcher import getFetcher
 
     print("Loading {} from {}".format(urlType, url))
-    try:
-        r = requests.get(url)
-        data = json5.loads(r.text)
-    except:
-        return({})
-        raise ValidationException(
-            'Invalid ' + urlType + ' URL: ' + url,
-            'url'
-        )
-    return(data)
+    return(getFetcher().load(url))
 
 
 def mkdir(path, mode=0o777, recurse=True, existOk=True):
@@ -17,6 +17,11 @@ class CherrypyRequestBackend(MemoryBackend):
 
     @property
     def _cache(self):
+        if 'request' not in vars(cherrypy.serving):
+            # Outside of a request cherrypy.request is a default object shared
+            # by every thread, so nothing is cached.
+            return {}
+
         if not hasattr(cherrypy.request, '_girderCache'):
             cherrypy.request._girderCache = {}
 
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import json5
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
+
+from girderformindlogger import logger
+from girderformindlogger.utility import config
+
+
+def parseJSON(text):
+    """
+    Parse a JSON document, falling back to the much slower JSON5 parser for
+    documents which are not strict JSON (comments, trailing commas...).
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json5.loads(text)
+
+
+class DocumentFetcher(object):
+    """
+    Fetches the JSON(-LD) documents of protocols, activities and items.
+
+    Requests go through one pooled session, with at most `workers` requests in
+    flight and at most `perHost` of them to the same host. Responses are kept
+    on disk with their ETag and Last-Modified headers: a cached document is
+    served as is for `freshFor` seconds, then revalidated with a conditional
+    request. When the server cannot be reached, the cached copy is served.
+
+    The cache holds up to `maxSize` bytes; beyond that the least recently
+    written documents are removed. Failing to write the cache is logged and
+    otherwise ignored.
+
+    Configured in the ``[jsonld]`` config section.
+    """
+
+    def __init__(self, cacheDir=None, workers=None, perHost=None, timeout=None,
+                 freshFor=None, session=None, maxSize=None):
+        conf = config.getConfig().get('jsonld', {})
+        self.cacheDir = cacheDir or conf.get('cache_dir') or os.path.join(
+            tempfile.gettempdir(), 'mindlogger-jsonld')
+        self.workers = int(workers or conf.get('workers', 16))
+        self.perHost = int(perHost or conf.get('per_host', 8))
+        self.timeout = float(timeout or conf.get('timeout', 10))
+        self.freshFor = float(conf.get('fresh_for', 60) if freshFor is None else freshFor)
+        self.maxSize = int(conf.get('max_size', 256 * 1024 ** 2) if maxSize is None else maxSize)
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self.hosts = {}
+        self.hostsLock = threading.Lock()
+
+        # size of the cache in bytes, measured on the first write
+        self.cacheSize = None
+        self.cacheLock = threading.Lock()
+
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+        except OSError as e:
+            logger.warning('Could not create the document cache in %s: %s', self.cacheDir, e)
+
+    def _cachePath(self, url):
+        return os.path.join(
+            self.cacheDir, hashlib.sha256(url.encode('utf8')).hexdigest() + '.json')
+
+    def _readCache(self, url):
+        try:
+            with open(self._cachePath(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def _writeCache(self, url, entry):
+        path = self._cachePath(url)
+        tmp = None
+        try:
+            try:
+                previous = os.path.getsize(path)
+            except OSError:
+                previous = 0
+
+            fd, tmp = tempfile.mkstemp(dir=self.cacheDir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning('Could not cache %s: %s', url, e)
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        with self.cacheLock:
+            if self.cacheSize is None:
+                self._evict()
+            else:
+                self.cacheSize += size - previous
+                if self.cacheSize > self.maxSize:
+                    self._evict()
+
+    def _evict(self):
+        """
+        Measure the cache and remove the least recently written documents until
+        it is below 90% of `maxSize`. Must be called with `cacheLock` held.
+        """
+        entries = []
+        for entry in os.scandir(self.cacheDir):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        self.cacheSize = sum(size for _, size, _ in entries)
+        if self.cacheSize <= self.maxSize:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if self.cacheSize <= self.maxSize * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.cacheSize -= size
+
+    def _hostLimit(self, url):
+        host = urlparse(url).netloc
+        with self.hostsLock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.perHost)
+            return self.hosts[host]
+
+    def fetch(self, url):
+        """
+        Get the body of a document.
+
+        :param url: The URL of the document.
+        :type url: str
+        :returns: The body, or None if the document could not be fetched.
+        """
+        if not isinstance(url, str):
+            return None
+
+        cached = self._readCache(url)
+        if cached and time.time() - cached['fetched'] < self.freshFor:
+            return cached['body']
+
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('lastModified'):
+            headers['If-Modified-Since'] = cached['lastModified']
+
+        try:
+            with self._hostLimit(url):
+                r = self.session.get(url, headers=headers, timeout=self.timeout)
+        except (requests.RequestException, ValueError) as e:
+            if cached:
+                logger.warning('Could not fetch %s, using the cached copy: %s', url, e)
+                return cached['body']
+            return None
+
+        notModified = r.status_code == 304 and cached is not None
+        if notModified:
+            body = cached['body']
+        elif r.ok:
+            body = r.text
+        else:
+            return None
+
+        previous = cached if notModified else {}
+        self._writeCache(url, {
+            'url': url,
+            'etag': r.headers.get('ETag') or previous.get('etag'),
+            'lastModified': r.headers.get('Last-Modified') or previous.get('lastModified'),
+            'fetched': time.time(),
+            'body': body
+        })
+        return body
+
+    def load(self, url):
+        """
+        Get a parsed document.
+
+        :param url: The URL of the document.
+        :type url: str
+        :returns: The document, or {} if it could not be fetched or parsed.
+        """
+        body = self.fetch(url)
+        if body is None:
+            return {}
+        try:
+            return parseJSON(body)
+        except ValueError:
+            return {}
+
+    def prefetch(self, urls):
+        """
+        Fetch documents concurrently, so that loading them afterwards is
+        served from the cache.
+
+        :param urls: The URLs of the documents.
+        :type urls: iterable of str
+        :returns: The number of documents fetched.
+        """
+        urls = list({url for url in urls if url})
+        if not urls:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(urls))) as pool:
+            bodies = list(pool.map(self.fetch, urls))
+        return sum(body is not None for body in bodies)
+
+
+_fetcher = None
+_fetcherLock = threading.Lock()
+
+
+def getFetcher():
+    global _fetcher
+
+    with _fetcherLock:
+        if _fetcher is None:
+            _fetcher = DocumentFetcher()
+        return _fetcher
@@ -1,14 +1,65 @@
+import base64
+import datetime
+import hashlib
+import io
 import os
+import threading
+import time
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.errorfactory import ClientError
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, \
+    BlobSasPermissions, generate_blob_sas
+
+from girderformindlogger.exceptions import RestException
 
 DEFAULT_REGION = 'us-east-1'
 DEFAULT_CONTAINER_NAME = 'mindlogger'
+GCP_ENDPOINT_URL = 'https://storage.googleapis.com'
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Lifetime of presigned upload and download urls, in seconds.
+PRESIGNED_URL_EXPIRES = 15 * 60
+
+# Files are streamed in parts of CHUNK_SIZE bytes, so at most
+# max_concurrency * CHUNK_SIZE bytes of a file are held in memory.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=CHUNK_SIZE,
+    multipart_chunksize=CHUNK_SIZE,
+    max_concurrency=4,
+    use_threads=True
+)
+
+# Pool for uploading the attachments of responses concurrently, created on
+# first use with ``upload_workers`` threads (``[storage]`` config section).
+_uploadPool = None
+_uploadPoolLock = threading.Lock()
+
+# Storage clients are expensive to build, so they are cached per set of
+# credentials (i.e. per tenant and bucket type).
+_clients = {}
+_clientsLock = threading.Lock()
+
+
+def _cachedClient(key, factory):
+    with _clientsLock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def _secretHash(secret):
+    return hashlib.sha256((secret or '').encode('utf8')).hexdigest()
+
 
 class S3Storage():
-    def __init__(self, s3_client):
+    def __init__(self, s3_client, bucket=None, scheme='s3'):
         self.s3_client = s3_client
+        self.bucket = bucket
+        self.scheme = scheme
 
     def checkPathExists(self, uri):
         if '/' not in uri:
@@ -20,9 +71,54 @@ class S3Storage():
         except ClientError as e:
             return False
 
+    def uri(self, key, bucket=None):
+        return "{}://{}/{}".format(self.scheme, bucket or self.bucket, key)
+
+    def upload(self, fileobj, key, bucket=None):
+        """
+        Stream a file-like object to the bucket as a multipart upload.
+
+        :returns: The uri of the uploaded object.
+        """
+        self.s3_client.upload_fileobj(fileobj, bucket or self.bucket, key, Config=TRANSFER_CONFIG)
+        return self.uri(key, bucket)
+
+    def key(self, uri):
+        """
+        Get the object key of a uri in this bucket, or None if the uri points
+        somewhere else.
+        """
+        prefix = "{}://{}/".format(self.scheme, self.bucket)
+        return uri[len(prefix):] if uri.startswith(prefix) else None
+
+    def download(self, key, bucket=None):
+        """
+        Stream an object in chunks of at most CHUNK_SIZE bytes.
+        """
+        body = self.s3_client.get_object(Bucket=bucket or self.bucket, Key=key)['Body']
+        return body.iter_chunks(CHUNK_SIZE)
+
+    def presigned_url(self, key, method='GET', contentType=None, expires=PRESIGNED_URL_EXPIRES):
+        """
+        Create a url that lets a client upload (PUT) or download (GET) an
+        object directly from the bucket.
+        """
+        params = {'Bucket': self.bucket, 'Key': key}
+        if method == 'PUT' and contentType:
+            params['ContentType'] = contentType
+
+        return self.s3_client.generate_presigned_url(
+            'put_object' if method == 'PUT' else 'get_object',
+            Params=params,
+            ExpiresIn=expires,
+            HttpMethod=method
+        )
+
+
 class AzureStorage():
-    def __init__(self, container_client):
+    def __init__(self, container_client, account=None):
         self.container_client = container_client
+        self.account = account
 
     def checkPathExists(self, uri):
         if '/' not in uri:
@@ -31,39 +127,196 @@ class AzureStorage():
         # [bucket, path] = uri.split('://').pop().split('/', 1)
         return True
 
+    def uri(self, key, bucket=None):
+        return "https://{}.blob.core.windows.net/{}/{}".format(
+            self.account, DEFAULT_CONTAINER_NAME, key)
+
+    def upload(self, fileobj, key, bucket=None):
+        """
+        Stream a file-like object to the container as a block blob.
+
+        :returns: The uri of the uploaded object.
+        """
+        self.container_client.upload_blob(key, fileobj, max_concurrency=TRANSFER_CONFIG.max_concurrency)
+        return self.uri(key)
+
+    def key(self, uri):
+        prefix = self.uri('')
+        return uri[len(prefix):] if uri.startswith(prefix) else None
+
+    def download(self, key, bucket=None):
+        return self.container_client.download_blob(key).chunks()
+
+    def presigned_url(self, key, method='GET', contentType=None, expires=PRESIGNED_URL_EXPIRES):
+        permission = BlobSasPermissions(create=True, write=True) if method == 'PUT' \
+            else BlobSasPermissions(read=True)
+        sas = generate_blob_sas(
+            self.container_client.account_name,
+            DEFAULT_CONTAINER_NAME,
+            key,
+            account_key=self.container_client.credential.account_key,
+            permission=permission,
+            expiry=datetime.datetime.utcnow() + datetime.timedelta(seconds=expires)
+        )
+        return "{}?{}".format(self.uri(key), sas)
+
+
+def _s3Client(accessKeyId, secretAccessKey, endpoint_url=None):
+    return _cachedClient(
+        ('s3', endpoint_url, accessKeyId, _secretHash(secretAccessKey)),
+        lambda: boto3.client(
+            's3',
+            region_name=DEFAULT_REGION,
+            endpoint_url=endpoint_url,
+            aws_access_key_id=accessKeyId,
+            aws_secret_access_key=secretAccessKey
+        )
+    )
+
+
+def _azureContainer(connectionString):
+    def factory():
+        blob_service_client = BlobServiceClient.from_connection_string(connectionString)
+        try:
+            blob_service_client.create_container(DEFAULT_CONTAINER_NAME)
+        except ResourceExistsError:
+            pass
+        return blob_service_client.get_container_client(DEFAULT_CONTAINER_NAME)
+
+    return _cachedClient(('azure', _secretHash(connectionString)), factory)
+
 
 def resolve_from_account(owner_account):
     bucketType = owner_account.get('bucketType', None)
+    bucket = owner_account.get('s3Bucket', None)
     if bucketType and 'gcp' in bucketType.lower():
-        s3_client = boto3.client(
-            's3',
-            region_name=DEFAULT_REGION,
-            endpoint_url="https://storage.googleapis.com",
-            aws_access_key_id=owner_account.get('accessKeyId', None),
-            aws_secret_access_key=owner_account.get('secretAccessKey', None)
+        s3_client = _s3Client(
+            owner_account.get('accessKeyId', None),
+            owner_account.get('secretAccessKey', None),
+            endpoint_url=GCP_ENDPOINT_URL
         )
-        return S3Storage(s3_client)
+        return S3Storage(s3_client, bucket, 'gs')
     elif bucketType and 'azure' in bucketType.lower():
-        blob_service_client = BlobServiceClient.from_connection_string(
-            owner_account.get('secretAccessKey', None))
-        try:
-            container_client = blob_service_client.create_container(DEFAULT_CONTAINER_NAME)
-            return AzureStorage(container_client)
-        except Exception as ex:
-            print('Azure CON Exception:')
-            print(ex)
+        return AzureStorage(
+            _azureContainer(owner_account.get('secretAccessKey', None)), bucket)
     else:
-        s3_client = boto3.client(
-            's3',
-            region_name=DEFAULT_REGION,
-            aws_access_key_id=owner_account.get('accessKeyId', None),
-            aws_secret_access_key=owner_account.get('secretAccessKey', None)
+        s3_client = _s3Client(
+            owner_account.get('accessKeyId', None),
+            owner_account.get('secretAccessKey', None)
         )
-        return S3Storage(s3_client)
+        return S3Storage(s3_client, bucket)
+
+
+def resolve_default(bucket=None):
+    """
+    Storage with the server credentials. Set ``S3_ENDPOINT_URL`` to use an
+    S3-compatible server other than AWS, e.g. a local stub.
+    """
+    s3_client = _s3Client(
+        os.environ['ACCESS_KEY_ID'],
+        os.environ['SECRET_ACCESS_KEY'],
+        endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None
+    )
+
+    return S3Storage(s3_client, bucket)
+
+
+def resolve_media_storage(owner_account):
+    """
+    Get the storage that the response media of applets owned by
+    `owner_account` are uploaded to.
+    """
+    if owner_account and owner_account.get('s3Bucket', None):
+        if owner_account.get('accessKeyId', None):
+            return resolve_from_account(owner_account)
+        return resolve_default(owner_account['s3Bucket'])
+    return resolve_default(os.environ['S3_MEDIA_BUCKET'])
+
+
+def _partFile(part):
+    if part.file is not None:
+        part.file.seek(0)
+        return part.file
+    value = part.value
+    return io.BytesIO(value.encode('utf8') if isinstance(value, str) else value)
+
+
+def _storageConfig():
+    from girderformindlogger.utility import config
+
+    return config.getConfig().get('storage', {})
+
+
+def _getUploadPool():
+    global _uploadPool
+
+    with _uploadPoolLock:
+        if _uploadPool is None:
+            _uploadPool = ThreadPoolExecutor(
+                max_workers=int(_storageConfig().get('upload_workers', 16)))
+        return _uploadPool
+
+
+def upload_parts(storage, uploads, concurrency=None, timeout=None):
+    """
+    Upload several request parts concurrently.
+
+    :param storage: The storage to upload to.
+    :param uploads: ``(part, key)`` pairs, where `part` is a CherryPy request
+        part. CherryPy spools file parts to disk, so they are streamed from
+        there without being read into memory.
+    :param concurrency: The number of parts uploaded at the same time, so
+        that one request does not take the whole shared pool. Defaults to
+        ``upload_concurrency`` in the ``[storage]`` config section.
+    :param timeout: Seconds to wait for all the parts. Defaults to
+        ``upload_timeout`` in the ``[storage]`` config section.
+    :returns: The uris of the uploaded objects, in the same order.
+    """
+    conf = _storageConfig()
+    concurrency = int(concurrency or conf.get('upload_concurrency', 4))
+    deadline = time.monotonic() + float(timeout or conf.get('upload_timeout', 300))
+    slots = threading.BoundedSemaphore(concurrency)
+    pool = _getUploadPool()
+
+    def upload(part, key):
+        try:
+            return storage.upload(_partFile(part), key)
+        finally:
+            slots.release()
+
+    def remaining():
+        return max(0, deadline - time.monotonic())
+
+    futures = []
+    try:
+        for part, key in uploads:
+            if not slots.acquire(timeout=remaining()):
+                raise FutureTimeoutError()
+            futures.append(pool.submit(upload, part, key))
+        return [future.result(timeout=remaining()) for future in futures]
+    except FutureTimeoutError:
+        for future in futures:
+            future.cancel()
+        raise RestException('Uploading the files of the response timed out.', code=504)
+
+
+def resolve_report_storage():
+    """
+    Get the storage pdf reports are uploaded to.
+    """
+    return resolve_default(os.environ['S3_REPORT_BUCKET'])
 
-def resolve_default():
-    s3_client = boto3.client('s3', region_name=DEFAULT_REGION,
-          aws_access_key_id=os.environ['ACCESS_KEY_ID'],
-          aws_secret_access_key=os.environ['SECRET_ACCESS_KEY'])
 
-    return S3Storage(s3_client)
+def base64_chunks(chunks):
+    """
+    Base64-encode a stream of byte chunks without joining them in memory.
+    """
+    remainder = b''
+    for chunk in chunks:
+        chunk = remainder + chunk
+        size = len(chunk) - len(chunk) % 3
+        remainder = chunk[size:]
+        if size:
+            yield base64.b64encode(chunk[:size])
+    if remainder:
+        yield base64.b64encode(remainder)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import filelock
 from hashlib import sha512
+import mmap
 import os
 import psutil
 import shutil
@@ -8,23 +9,119 @@ import six
 from six import BytesIO
 import stat
 import tempfile
+import threading
+import uuid
 
 from girderformindlogger import events, logger
-from girderformindlogger.api.rest import setResponseHeader
+from girderformindlogger.api.rest import setResponseHeader, setContentDisposition
 from girderformindlogger.exceptions import ValidationException, GirderException
 from girderformindlogger.models.file import File
 from girderformindlogger.models.folder import Folder
 from girderformindlogger.models.item import Item
 from girderformindlogger.models.upload import Upload
-from girderformindlogger.utility import mkdir, progress
+from girderformindlogger.utility import config, mkdir, progress
 from . import _hash_state
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 
 BUF_SIZE = 65536
 
+# Downloads are sent in slices of a memory map of this size.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Uploads are read, hashed and written in buffers of this size.
+UPLOAD_BUF_SIZE = 1024 * 1024
+# Number of buffers waiting to be hashed before reading the upload blocks.
+HASH_QUEUE_DEPTH = 4
+# The SHA-512 state is persisted in the upload document whenever this many
+# bytes were received since it was last persisted.
+HASH_STATE_INTERVAL = 32 * 1024 * 1024
+# Number of in-progress hash objects kept in memory between chunks.
+HASH_CACHE_SIZE = 64
+
+_hashCache = {}
+_hashCacheLock = threading.Lock()
+
+
+def _cachedHash(uploadId, offset):
+    """
+    Get the in-memory hash object of an upload if it covers exactly the first
+    `offset` bytes.
+    """
+    with _hashCacheLock:
+        entry = _hashCache.pop(uploadId, None)
+    if entry is not None and entry[0] == offset:
+        return entry[1]
+
+
+def _cacheHash(uploadId, offset, checksum):
+    with _hashCacheLock:
+        if len(_hashCache) >= HASH_CACHE_SIZE:
+            _hashCache.pop(next(iter(_hashCache)))
+        _hashCache[uploadId] = (offset, checksum)
+
+
+class _HashingWriter(object):
+    """
+    Writes buffers to a file while a background thread feeds them to a hash.
+    hashlib releases the GIL while hashing large buffers, so hashing runs in
+    parallel with reading the request and writing to disk. At most
+    `depth` buffers wait to be hashed.
+    """
+
+    def __init__(self, fileobj, checksum, depth=HASH_QUEUE_DEPTH):
+        self.fileobj = fileobj
+        self.checksum = checksum
+        self.queue = six.moves.queue.Queue(maxsize=depth)
+        self.thread = threading.Thread(target=self._hash, daemon=True)
+        self.thread.start()
+
+    def _hash(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            self.checksum.update(data)
+
+    def write(self, data):
+        self.queue.put(data)
+        self.fileobj.write(data)
+
+    def close(self):
+        """
+        Wait for the queued buffers to be hashed.
+
+        :returns: The hash object.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        return self.checksum
+
 # Default permissions for the files written to the filesystem
 DEFAULT_PERMS = stat.S_IRUSR | stat.S_IWUSR
 
+_warnedDeferSha512 = False
+
+
+def _deferSha512():
+    """
+    Whether uploads are stored without hashing them (``defer_sha512`` in the
+    ``[assetstore]`` config section). Their sha512 is then computed by the
+    hashsum_download plugin, so uploads are hashed as usual when the plugin
+    is not loaded.
+    """
+    global _warnedDeferSha512
+    from girderformindlogger.plugin import loadedPlugins
+
+    if not config.getConfig().get('assetstore', {}).get('defer_sha512', False):
+        return False
+    if 'hashsum_download' not in loadedPlugins():
+        if not _warnedDeferSha512:
+            logger.warning('defer_sha512 needs the hashsum_download plugin, which is not '
+                           'loaded; uploads are hashed while they are received.')
+            _warnedDeferSha512 = True
+        return False
+    return True
+
 
 class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
     """
@@ -130,7 +227,11 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         fd, path = tempfile.mkstemp(dir=self.tempDir)
         os.close(fd)  # Must close this file descriptor or it will leak
         upload['tempFile'] = path
-        upload['sha512state'] = _hash_state.serializeHex(sha512())
+        if _deferSha512():
+            upload['deferSha512'] = True
+        else:
+            upload['sha512state'] = _hash_state.serializeHex(sha512())
+            upload['sha512stateOffset'] = 0
         return upload
 
     def uploadChunk(self, upload, chunk):
@@ -146,30 +247,24 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, six.binary_type):
             chunk = BytesIO(chunk)
 
-        # Restore the internal state of the streaming SHA-512 checksum
-        checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
-
-        if self.requestOffset(upload) > upload['received']:
-            # This probably means the server died midway through writing last
-            # chunk to disk, and the database record was not updated. This
-            # means we need to update the sha512 state with the difference.
-            with open(upload['tempFile'], 'rb') as tempFile:
-                tempFile.seek(upload['received'])
-                while True:
-                    data = tempFile.read(BUF_SIZE)
-                    if not data:
-                        break
-                    checksum.update(data)
+        if upload.get('deferSha512'):
+            checksum = None
+        else:
+            checksum = self._restoreChecksum(upload)
 
         with open(upload['tempFile'], 'a+b') as tempFile:
+            writer = _HashingWriter(tempFile, checksum) if checksum else tempFile
             size = 0
-            while not upload['received'] + size > upload['size']:
-                data = chunk.read(BUF_SIZE)
-                if not data:
-                    break
-                size += len(data)
-                tempFile.write(data)
-                checksum.update(data)
+            try:
+                while not upload['received'] + size > upload['size']:
+                    data = chunk.read(UPLOAD_BUF_SIZE)
+                    if not data:
+                        break
+                    size += len(data)
+                    writer.write(data)
+            finally:
+                if checksum:
+                    writer.close()
         chunk.close()
 
         try:
@@ -179,11 +274,42 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 tempFile.truncate(upload['received'])
             raise
 
-        # Persist the internal state of the checksum
-        upload['sha512state'] = _hash_state.serializeHex(checksum)
         upload['received'] += size
+        if checksum:
+            _cacheHash(str(upload.get('_id')), upload['received'], checksum)
+            # Persist the internal state of the checksum now and then, or
+            # when the upload is complete
+            if upload['received'] - upload.get('sha512stateOffset', 0) >= HASH_STATE_INTERVAL \
+                    or upload['received'] >= upload['size']:
+                upload['sha512state'] = _hash_state.serializeHex(checksum)
+                upload['sha512stateOffset'] = upload['received']
         return upload
 
+    def _restoreChecksum(self, upload):
+        """
+        Get the SHA-512 hash object of the data received so far, either kept
+        in memory from the previous chunk or restored from the persisted state
+        and brought up to date from the temp file.
+        """
+        offset = self.requestOffset(upload)
+        checksum = _cachedHash(str(upload.get('_id')), offset)
+        if checksum is not None:
+            return checksum
+
+        # Restore the internal state of the streaming SHA-512 checksum. The
+        # persisted state may lag behind the data in the temp file, e.g. if
+        # the chunks were received by another process or the server died
+        # midway through writing the last chunk, so hash the difference.
+        checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
+        with open(upload['tempFile'], 'rb') as tempFile:
+            tempFile.seek(upload.get('sha512stateOffset', upload['received']))
+            while True:
+                data = tempFile.read(UPLOAD_BUF_SIZE)
+                if not data:
+                    break
+                checksum.update(data)
+        return checksum
+
     def requestOffset(self, upload):
         """
         Returns the size of the temp file.
@@ -195,7 +321,13 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         Moves the file into its permanent content-addressed location within the
         assetstore. Directory hierarchy yields 256^2 buckets.
         """
-        hash = _hash_state.restoreHex(upload['sha512state'], 'sha512').hexdigest()
+        if upload.get('deferSha512'):
+            return self._finalizeUnhashed(upload, file)
+
+        checksum = _cachedHash(str(upload.get('_id')), upload['received'])
+        if checksum is None:
+            checksum = self._restoreChecksum(upload)
+        hash = checksum.hexdigest()
         dir = os.path.join(hash[0:2], hash[2:4])
         absdir = os.path.join(self.assetstore['root'], dir)
 
@@ -233,6 +365,32 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return file
 
+    def _finalizeUnhashed(self, upload, file):
+        """
+        Move an upload whose SHA-512 is computed later into a unique location.
+        The hash is filled in by the hashsum_download plugin in the background
+        (see its ``_computeHash``) once the data.process event is handled.
+
+        Such files keep their unique location once they are hashed, so they
+        are never deduplicated, and they are left out of the files sharing the
+        content of a hashed file in `deleteFile`.
+        """
+        name = uuid.uuid4().hex
+        dir = os.path.join('unhashed', name[0:2])
+        path = os.path.join(dir, name)
+        abspath = os.path.join(self.assetstore['root'], path)
+
+        mkdir(os.path.join(self.assetstore['root'], dir))
+        shutil.move(upload['tempFile'], abspath)
+        try:
+            os.chmod(abspath, self.assetstore.get('perms', DEFAULT_PERMS))
+        except OSError:
+            pass
+
+        file['path'] = path
+        file['sha512Deferred'] = True
+        return file
+
     def fullPath(self, file):
         """
         Utility method for constructing the full (absolute) path to the given
@@ -260,29 +418,51 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 'girderformindlogger.utility.filesystem_assetstore_adapter.'
                 'file-does-not-exist')
 
+        if headers and self._offloadDownload(file, offset, endByte, contentDisposition):
+            return lambda: iter(())
+
         if headers:
             setResponseHeader('Accept-Ranges', 'bytes')
             self.setContentHeaders(file, offset, endByte, contentDisposition)
 
         def stream():
-            bytesRead = offset
-            with open(path, 'rb') as f:
-                if offset > 0:
-                    f.seek(offset)
-
-                while True:
-                    readLen = min(BUF_SIZE, endByte - bytesRead)
-                    if readLen <= 0:
-                        break
+            if endByte <= offset:
+                return
+            # Slicing a memory map copies straight from the page cache,
+            # without a read() call per buffer.
+            with open(path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = min(endByte, len(data))
+                for position in range(offset, end, DOWNLOAD_CHUNK_SIZE):
+                    yield data[position:min(position + DOWNLOAD_CHUNK_SIZE, end)]
 
-                    data = f.read(readLen)
-                    bytesRead += readLen
+        return stream
 
-                    if not data:
-                        break
-                    yield data
+    def _offloadDownload(self, file, offset, endByte, contentDisposition):
+        """
+        Hand the download over to the reverse proxy if ``sendfile_header`` is
+        set in the ``[assetstore]`` config section, e.g. to
+        ``X-Accel-Redirect`` for nginx, which then serves the file with
+        sendfile. The proxy handles Range requests itself, so this is only
+        done for whole files or ranges given by a Range header.
 
-        return stream
+        :returns: Whether the download was offloaded.
+        """
+        import cherrypy
+
+        conf = config.getConfig().get('assetstore', {})
+        header = conf.get('sendfile_header')
+        if not header or file.get('imported') or 'path' not in file:
+            return False
+        if 'Range' not in cherrypy.request.headers and (offset or endByte < file['size']):
+            return False
+
+        setResponseHeader(
+            'Content-Type', file.get('mimeType') or 'application/octet-stream')
+        setContentDisposition(file['name'], contentDisposition or 'attachment')
+        setResponseHeader(
+            header, '%s/%s' % (conf.get('sendfile_prefix', '/assetstore').rstrip('/'), file['path']))
+        return True
 
     def deleteFile(self, file):
         """
@@ -294,9 +474,19 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if file.get('imported') or 'path' not in file:
             return
 
+        if file.get('sha512Deferred'):
+            # Files hashed after the upload are stored under a unique name
+            try:
+                os.unlink(os.path.join(self.assetstore['root'], file['path']))
+            except OSError:
+                logger.exception('Failed to delete file %s' % file['path'])
+            return
+
         q = {
             'sha512': file['sha512'],
-            'assetstoreId': self.assetstore['_id']
+            'assetstoreId': self.assetstore['_id'],
+            # files hashed after the upload do not share the hashed location
+            'sha512Deferred': {'$ne': True}
         }
         path = os.path.join(self.assetstore['root'], file['path'])
         if os.path.isfile(path):
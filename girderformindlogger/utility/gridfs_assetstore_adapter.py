@@ -4,6 +4,7 @@ from hashlib import sha512
 import pymongo
 import six
 from six import BytesIO
+import threading
 import time
 import uuid
 
@@ -21,12 +22,84 @@ from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 # unless they are sending the final chunk.
 CHUNK_SIZE = 2097152
 
+# Number of chunks fetched from the database ahead of the one being sent.
+PREFETCH_CHUNKS = 8
+
 # Cache recent connections so we can skip some start up actions
 RECENT_CONNECTION_CACHE_TIME = 600  # seconds
 RECENT_CONNECTION_CACHE_MAX_SIZE = 100
 _recentConnections = {}
 
 
+def _prefetch(iterable, size=PREFETCH_CHUNKS):
+    """
+    Iterate over `iterable` in a background thread, keeping up to `size`
+    items ready, so that fetching the next batch of chunks from the database
+    overlaps with writing the current one to the client.
+    """
+    queue = six.moves.queue.Queue(maxsize=size)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        queue.put((item, None), timeout=1)
+                        break
+                    except six.moves.queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            queue.put((end, None))
+        except Exception as e:
+            queue.put((end, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def _streamChunks(chunks, offset, endByte, chunkOffset=0):
+    """
+    Yield the bytes between `offset` and `endByte` of a file from its chunks,
+    starting `chunkOffset` bytes into the first chunk. Whole chunks are
+    yielded as stored, and the first and last chunks of a range as memoryview
+    slices of the stored chunks, so no chunk is copied.
+    """
+    co = chunkOffset
+    position = offset
+
+    for chunk in chunks:
+        data = chunk['data']
+        chunkLen = len(data)
+        last = position + chunkLen - co >= endByte
+
+        if last:
+            chunkLen = endByte - position + co
+
+        if co or chunkLen < len(data):
+            yield memoryview(data)[co:chunkLen]
+        else:
+            yield data
+
+        if last:
+            break
+
+        position += chunkLen - co
+        co = 0
+
+
 def _ensureChunkIndices(collection):
     """
     Ensure that we have appropriate indices on the chunk collection.
@@ -260,32 +333,22 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
             n = offset // file['chunkSize']
             chunkOffset = offset % file['chunkSize']
 
-        cursor = self.chunkColl.find({
+        query = {
             'uuid': file['chunkUuid'],
             'n': {'$gte': n}
-        }, projection=['data']).sort('n', pymongo.ASCENDING)
-
-        def stream():
-            co = chunkOffset  # Can't assign to outer scope without "nonlocal"
-            position = offset
-            shouldBreak = False
-
-            for chunk in cursor:
-                chunkLen = len(chunk['data'])
-
-                if position + chunkLen - co > endByte:
-                    chunkLen = endByte - position + co
-                    shouldBreak = True
-
-                yield chunk['data'][co:chunkLen]
-
-                if shouldBreak:
-                    break
+        }
+        if endByte < file['size']:
+            query['n']['$lte'] = (endByte - 1) // file['chunkSize']
 
-                position += chunkLen - co
+        cursor = self.chunkColl.find(
+            query, projection=['data'], batch_size=PREFETCH_CHUNKS
+        ).sort('n', pymongo.ASCENDING)
 
-                if co > 0:
-                    co = 0
+        def stream():
+            for data in _streamChunks(_prefetch(cursor), offset, endByte, chunkOffset):
+                # WSGI servers only accept bytes, so the sliced chunks of a
+                # range response are copied here
+                yield bytes(data) if headers and isinstance(data, memoryview) else data
 
         return stream
 
@@ -12,10 +12,12 @@ from girderformindlogger.models.collection import Collection as CollectionModel
 from girderformindlogger.models.folder import Folder as FolderModel
 from girderformindlogger.models.item import Item as ItemModel
 from girderformindlogger.models.protocol import Protocol as ProtocolModel
+from girderformindlogger.models.protocol_history import ProtocolHistory
 from girderformindlogger.models.screen import Screen as ScreenModel
 from girderformindlogger.models.user import User as UserModel
-from girderformindlogger.utility import loadJSON
+from girderformindlogger.utility import jsonld_normalize, loadJSON
 from girderformindlogger.utility.response import responseDateList
+from girderformindlogger.utility.versions import versionKey
 from girderformindlogger.models.cache import Cache as CacheModel
 from bson.objectid import ObjectId
 from pyld import jsonld
@@ -193,6 +195,7 @@ def insertHistoryData(obj, identifier, modelType, baseVersion, historyFolder, hi
         '$push': {
             'meta.history': {
                 'version': baseVersion,
+                'versionKey': versionKey(baseVersion),
                 'reference': '{}/{}'.format(modelType, str(obj['_id'])) if obj else None,
                 'updated': now
             }
@@ -203,6 +206,9 @@ def insertHistoryData(obj, identifier, modelType, baseVersion, historyFolder, hi
         }
     })
 
+    ProtocolHistory().indexReferences([itemModel.findOne(
+        {'_id': referenceObj['_id']}, fields=['folderId', 'meta.identifier', 'meta.history'])])
+
     return obj
 
 def createProtocolFromExpandedDocument(protocol, user, editExisting=False, removed={}, baseVersion=None):
@@ -454,7 +460,7 @@ def createProtocolFromExpandedDocument(protocol, user, editExisting=False, remov
 
     for modelType in ['screen', 'activity', 'activityFlow']:
         for model in models[modelType]:
-            formatted = _fixUpFormat(formatLdObject(
+            formatted = _fixUpFormatted(formatLdObject(
                 model,
                 mesoPrefix=modelType,
                 user=user,
@@ -714,7 +720,7 @@ def updateContributions(protocol, document, user):
                     if baseItem.get('cached', None):
                         cache = loadCache(baseItem['cached'])
                     else:
-                        cache = _fixUpFormat(formatLdObject(
+                        cache = _fixUpFormatted(formatLdObject(
                             baseItem,
                             mesoPrefix='screen',
                             user=user
@@ -928,7 +934,7 @@ def importAndCompareModelType(model, url, user, modelType, meta={}, existing=Non
         )
         newModel['loadedFromSingleFile'] = False
 
-    formatted = _fixUpFormat(formatLdObject(
+    formatted = _fixUpFormatted(formatLdObject(
         newModel,
         mesoPrefix=modelType,
         user=user,
@@ -1166,9 +1172,7 @@ def reprolibPrefix(s):
     :returns: str
     """
     if isinstance(s, str):
-        for prefix in REPROLIB_PREFIXES:
-            if s.startswith(prefix) and s!=prefix:
-                return(s.replace(prefix, 'reprolib:'))
+        return(jsonld_normalize.reprolib_prefix(s))
     elif isinstance(s, dict):
         for k in s.keys():
             s[k] = reprolibPrefix(
@@ -1202,27 +1206,7 @@ def reprolibCanonize(s):
     :type s: str
     :returns: str
     """
-    if isinstance(s, str):
-        s = reprolibPrefix(s).replace('reprolib:', REPROLIB_CANONICAL)
-        return(s)
-        ##
-        ##Temporary disabled
-        ##
-        #if checkURL(s):
-        #    return(s)
-        #else:
-        #    return(None)
-    elif isinstance(s, list):
-        return([reprolibCanonize(ls) for ls in s])
-    elif isinstance(s, dict):
-        return({
-            reprolibCanonize(
-                k
-            ) if reprolibCanonize(
-                k
-            ) is not None else k: reprolibCanonize(v) for k, v in s.items()
-        })
-    return(s)
+    return(jsonld_normalize.canonize(s))
 
 
 def delanguageTag(obj):
@@ -1339,17 +1323,7 @@ def dereference(prefixed):
     :type prefixed: dict, list, str, or None
     :returns: dereferenced same-type
     """
-    if isinstance(prefixed, str):
-        d = reprolibCanonize(prefixed)
-        return(d if d is not None else prefixed)
-    elif isinstance(prefixed, dict):
-        return({
-            k: dereference(v) for k, v in prefixed.items()
-        })
-    elif isinstance(prefixed, list):
-        return([dereference(li) for li in prefixed])
-    else: # bool, int, float, None
-        return(prefixed)
+    return(jsonld_normalize.dereference(prefixed))
 
 
 def expand(obj, keepUndefined=False):
@@ -1559,38 +1533,12 @@ def loadCache(id):
     return cache
 
 def _fixUpFormat(obj):
-    if isinstance(obj, dict):
-        newObj = {}
-        for k in obj.keys():
-            rk = reprolibPrefix(k)
-            if k in KEYS_TO_DELANGUAGETAG:
-                newObj[rk] = reprolibCanonize(
-                    delanguageTag(obj[k])
-                )
-            elif k in KEYS_TO_DEREFERENCE:
-                newObj[rk] = dereference(obj[k])
-            elif isinstance(obj[k], list):
-                newObj[rk] = [_fixUpFormat(li) for li in obj[k]]
-            elif isinstance(obj[k], dict):
-                newObj[rk] = _fixUpFormat(obj[k])
-            else: # bool, int, float
-                newObj[rk] = obj[k]
-            if isinstance(obj[k], str) and k not in KEYS_TO_DEREFERENCE:
-                c = reprolibPrefix(obj[k])
-                newObj[rk] = c if c is not None else obj[k]
-            s2k = schemaPrefix(rk)
-            if s2k!=rk:
-                newObj[s2k] = newObj.pop(rk)
-        if "@context" in newObj:
-            newObj["@context"] = reprolibCanonize(newObj["@context"])
-        for k in ["schema:url", "http://schema.org/url"]:
-            if k in newObj and newObj[k] is not None:
-                newObj["url"] = newObj["schema:url"] = newObj[k]
-        return(newObj)
-    elif isinstance(obj, str):
-        return(reprolibPrefix(obj))
-    else:
-        return(obj)
+    return jsonld_normalize.normalize(obj)
+
+def _fixUpFormatted(obj):
+    # Output of formatLdObject is normalised already and owned by the caller,
+    # so the subtrees which do not change are not copied again.
+    return jsonld_normalize.normalize(obj, copy=False)
 
 def fixUpList(obj, modelType, dictionary, listKey):
     updated = False
@@ -1893,7 +1841,7 @@ def formatLdObject(
             return (_fixUpFormat(newObj))
     except:
         if refreshCache==False:
-            return(_fixUpFormat(formatLdObject(
+            return(_fixUpFormatted(formatLdObject(
                 obj,
                 mesoPrefix,
                 user,
@@ -1921,12 +1869,25 @@ def componentImport(
     :returns: protocol (updated)
     """
     import itertools
-    from girderformindlogger.models import pluralize, smartImport
+    from girderformindlogger.models import cycleModels, pluralize, smartImport
     from girderformindlogger.utility import firstLower
+    from girderformindlogger.utility.document_fetcher import getFetcher
 
     updatedProtocol = deepcopy(protocol)
     obj2 = {k: v for k, v in expand(deepcopy(obj)).items() if v is not None}
     try:
+        # fetch the documents which are not imported yet concurrently, so that
+        # importing them one by one below is served from the fetcher's cache
+        prefetch = set()
+        for order in obj2.get("reprolib:terms/order", {}):
+            for activity in order.get("@list", []):
+                IRI = activity.get('url', activity.get('@id'))
+                if isinstance(IRI, str) and not IRI.startswith("Document not found"):
+                    url = reprolibCanonize(IRI)
+                    if refreshCache or cycleModels({url, IRI}, meta=meta)[1] is None:
+                        prefetch.add(url)
+        getFetcher().prefetch(prefetch)
+
         for order in obj2.get(
             "reprolib:terms/order",
             {}
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Normalisation of expanded JSON-LD documents: reprolib urls are compacted to
+the ``reprolib:`` prefix, ``http://schema.org/`` keys to ``schema:``, and the
+values of url-like keys are de-language-tagged and canonized.
+
+Every key and string goes through the same few prefix rules, and the same
+strings come up in every activity and item, so their canonical forms are
+memoized. A document is normalised in a single traversal.
+"""
+from girderformindlogger.constants import KEYS_TO_DELANGUAGETAG, \
+    KEYS_TO_DEREFERENCE, REPROLIB_CANONICAL, REPROLIB_PREFIXES
+
+SCHEMA_PREFIX = 'http://schema.org/'
+
+# Every prefix starts with one of these, so most strings are rejected with a
+# single `startswith`.
+_PREFIX_HEADS = tuple({prefix[:5] for prefix in REPROLIB_PREFIXES})
+
+_DELANGUAGETAG = frozenset(KEYS_TO_DELANGUAGETAG)
+_DEREFERENCE = frozenset(KEYS_TO_DEREFERENCE)
+_URL_KEYS = ('schema:url', SCHEMA_PREFIX + 'url')
+
+# The memos are dropped once they grow past this many entries. Only urls
+# (strings which may have a prefix) of up to MEMO_MAX_LENGTH characters are
+# memoized, so free text and data uris are not kept in memory.
+MEMO_SIZE = 100000
+MEMO_MAX_LENGTH = 512
+
+_MEMO_HEADS = _PREFIX_HEADS + ('reprolib:',)
+
+_prefixed = {}
+_keys = {}
+_canonical = {}
+
+
+def _memoize(memo, value, result):
+    if len(value) <= MEMO_MAX_LENGTH:
+        if len(memo) >= MEMO_SIZE:
+            memo.clear()
+        memo[value] = result
+    return result
+
+
+def reprolib_prefix(s):
+    """
+    Compact a reprolib url to the ``reprolib:`` prefix.
+
+    :type s: str
+    :returns: str
+    """
+    if not s.startswith(_PREFIX_HEADS):
+        return s
+    try:
+        return _prefixed[s]
+    except KeyError:
+        pass
+
+    result = s
+    for prefix in REPROLIB_PREFIXES:
+        if s.startswith(prefix) and s != prefix:
+            result = s.replace(prefix, 'reprolib:')
+            break
+    return _memoize(_prefixed, s, result)
+
+
+def normalize_key(k):
+    """
+    Compact the reprolib and schema.org prefixes of a key.
+    """
+    if not isinstance(k, str) or not k.startswith(_PREFIX_HEADS):
+        return k
+    try:
+        return _keys[k]
+    except KeyError:
+        pass
+
+    result = reprolib_prefix(k)
+    if result.startswith(SCHEMA_PREFIX):
+        result = result.replace(SCHEMA_PREFIX, 'schema:')
+    return _memoize(_keys, k, result)
+
+
+def canonize(s):
+    """
+    Expand a (possibly prefixed) reprolib url to the canonical reprolib url.
+    Lists and dicts are canonized recursively, including dict keys.
+    """
+    if isinstance(s, str):
+        if not s.startswith(_MEMO_HEADS):
+            return s.replace('reprolib:', REPROLIB_CANONICAL) if 'reprolib:' in s else s
+        try:
+            return _canonical[s]
+        except KeyError:
+            return _memoize(
+                _canonical, s, reprolib_prefix(s).replace('reprolib:', REPROLIB_CANONICAL))
+    elif isinstance(s, list):
+        return [canonize(ls) for ls in s]
+    elif isinstance(s, dict):
+        return {canonize(k): canonize(v) for k, v in s.items()}
+    return s
+
+
+def dereference(prefixed):
+    """
+    Canonize every string of a value; dict keys are kept.
+    """
+    if isinstance(prefixed, str):
+        return canonize(prefixed)
+    elif isinstance(prefixed, dict):
+        return {k: dereference(v) for k, v in prefixed.items()}
+    elif isinstance(prefixed, list):
+        return [dereference(li) for li in prefixed]
+    return prefixed
+
+
+def delanguage_tag(obj):
+    """
+    Get the value of the last entry of a language-tagged list.
+    """
+    if not isinstance(obj, list):
+        return obj
+
+    data = (obj if len(obj) else [{}])[-1]
+    return data['@value'] if data.get('@value', '') else data.get('@id', '')
+
+
+def _same(new, old):
+    return new is old or (type(new) is str and new == old)
+
+
+def _normalizeList(obj, copy):
+    new = []
+    changed = copy
+    for li in obj:
+        if isinstance(li, dict):
+            value = _normalizeDict(li, copy)
+        elif isinstance(li, str):
+            value = reprolib_prefix(li)
+        else:
+            value = li
+        changed = changed or not _same(value, li)
+        new.append(value)
+    return new if changed else obj
+
+
+def _normalizeDict(obj, copy):
+    new = {}
+    changed = copy
+    for k, v in obj.items():
+        if k in _DELANGUAGETAG:
+            value = canonize(delanguage_tag(v))
+        elif k in _DEREFERENCE:
+            value = dereference(v)
+        elif isinstance(v, str):
+            value = reprolib_prefix(v)
+        elif isinstance(v, list):
+            value = _normalizeList(v, copy)
+        elif isinstance(v, dict):
+            value = _normalizeDict(v, copy)
+        else:
+            value = v
+
+        key = normalize_key(k)
+        changed = changed or key != k or not _same(value, v)
+        new[key] = value
+
+    if '@context' in new:
+        context = canonize(new['@context'])
+        if context != new['@context']:
+            new['@context'] = context
+            changed = True
+
+    for k in _URL_KEYS:
+        if k in new and new[k] is not None:
+            if new.get('url') is not new[k] or new.get('schema:url') is not new[k]:
+                changed = True
+            new['url'] = new['schema:url'] = new[k]
+
+    return new if changed else obj
+
+
+def normalize(obj, copy=True):
+    """
+    Normalise a formatted JSON-LD object.
+
+    :param obj: The object. Strings are prefixed; lists are returned as they
+        are, since their items have been normalised already.
+    :param copy: Whether to always return new dicts and lists. When False,
+        the dicts and lists which do not change are returned as they are, so
+        normalising an object twice costs a single traversal without any
+        allocation; only pass False for objects owned by the caller.
+    :returns: The normalised object.
+    """
+    if isinstance(obj, dict):
+        return _normalizeDict(obj, copy)
+    elif isinstance(obj, str):
+        return reprolib_prefix(obj)
+    return obj
@@ -3,6 +3,8 @@ import os
 import re
 import six
 import smtplib
+import threading
+import time
 
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -12,6 +14,7 @@ from mako.lookup import TemplateLookup
 from girderformindlogger import events
 from girderformindlogger import logger
 from girderformindlogger.constants import PACKAGE_DIR
+from girderformindlogger.utility import config
 from girderformindlogger.settings import SettingKey
 from girderformindlogger.exceptions import AccessException
 
@@ -193,17 +196,191 @@ class _SMTPConnection(object):
         self.connection.quit()
 
 
-def _submitEmail(msg, recipients):
+def _smtpSettings():
     from girderformindlogger.models.setting import Setting
 
     setting = Setting()
-    smtp = _SMTPConnection(
-        host=setting.get(SettingKey.SMTP_HOST),
-        port=setting.get(SettingKey.SMTP_PORT),
-        encryption=setting.get(SettingKey.SMTP_ENCRYPTION),
-        username=setting.get(SettingKey.SMTP_USERNAME),
-        password=setting.get(SettingKey.SMTP_PASSWORD)
-    )
+    return {
+        'host': setting.get(SettingKey.SMTP_HOST),
+        'port': setting.get(SettingKey.SMTP_PORT),
+        'encryption': setting.get(SettingKey.SMTP_ENCRYPTION),
+        'username': setting.get(SettingKey.SMTP_USERNAME),
+        'password': setting.get(SettingKey.SMTP_PASSWORD)
+    }
+
+
+class _SMTPSession(object):
+    """
+    A long-lived, authenticated SMTP session. The connection is opened on
+    first use, checked with NOOP after being idle, and reopened whenever it
+    was dropped.
+    """
+
+    def __init__(self, host, port=None, encryption=None, username=None,
+                 password=None, idleCheck=30):
+        self.host = host
+        self.port = port
+        self.encryption = encryption
+        self.username = username
+        self.password = password
+        self.idleCheck = idleCheck
+        self.connection = None
+        self.lastUsed = 0
+
+    def _connect(self):
+        if self.encryption == 'ssl':
+            connection = smtplib.SMTP_SSL(self.host, self.port)
+        else:
+            connection = smtplib.SMTP(self.host, self.port)
+            if self.encryption == 'starttls':
+                connection.starttls()
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        return connection
+
+    def send(self, fromAddress, toAddresses, message):
+        """
+        Send a message, reconnecting once if the server closed the session.
+
+        :returns: The recipients refused by the server, as returned by
+            ``smtplib.SMTP.sendmail``.
+        """
+        if self.connection is not None and time.time() - self.lastUsed > self.idleCheck:
+            try:
+                if self.connection.noop()[0] != 250:
+                    self.close()
+            except smtplib.SMTPException:
+                self.close()
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self._connect()
+            try:
+                refused = self.connection.sendmail(fromAddress, toAddresses, message)
+                self.lastUsed = time.time()
+                return refused
+            except smtplib.SMTPServerDisconnected:
+                self.connection = None
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.connection = None
+
+
+class MailDelivery(object):
+    """
+    Delivers the messages of the persistent mail queue.
+
+    Each of the `workers` threads holds its own SMTP session, claims batches
+    of up to `batchSize` messages and sends them over that session. The SMTP
+    settings are read for every batch, and the session is reopened when they
+    changed. Messages
+    are retried with exponential backoff when the server cannot be reached or
+    temporarily refuses some recipients.
+
+    Configured in the ``[mail]`` config section. The threads are started in
+    the API process on first use unless ``workers`` is 0, in which case the
+    queue is served by ``girderformindlogger/external/mail_delivery.py``.
+    """
+
+    def __init__(self, queue=None, workers=None, batchSize=None, maxAttempts=None,
+                 backoff=None, pollInterval=1.0, settings=None):
+        from girderformindlogger.models.mail_queue import MailQueue
+
+        conf = config.getConfig().get('mail', {})
+        self.queue = queue or MailQueue()
+        self.workers = int(conf.get('workers', 4) if workers is None else workers)
+        self.batchSize = int(batchSize or conf.get('batch_size', 20))
+        self.maxAttempts = int(maxAttempts or conf.get('max_attempts', 5))
+        self.backoff = float(conf.get('backoff', 30) if backoff is None else backoff)
+        self.pollInterval = pollInterval
+        self.settings = settings or _smtpSettings
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self.run, name='MailDelivery-%d' % i, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def notify(self):
+        self.wakeup.set()
+
+    def run(self):
+        session, settings = None, None
+        try:
+            while not self.stopping.is_set():
+                try:
+                    messages = self.queue.claim(self.batchSize)
+                    if not messages:
+                        self.wakeup.wait(self.pollInterval)
+                        self.wakeup.clear()
+                        continue
+
+                    # the SMTP settings can be changed by admins at any time
+                    current = self.settings()
+                    if current != settings:
+                        if session is not None:
+                            session.close()
+                        session, settings = _SMTPSession(**current), current
+
+                    for message in messages:
+                        self.deliver(session, message)
+                except Exception:
+                    # claimed messages are handed out again when their lease ends
+                    logger.exception('Mail delivery failed')
+                    self.stopping.wait(self.pollInterval)
+        finally:
+            if session is not None:
+                session.close()
+
+    def deliver(self, session, message):
+        recipients = self.queue.pendingRecipients(message)
+        try:
+            refused = session.send(message['fromAddress'], recipients, message['message'])
+        except smtplib.SMTPRecipientsRefused as e:
+            refused = e.recipients
+        except (smtplib.SMTPException, OSError) as e:
+            logger.warning('Could not send email to %s: %s', ', '.join(recipients), e)
+            session.close()
+            self.queue.markFailed(message, e, self.maxAttempts, self.backoff)
+            return
+
+        self.queue.markDelivered(message, refused, self.maxAttempts, self.backoff)
+
+
+_delivery = None
+_deliveryLock = threading.Lock()
+
+
+def _getDelivery():
+    global _delivery
+
+    with _deliveryLock:
+        if _delivery is None:
+            _delivery = MailDelivery()
+            _delivery.start()
+        return _delivery
+
+
+def _submitEmail(msg, recipients):
+    smtp = _SMTPConnection(**_smtpSettings())
 
     logger.info('Sending email to %s through %s', ', '.join(recipients), smtp.host)
 
@@ -229,7 +406,8 @@ def sendMailSync(subject, text, to, bcc=None, attachments=[]):
 
 def sendMail(subject, text, to, bcc=None, attachments=[]):
     """
-    Send an email asynchronously.
+    Send an email asynchronously. The message is stored in the mail queue and
+    delivered by `MailDelivery`.
 
     :param subject: The subject line of the email.
     :type subject: str
@@ -242,10 +420,9 @@ def sendMail(subject, text, to, bcc=None, attachments=[]):
     """
     msg, recipients = _createMessage(subject, text, to, bcc, attachments)
 
-    events.daemon.trigger('_sendmail', info={
-        'message': msg,
-        'recipients': recipients
-    })
+    delivery = _getDelivery()
+    delivery.queue.enqueue(msg.as_string(), msg['From'], recipients)
+    delivery.notify()
 
 
 def sendMailToAdmins(subject, text):
@@ -1,20 +1,305 @@
+import asyncio
+import json
+import os
+import random
+import threading
 import time
 
+import aiohttp
+from collections import OrderedDict
 from pyfcm import FCMNotification
-from concurrent.futures.thread import ThreadPoolExecutor
+from pyfcm.errors import AuthenticationError, InvalidDataError, FCMServerError
 
+# Per-device errors meaning the token will never be valid again.
+INVALID_TOKEN_ERRORS = ('NotRegistered', 'InvalidRegistration', 'MismatchSenderId')
+# Per-device errors which are worth retrying later.
+RETRY_TOKEN_ERRORS = ('Unavailable', 'InternalServerError', 'DeviceMessageRateExceeded')
 
-class FirebaseNotification(FCMNotification):
-    def do_request(self, payload, timeout=5):
-        response = self.requests_session.post(self.FCM_END_POINT, data=payload, timeout=timeout)
-        if 'Retry-After' in response.headers and int(response.headers['Retry-After']) > 0:
-            sleep_time = int(response.headers['Retry-After'])
-            time.sleep(sleep_time)
-            return self.do_request(payload, timeout)
+
+class TokenBucket(object):
+    """
+    Rate limiter allowing `rate` requests per second with bursts of up to
+    `capacity` requests. Waiting for a token never blocks the event loop, and
+    the bucket can be shared by the event loops of several threads.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    async def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class FCMSender(object):
+    """
+    Asynchronous sender for the FCM legacy HTTP API.
+
+    Messages with the same content are coalesced into multicast requests of up
+    to `FCM_MAX_RECIPIENTS` device tokens, which are then posted concurrently
+    over a pooled connection, throttled by a token bucket. Failed requests and
+    devices that were temporarily unavailable are retried with exponential
+    backoff (honouring `Retry-After`). Tokens reported as invalid or replaced
+    by a canonical id are passed to `on_invalid_tokens` so that they can be
+    removed from user profiles.
+
+    `send` keeps an event loop and a session per thread, so the connections
+    to FCM are reused by the following calls of the same thread (e.g. the
+    jobs of an rq worker).
+
+    The endpoint, concurrency and rate limit can be set through the
+    ``FCM_END_POINT``, ``FCM_CONCURRENCY`` and ``FCM_RATE_LIMIT`` environment
+    variables, e.g. to run against `girderformindlogger/external/fake_fcm.py`.
+    """
+
+    def __init__(self, api_key, endpoint=None, concurrency=None, rate=None,
+                 max_retries=5, backoff=0.5, timeout=10, on_invalid_tokens=None):
+        self.api_key = api_key
+        self.endpoint = endpoint or os.environ.get('FCM_END_POINT', FCMNotification.FCM_END_POINT)
+        self.concurrency = int(concurrency or os.environ.get('FCM_CONCURRENCY', 32))
+        self.bucket = TokenBucket(rate or os.environ.get('FCM_RATE_LIMIT', 200))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.on_invalid_tokens = on_invalid_tokens
+        self._local = threading.local()
+
+    @staticmethod
+    def coalesce(messages):
+        """
+        Merge messages with identical content into multicast messages of at
+        most `FCM_MAX_RECIPIENTS` distinct device tokens. Topic and condition
+        messages are passed through unchanged.
+
+        :param messages: FCM payloads, addressed with `to` or `registration_ids`.
+        :type messages: list
+        :returns: The list of payloads to post.
+        """
+        groups = OrderedDict()
+        others = []
+
+        for message in messages:
+            message = dict(message)
+            if 'registration_ids' in message:
+                tokens = message.pop('registration_ids')
+            elif 'to' in message and not message['to'].startswith('/topics/'):
+                tokens = [message.pop('to')]
+            else:
+                others.append(message)
+                continue
+
+            key = json.dumps(message, sort_keys=True)
+            groups.setdefault(key, (message, []))[1].extend(tokens)
+
+        payloads = []
+        for message, tokens in groups.values():
+            tokens = [token for token in OrderedDict.fromkeys(tokens) if token]
+            for i in range(0, len(tokens), FCMNotification.FCM_MAX_RECIPIENTS):
+                payloads.append(dict(
+                    message,
+                    registration_ids=tokens[i:i + FCMNotification.FCM_MAX_RECIPIENTS]
+                ))
+        return payloads + others
+
+    def send(self, messages):
+        """
+        Send messages from synchronous code, through the event loop and the
+        session of the calling thread.
+
+        :returns: The merged response, in the format of
+            `FCMNotification.parse_responses`.
+        """
+        loop = getattr(self._local, 'loop', None)
+        if loop is None or loop.is_closed():
+            loop = self._local.loop = asyncio.new_event_loop()
+
+        return loop.run_until_complete(self._send_pooled(messages))
+
+    def close(self):
+        """
+        Close the session and the event loop of the calling thread.
+        """
+        loop = getattr(self._local, 'loop', None)
+        session = getattr(self._local, 'session', None)
+        if loop is None or loop.is_closed():
+            return
+
+        if session is not None and not session.closed:
+            loop.run_until_complete(session.close())
+        loop.close()
+        self._local.session = None
+
+    def _session(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                'Content-Type': FCMNotification.CONTENT_TYPE,
+                'Authorization': 'key=' + self.api_key
+            },
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def _send_pooled(self, messages):
+        session = getattr(self._local, 'session', None)
+        if session is None or session.closed:
+            session = self._local.session = self._session()
+        return await self.send_async(messages, session)
+
+    async def send_async(self, messages, session=None):
+        """
+        Send messages from a coroutine.
+
+        :param session: The session to post with. A session is opened for the
+            call if it is not given.
+        """
+        payloads = self.coalesce(messages)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if session is None:
+            async with self._session() as session:
+                responses = await asyncio.gather(*[
+                    self._post(session, semaphore, payload) for payload in payloads
+                ])
+        else:
+            responses = await asyncio.gather(*[
+                self._post(session, semaphore, payload) for payload in payloads
+            ])
+
+        response_dict = {
+            'multicast_ids': [],
+            'success': 0,
+            'failure': 0,
+            'canonical_ids': 0,
+            'results': [],
+            'topic_message_id': None
+        }
+        invalid = set()
+        canonical = {}
+        for response in responses:
+            for key in ('success', 'failure', 'canonical_ids'):
+                response_dict[key] += response[key]
+            response_dict['multicast_ids'].extend(response['multicast_ids'])
+            response_dict['results'].extend(response['results'])
+            response_dict['topic_message_id'] = response['topic_message_id'] or \
+                response_dict['topic_message_id']
+            invalid.update(response['invalid'])
+            canonical.update(response['canonical'])
+
+        if (invalid or canonical) and self.on_invalid_tokens:
+            self.on_invalid_tokens(list(invalid), canonical)
+
+        return response_dict
+
+    async def _post(self, session, semaphore, payload):
+        tokens = payload.get('registration_ids')
+        results = OrderedDict((token, None) for token in tokens or [])
+        response = {
+            'multicast_ids': [],
+            'success': 0,
+            'failure': 0,
+            'canonical_ids': 0,
+            'topic_message_id': None,
+            'invalid': [],
+            'canonical': {}
+        }
+        pending = tokens
+
+        for attempt in range(self.max_retries + 1):
+            status, retryAfter, body = await self._request(
+                session, semaphore, dict(payload, registration_ids=pending) if tokens else payload)
+
+            if status == 200:
+                if body.get('multicast_id'):
+                    response['multicast_ids'].append(body['multicast_id'])
+                if body.get('message_id'):
+                    response['topic_message_id'] = body['message_id']
+                    response['success'] += 1
+
+                retry = []
+                for token, result in zip(pending or [], body.get('results', [])):
+                    results[token] = result
+                    error = result.get('error')
+                    if error in RETRY_TOKEN_ERRORS:
+                        retry.append(token)
+                    elif error in INVALID_TOKEN_ERRORS:
+                        response['invalid'].append(token)
+                    elif result.get('registration_id'):
+                        response['canonical'][token] = result['registration_id']
+
+                if not retry:
+                    break
+                pending = retry
+            elif status == 401:
+                raise AuthenticationError('There was an error authenticating the sender account')
+            elif status == 400:
+                raise InvalidDataError(body)
+            elif attempt == self.max_retries and not tokens:
+                raise FCMServerError('FCM server is temporarily unavailable')
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._delay(attempt, retryAfter))
+
+        for result in results.values():
+            if result and 'message_id' in result:
+                response['success'] += 1
+                if result.get('registration_id'):
+                    response['canonical_ids'] += 1
+            else:
+                response['failure'] += 1
+        response['results'] = [
+            result or {'error': 'Unavailable'} for result in results.values()
+        ]
         return response
 
+    async def _request(self, session, semaphore, payload):
+        await self.bucket.acquire()
+        async with semaphore:
+            try:
+                async with session.post(self.endpoint, json=payload) as response:
+                    retryAfter = response.headers.get('Retry-After')
+                    if response.status == 200:
+                        return response.status, retryAfter, await response.json(content_type=None)
+                    return response.status, retryAfter, await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None, None, None
+
+    def _delay(self, attempt, retryAfter=None):
+        delay = self.backoff * (2 ** attempt)
+        try:
+            delay = max(delay, float(retryAfter or 0))
+        except ValueError:
+            pass
+        return min(delay, 60) * (1 + random.random() / 10)
+
+
+class FirebaseNotification(FCMNotification):
+    """
+    pyfcm client whose requests are sent through `FCMSender`.
+    """
+
+    def __init__(self, *args, on_invalid_tokens=None, **kwargs):
+        super(FirebaseNotification, self).__init__(*args, **kwargs)
+        self.sender = FCMSender(self._FCM_API_KEY, on_invalid_tokens=on_invalid_tokens)
+        self.send_request_response = None
+
     def send_request(self, payloads=None, timeout=None):
-        self.send_request_responses = []
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            response = executor.map(self.do_request, payloads)
-            executor.map(self.send_request_responses.append, response)
+        self.send_request_response = self.sender.send([
+            json.loads(payload) for payload in payloads or []
+        ])
+
+    def parse_responses(self):
+        return self.send_request_response
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+
+import six
+
+from redis.exceptions import RedisError
+
+from girderformindlogger import logger
+from girderformindlogger.utility import JsonEncoder, config
+
+NOTIFICATION_CHANNEL = 'notifications'
+
+# Put on the queues of the subscribers which may have missed notifications,
+# which should then read them from the database.
+RESYNC = object()
+
+
+def recipientKey(doc):
+    """
+    The key of the recipient (user or token) of a notification.
+    """
+    if doc.get('userId'):
+        return 'user:%s' % doc['userId']
+    return 'token:%s' % doc.get('tokenId')
+
+
+def publish(doc, connection=None):
+    """
+    Publish a saved notification to the brokers of every process.
+    """
+    from girderformindlogger.models import getRedisConnection
+
+    try:
+        (connection or getRedisConnection()).publish(
+            NOTIFICATION_CHANNEL, json.dumps(doc, allow_nan=False, cls=JsonEncoder))
+    except RedisError as e:
+        logger.warning('Could not publish notification %s: %s', doc.get('_id'), e)
+
+
+class NotificationBroker(object):
+    """
+    Fans the notifications published on Redis out to the notification streams
+    of this process.
+
+    A single thread listens on the notification channel and puts each
+    notification on the queues of the streams of its recipient, so an idle
+    stream waits on its queue without querying the database. Streams whose
+    queue overflows, and every stream after the connection to Redis was lost,
+    receive `RESYNC` and catch up from the database.
+
+    Configured in the ``[notification]`` config section.
+    """
+
+    def __init__(self, connection=None, queueSize=None):
+        conf = config.getConfig().get('notification', {})
+        self.connection = connection
+        self.queueSize = int(queueSize or conf.get('queue_size', 1000))
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.ready = threading.Event()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='NotificationBroker', daemon=True)
+                self.thread.start()
+
+    def subscribe(self, key):
+        """
+        Get a queue receiving the notifications of a recipient.
+
+        :param key: The recipient key, see `recipientKey`.
+        :returns: The queue, to be passed to `unsubscribe`.
+        """
+        queue = six.moves.queue.Queue(self.queueSize)
+        with self.lock:
+            self.subscribers.setdefault(key, set()).add(queue)
+        self.start()
+        self.ready.wait(5)
+        return queue
+
+    def unsubscribe(self, key, queue):
+        with self.lock:
+            queues = self.subscribers.get(key, set())
+            queues.discard(queue)
+            if not queues:
+                self.subscribers.pop(key, None)
+
+    def streamCount(self):
+        with self.lock:
+            return sum(len(queues) for queues in self.subscribers.values())
+
+    def _put(self, queue, item):
+        try:
+            queue.put_nowait(item)
+        except six.moves.queue.Full:
+            with queue.mutex:
+                queue.queue.clear()
+            queue.put_nowait(RESYNC)
+
+    def dispatch(self, doc):
+        with self.lock:
+            queues = list(self.subscribers.get(recipientKey(doc), ()))
+        for queue in queues:
+            self._put(queue, doc)
+
+    def resync(self):
+        with self.lock:
+            queues = [queue for queues in self.subscribers.values() for queue in queues]
+        for queue in queues:
+            self._put(queue, RESYNC)
+
+    def run(self):
+        from girderformindlogger.models import getRedisConnection
+
+        connected = False
+        while True:
+            try:
+                pubsub = (self.connection or getRedisConnection()).pubsub(
+                    ignore_subscribe_messages=True)
+                pubsub.subscribe(NOTIFICATION_CHANNEL)
+                if connected:
+                    self.resync()
+                connected = True
+                self.ready.set()
+
+                for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    try:
+                        doc = json.loads(message['data'])
+                    except ValueError:
+                        continue
+                    self.dispatch(doc)
+            except RedisError as e:
+                logger.warning('Notification broker was disconnected: %s', e)
+                time.sleep(2)
+
+
+_broker = None
+_brokerLock = threading.Lock()
+
+
+def getBroker():
+    global _broker
+
+    with _brokerLock:
+        if _broker is None:
+            _broker = NotificationBroker()
+        return _broker
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Recurrence rules of scheduled events.
+
+The triggers of an event are computed from its ``schedule`` and ``data``
+with integer arithmetic on dates and minutes of the day, without formatting
+and parsing datetimes along the way. The same rules decide when a trigger
+fires next, see `next_fire`.
+"""
+import calendar
+import datetime
+import random
+
+from girderformindlogger import logger
+
+ONE_TIME = ''
+DAILY = 'Daily'
+WEEKLY = 'Weekly'
+MONTHLY = 'Monthly'
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def format_date(date):
+    """
+    Format a date as stored in the triggers (YYYY/MM/DD).
+    """
+    return '%04d/%02d/%02d' % (date.year, date.month, date.day)
+
+
+def parse_date(value):
+    return datetime.date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+
+
+def parse_time(value):
+    """
+    Get the minute of the day of a HH:MM time.
+    """
+    hour, minute = value.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def format_time(minutes):
+    return '%02d:%02d' % divmod(minutes % (24 * 60), 60)
+
+
+def _fromTimestamp(value):
+    return datetime.datetime.fromtimestamp(float(value) / 1000).date()
+
+
+def schedule_range(event, today):
+    """
+    Get the first and last date (inclusive) an event is active on.
+
+    :param event: The event.
+    :type event: dict
+    :param today: The date used as start when the schedule has none.
+    :type today: datetime.date
+    :returns: ``(start, end)``, where `end` is None for open-ended events.
+    """
+    schedule = event.get('schedule', {})
+
+    if event.get('data', {}).get('eventType', '') == ONE_TIME:
+        date = datetime.date(
+            schedule['year'][0], schedule['month'][0] + 1, schedule['dayOfMonth'][0])
+        return date, date
+
+    start = schedule.get('start', None)
+    end = schedule.get('end', None)
+    return (
+        _fromTimestamp(start) if start else today,
+        _fromTimestamp(end) if end else None
+    )
+
+
+def _trigger(event, minute, start, end, today, isReminder=False):
+    event_type = event.get('data', {}).get('eventType', '')
+    schedule = event.get('schedule', {})
+
+    trigger = {
+        'time': format_time(minute),
+        'start': format_date(start) if start else None,
+        'end': format_date(end) if end else None,
+        'reminder': isReminder,
+        'type': 'event-alert' if event_type in (WEEKLY, MONTHLY) else 'schedule-updated'
+    }
+
+    if event_type == WEEKLY:
+        trigger['dayOfWeek'] = schedule.get('dayOfWeek', [(today.weekday() + 1) % 7])[0]
+
+    if event_type == MONTHLY:
+        trigger['dayOfMonth'] = schedule.get('dayOfMonth', [today.day])[0]
+
+    return trigger
+
+
+def build_triggers(event, now=None, rng=random):
+    """
+    Compute the notification triggers of an event.
+
+    A notification with ``random`` set fires once at a random minute between
+    its ``start`` and ``end``; the notifications after it are ignored and it
+    is the only send time reported to the app.
+
+    :param event: The event.
+    :type event: dict
+    :param now: The current (UTC) time, defaults to now.
+    :type now: datetime.datetime
+    :param rng: The random generator used for random notifications.
+    :returns: ``(triggers, sendTime)``, the triggers to register in the
+        timing wheel and the send times to store on the event.
+    """
+    now = now or datetime.datetime.utcnow()
+    today = now.date()
+    data = event.get('data', {})
+    triggers = []
+    sendTime = []
+
+    try:
+        start, end = schedule_range(event, today)
+    except (KeyError, IndexError, TypeError, ValueError):
+        logger.exception('Invalid schedule of event %s', event.get('_id'))
+        return [], []
+
+    reminder = data.get('reminder', {})
+    if reminder.get('valid', False):
+        days = datetime.timedelta(days=int(reminder.get('days', 0)))
+        triggers.append(_trigger(
+            event, parse_time(reminder.get('time', '00:00') or '00:00'),
+            start + days, end + days if end else None, today, True))
+        sendTime.append(triggers[-1]['time'])
+
+    for notification in data.get('notifications', []):
+        if not notification.get('start'):
+            continue
+
+        try:
+            minute = parse_time(notification['start'])
+
+            if notification.get('random'):
+                last = parse_time(notification['end']) if notification.get('end') else minute
+                if last > minute:
+                    minute = rng.randrange(minute, last)
+                triggers.append(_trigger(event, minute, start, end, today))
+                sendTime = [triggers[-1]['time']]
+                break
+
+            triggers.append(_trigger(event, minute, start, end, today))
+            sendTime.append(triggers[-1]['time'])
+        except (KeyError, ValueError):
+            logger.exception('Invalid notification of event %s', event.get('_id'))
+
+    return triggers, sendTime
+
+
+def _alignMonth(date, dayOfMonth):
+    """
+    Get the first date on or after `date` falling on `dayOfMonth`; months
+    without that day are skipped.
+    """
+    year, month = date.year, date.month
+    if date.day > dayOfMonth:
+        month += 1
+    while True:
+        if month > 12:
+            year, month = year + 1, 1
+        if dayOfMonth <= calendar.monthrange(year, month)[1]:
+            return datetime.date(year, month, dayOfMonth)
+        month += 1
+
+
+def next_fire(trigger, after):
+    """
+    Get the next time a trigger fires.
+
+    :param trigger: A trigger, as returned by `build_triggers`.
+    :type trigger: dict
+    :param after: The (local) time to search from, inclusive.
+    :type after: datetime.datetime
+    :returns: The local datetime of the next notification, or None if the
+        trigger does not fire anymore.
+    """
+    minute = parse_time(trigger['time'])
+    date = after.date()
+    if after.hour * 60 + after.minute > minute:
+        date += ONE_DAY
+
+    if trigger.get('start'):
+        date = max(date, parse_date(trigger['start']))
+
+    if trigger.get('dayOfWeek') is not None:
+        date += datetime.timedelta(days=(trigger['dayOfWeek'] - (date.weekday() + 1)) % 7)
+    elif trigger.get('dayOfMonth') is not None:
+        date = _alignMonth(date, trigger['dayOfMonth'])
+
+    if trigger.get('end') and date > parse_date(trigger['end']):
+        return None
+
+    return datetime.datetime(date.year, date.month, date.day, *divmod(minute, 60))
@@ -14,6 +14,7 @@ from girderformindlogger.models.response_folder import ResponseItem
 from girderformindlogger.models.response_tokens import ResponseTokens
 from girderformindlogger.models.account_profile import AccountProfile
 from girderformindlogger.utility import clean_empty
+from girderformindlogger.utility.versions import versionKey
 from pandas.api.types import is_numeric_dtype
 from pymongo import ASCENDING, DESCENDING
 from bson import json_util
@@ -183,6 +184,7 @@ def aggregate(metadata, informant, startDate=None, endDate=None, activities=[],
                     ),
                     "date": completedDate(response),
                     "version": response.get('meta', {}).get('applet', {}).get('version', '0.0.0'),
+                    "versionKey": responseVersionKey(response),
                     "activityFlow": response.get('meta', {}).get('activityFlow', {}).get('@id')
                 } for response in responses if itemIRI in response.get(
                     'meta',
@@ -363,6 +365,7 @@ def last7Days(
         for resp in outputResponses[item]:
             resp['date'] = delocalize(resp['date'])
             if not groupByDateActivity:
+                resp.pop('versionKey')
                 resp['datetime'] = resp['date']
                 resp['date'] = determine_date(resp['date'] + timedelta(hours=profile['timezone']))
 
@@ -422,12 +425,13 @@ def determine_date(d):
         ) if isinstance(d, str) else d
     ).date())
 
-def convertToComparableVersion(version):
-    values = version.split('.')
-    for i in range(0, len(values)):
-        values[i] = '0' * (20 - len(values[i])) + values[i]
+def responseVersionKey(response):
+    applet = response.get('meta', {}).get('applet', {})
+    if 'versionKey' in applet:
+        return applet['versionKey']
 
-    return '.'.join(values)
+    # responses stored before version keys
+    return versionKey(applet.get('version', '0.0.0'))
 
 def isodatetime(d):
     if isinstance(d, int):
@@ -565,10 +569,9 @@ def _oneResponsePerDatePerVersion(responses, offset):
 
         df["date"] = df.date + timedelta(hours=offset)
         df["date"] = df.date.apply(determine_date)
-        df["versionValue"] = df.version.apply(convertToComparableVersion)
 
-        df.sort_values(by=['datetime', 'versionValue'], ascending=False, inplace=True)
-        df = df.groupby(['date', 'versionValue']).first()
+        df.sort_values(by=['datetime', 'versionKey'], ascending=False, inplace=True)
+        df = df.groupby(['date', 'versionKey']).first()
 
         df.drop('datetime', axis=1, inplace=True)
 
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Resolution of the roles of users on applets.
+
+The roles of a user on an applet are read from their applet profile once per
+request and memoised in the request cache, so the role checks of an endpoint
+(``isCoordinator``, ``isManager``, ``isReviewer``, ...) share a single profile
+lookup. Writes to profiles bump a per-request generation which is part of the
+cache keys, so a request sees the roles it has just changed.
+"""
+import cherrypy
+from bson.objectid import ObjectId
+
+from girderformindlogger.utility._cache import requestCache
+
+
+def _generation():
+    return getattr(cherrypy.request, 'girderProfileGeneration', 0)
+
+
+def profilesChanged():
+    """
+    Forget the roles resolved so far in the current request. Called on every
+    write to applet profiles.
+    """
+    cherrypy.request.girderProfileGeneration = _generation() + 1
+
+
+@requestCache.cache_on_arguments()
+def _resolveUserId(id):
+    from girderformindlogger.models.profile import Profile
+    from girderformindlogger.models.user import User
+
+    if User().findOne({'_id': ObjectId(id)}, fields=['_id']) is not None:
+        return ObjectId(id)
+
+    profile = Profile().findOne({'_id': ObjectId(id)}, fields=['userId'])
+    return profile.get('userId') if profile else None
+
+
+def userIdOf(user):
+    """
+    The id of a user given as a user document, an applet profile or the id of
+    either of them.
+
+    :returns: The user id, or None if there is no such user.
+    """
+    if isinstance(user, dict):
+        if 'appletId' in user and 'userId' in user:
+            return ObjectId(user['userId'])
+        if 'login' in user:
+            return user['_id']
+        user = user.get('_id')
+
+    return _resolveUserId(str(user)) if user else None
+
+
+@requestCache.cache_on_arguments()
+def _appletRoles(appletId, userId, generation):
+    from girderformindlogger.models.profile import Profile
+
+    profile = Profile().findOne({
+        'appletId': ObjectId(appletId),
+        'userId': ObjectId(userId)
+    }, fields=['roles', 'deactivated'])
+
+    if not profile or profile.get('deactivated', False):
+        return ()
+    return tuple(profile.get('roles', []))
+
+
+def getAppletRoles(appletId, user):
+    """
+    The roles of a user on an applet; none if their profile is deactivated.
+
+    :param appletId: The applet id.
+    :param user: The user, see `userIdOf`.
+    :returns: tuple of roles
+    """
+    userId = userIdOf(user)
+    if userId is None:
+        return ()
+
+    return _appletRoles(str(appletId), str(userId), _generation())
+
+
+def hasRole(appletId, user, role):
+    return role in getAppletRoles(appletId, user)
+
+
+def getAppletIds(userId, role, active=True):
+    """
+    The ids of the applets on which a user has a role, with one indexed query.
+
+    :param userId: The user id.
+    :param role: The role.
+    :param active: Skip the deactivated profiles.
+    :type active: bool
+    :returns: list of applet ids
+    """
+    from girderformindlogger.models.profile import Profile
+
+    query = {
+        'userId': ObjectId(userId),
+        'roles': role,
+        'profile': True
+    }
+    if active:
+        query['deactivated'] = {'$ne': True}
+
+    return [profile['appletId'] for profile in Profile().find(query, fields=['appletId'])]
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+
+from girderformindlogger.utility.recurrence import format_date
+
+# One slot per minute of the (local) day.
+WHEEL_SLOTS = 24 * 60
+
+# Profile timezones are stored as hour offsets rounded to quarter hours.
+TIMEZONE_OFFSETS = [offset / 4 for offset in range(-12 * 4, 14 * 4 + 1)]
+
+DATE_FORMAT = '%Y/%m/%d'
+
+
+def slot_for(hour, minute):
+    """
+    Get the wheel slot for a local time of day.
+    """
+    return (int(hour) * 60 + int(minute)) % WHEEL_SLOTS
+
+
+def is_due(trigger, local_date):
+    """
+    Check whether a trigger fires on the given local date.
+
+    :param trigger: A trigger as stored in the wheel.
+    :type trigger: dict
+    :param local_date: The date in the recipient's timezone.
+    :type local_date: datetime.date
+    """
+    day = format_date(local_date)
+
+    if trigger.get('start') and day < trigger['start']:
+        return False
+    if trigger.get('end') and day > trigger['end']:
+        return False
+    if trigger.get('dayOfWeek') is not None \
+            and (local_date.weekday() + 1) % 7 != trigger['dayOfWeek']:
+        return False
+    if trigger.get('dayOfMonth') is not None \
+            and local_date.day != trigger['dayOfMonth']:
+        return False
+    return True
+
+
+class TimingWheel(object):
+    """
+    A minute-resolution timing wheel for notification triggers, kept in redis.
+
+    Each of the ``WHEEL_SLOTS`` slots is a set holding every trigger that fires
+    at that local time of day, whatever the applet. A tick at a given UTC
+    minute reads the slot matching that minute in every timezone bucket, so the
+    number of keys is bounded by the size of the wheel rather than by the
+    number of events. An index set per event remembers where its triggers live
+    so they can be removed when the event is rescheduled or deleted.
+    """
+
+    SLOT_KEY = 'notification:wheel:slot:{}'
+    EVENT_KEY = 'notification:wheel:event:{}'
+    TICK_KEY = 'notification:wheel:tick:{}'
+    CURSOR_KEY = 'notification:wheel:cursor'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def add(self, event_id, triggers):
+        """
+        Register the triggers of an event.
+
+        :param event_id: The id of the event the triggers belong to.
+        :param triggers: Triggers, each with a local ``time`` (HH:MM).
+        :type triggers: list
+        """
+        if not triggers:
+            return
+
+        pipe = self.connection.pipeline(transaction=False)
+        self._add(pipe, event_id, triggers)
+        pipe.execute()
+
+    def _add(self, pipe, event_id, triggers):
+        index_key = self.EVENT_KEY.format(event_id)
+        for trigger in triggers:
+            trigger = dict(trigger, event=str(event_id))
+            hour, minute = trigger['time'].split(':')
+            slot = slot_for(hour, minute)
+            member = json.dumps(trigger, sort_keys=True)
+
+            pipe.sadd(self.SLOT_KEY.format(slot), member)
+            pipe.sadd(index_key, json.dumps([slot, member]))
+
+    def remove(self, event_id):
+        """
+        Remove every trigger registered for an event.
+        """
+        self.replace([(event_id, [])])
+
+    def replace(self, schedules, pipe=None):
+        """
+        Replace the triggers of many events in two round trips.
+
+        :param schedules: ``(event_id, triggers)`` pairs.
+        :type schedules: list
+        :param pipe: A pipeline to queue the writes on. When given, the caller
+            executes it; otherwise the writes are executed right away.
+        """
+        if not schedules:
+            return
+
+        lookup = self.connection.pipeline(transaction=False)
+        for event_id, _ in schedules:
+            lookup.smembers(self.EVENT_KEY.format(event_id))
+        indexes = lookup.execute()
+
+        execute = pipe is None
+        pipe = pipe or self.connection.pipeline(transaction=False)
+        for (event_id, triggers), entries in zip(schedules, indexes):
+            for entry in entries:
+                slot, member = json.loads(entry)
+                pipe.srem(self.SLOT_KEY.format(slot), member)
+            pipe.delete(self.EVENT_KEY.format(event_id))
+            self._add(pipe, event_id, triggers)
+
+        if execute:
+            pipe.execute()
+
+    def collect(self, tick):
+        """
+        Collect the triggers due at a UTC tick, grouped by timezone bucket.
+
+        :param tick: The UTC minute being processed.
+        :type tick: datetime.datetime
+        :returns: A dict mapping each timezone offset to a list of
+            ``(trigger, local_time)`` pairs that are due for that offset.
+        """
+        local_times = {}
+        for offset in TIMEZONE_OFFSETS:
+            local_times[offset] = tick + datetime.timedelta(hours=offset)
+
+        slots = sorted({
+            slot_for(local.hour, local.minute) for local in local_times.values()
+        })
+        pipe = self.connection.pipeline(transaction=False)
+        for slot in slots:
+            pipe.smembers(self.SLOT_KEY.format(slot))
+        members = dict(zip(slots, pipe.execute()))
+
+        due = {}
+        for offset, local in local_times.items():
+            for member in members[slot_for(local.hour, local.minute)]:
+                trigger = json.loads(member)
+                if is_due(trigger, local.date()):
+                    due.setdefault(offset, []).append((trigger, local))
+        return due
+
+    def claim(self, tick, expires=3600):
+        """
+        Mark a tick as being processed. Returns False if another dispatcher
+        already claimed it.
+        """
+        key = self.TICK_KEY.format(tick.strftime('%Y%m%d%H%M'))
+        return bool(self.connection.set(key, 1, nx=True, ex=expires))
+
+    def get_cursor(self):
+        """
+        Get the last tick that was fully processed, if any.
+        """
+        value = self.connection.get(self.CURSOR_KEY)
+        if not value:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode('utf8')
+        return datetime.datetime.strptime(value, '%Y%m%d%H%M')
+
+    def set_cursor(self, tick):
+        self.connection.set(self.CURSOR_KEY, tick.strftime('%Y%m%d%H%M'))
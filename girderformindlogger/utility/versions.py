@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import re
+
+_PART_BITS = 20
+_PART_MAX = (1 << _PART_BITS) - 1
+_LEADING_DIGITS = re.compile(r'\d*')
+
+
+def versionKey(version):
+    """
+    Pack a "major.minor.patch" version into an integer which sorts like the
+    version, so that versions can be compared and indexed in the database.
+
+    Each part is read from its leading digits (missing parts and parts without
+    digits count as 0) and is capped at 2^20 - 1; parts after the third are
+    ignored. Pre-release and build tags are ignored too, so "2.0.0-beta" has
+    the same key as "2.0.0".
+
+    :param version: The version.
+    :type version: str
+    :returns: int
+    """
+    key = 0
+    parts = str(version or '').split('.')
+    for i in range(3):
+        digits = _LEADING_DIGITS.match(parts[i]).group() if i < len(parts) else ''
+        key = (key << _PART_BITS) | min(int(digits or 0), _PART_MAX)
+    return key
+
+
+def versionRange(fromVersion=None, toVersion=None):
+    """
+    A query on stored version keys matching the versions from `fromVersion`
+    to `toVersion`, both included.
+
+    :returns: dict, or None if neither bound is given.
+    """
+    query = {}
+    if fromVersion:
+        query['$gte'] = versionKey(fromVersion)
+    if toVersion:
+        query['$lte'] = versionKey(toVersion)
+    return query or None
@@ -152,10 +152,12 @@ class HashedFile(File):
 def _computeHashHook(event):
     """
     Event hook that computes the file hashes in the background after
-    a completed upload. Only done if the AUTO_COMPUTE setting enabled.
+    a completed upload. Only done if the AUTO_COMPUTE setting enabled, or if
+    the assetstore deferred computing the sha512 of the file.
     """
-    if Setting().get(PluginSettings.AUTO_COMPUTE):
-        _computeHash(event.info['file'])
+    file = event.info['file']
+    if Setting().get(PluginSettings.AUTO_COMPUTE) or file.get('sha512Deferred'):
+        _computeHash(file)
 
 
 def _computeHash(file, progress=noProgress):
@@ -23,6 +23,7 @@ with open('README.rst', 'r', encoding='utf8') as f:
     readme = f.read()
 
 installReqs = [
+    'aiohttp==3.8.6',
 	'asn1crypto==0.24.0',
 	'attrs==19.2.0',
     'boto3',
@@ -1,4 +1,6 @@
 # unit tests
+import datetime
+import json
 import pytest
 from girderformindlogger.constants import REPROLIB_CANONICAL
 
@@ -29,3 +31,1331 @@ testOutput = {
 def testDereference(args):
     from girderformindlogger.utility.jsonld_expander import dereference
     assert dereference(testInput)==testOutput, 'Dereferencing failed.'
+
+
+def testNormalizeMatchesExpandedForm():
+    from girderformindlogger.utility.jsonld_normalize import normalize
+    doc = {
+        "{}schema/allow".format(REPROLIB_CANONICAL): [
+            {"@id": "{}schema/auto_advance".format(REPROLIB_CANONICAL)}
+        ],
+        "http://schema.org/url": "{}activities/a".format(REPROLIB_CANONICAL),
+        "http://schema.org/name": [{"@language": "en", "@value": "A"}],
+    }
+    normalized = normalize(doc)
+    assert normalized["reprolib:schema/allow"] == [{"@id": "reprolib:schema/auto_advance"}]
+    assert normalized["url"] == normalized["schema:url"]
+    assert normalize(normalized, copy=False) is normalized
+
+
+def testNormalizeOnlyMemoizesShortUrls():
+    from girderformindlogger.utility import jsonld_normalize
+
+    image = 'data:image/png;base64,' + 'A' * 10000
+    longUrl = 'https://example.org/' + 'a' * jsonld_normalize.MEMO_MAX_LENGTH
+    for value in ('How are you today?', image, longUrl, 'reprolib:activities/a'):
+        jsonld_normalize.canonize(value)
+        jsonld_normalize.normalize_key(value)
+    memos = (jsonld_normalize._prefixed, jsonld_normalize._keys, jsonld_normalize._canonical)
+    assert not any(value in memo for memo in memos
+                   for value in ('How are you today?', image, longUrl))
+    assert jsonld_normalize._canonical['reprolib:activities/a'] \
+        == '{}activities/a'.format(REPROLIB_CANONICAL)
+    assert jsonld_normalize.canonize('see reprolib:items/b') \
+        == 'see {}items/b'.format(REPROLIB_CANONICAL)
+
+
+@pytest.mark.parametrize(
+    "trigger,date,expected",
+    [
+        ({'start': '2020/01/01', 'end': None}, datetime.date(2020, 1, 1), True),
+        ({'start': '2020/01/02', 'end': None}, datetime.date(2020, 1, 1), False),
+        ({'start': None, 'end': '2020/01/01'}, datetime.date(2020, 1, 2), False),
+        ({'start': None, 'end': None, 'dayOfWeek': 0}, datetime.date(2020, 1, 5), True),
+        ({'start': None, 'end': None, 'dayOfWeek': 1}, datetime.date(2020, 1, 5), False),
+        ({'start': None, 'end': None, 'dayOfMonth': 5}, datetime.date(2020, 1, 5), True),
+    ]
+)
+def testTimingWheelIsDue(trigger, date, expected):
+    from girderformindlogger.utility.timing_wheel import is_due
+    assert is_due(trigger, date) == expected
+
+
+@pytest.mark.parametrize(
+    "trigger,after,expected",
+    [
+        ({'time': '09:00'}, datetime.datetime(2020, 1, 1, 8, 0), datetime.datetime(2020, 1, 1, 9, 0)),
+        ({'time': '09:00'}, datetime.datetime(2020, 1, 1, 9, 1), datetime.datetime(2020, 1, 2, 9, 0)),
+        ({'time': '09:00', 'start': '2020/02/01'}, datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1, 9, 0)),
+        ({'time': '09:00', 'end': '2020/01/01'}, datetime.datetime(2020, 1, 1, 10, 0), None),
+        ({'time': '09:00', 'dayOfWeek': 0}, datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 5, 9, 0)),
+        ({'time': '09:00', 'dayOfMonth': 31}, datetime.datetime(2020, 2, 1), datetime.datetime(2020, 3, 31, 9, 0)),
+        ({'time': '09:00', 'dayOfMonth': 1}, datetime.datetime(2020, 12, 2), datetime.datetime(2021, 1, 1, 9, 0)),
+    ]
+)
+def testRecurrenceNextFire(trigger, after, expected):
+    from girderformindlogger.utility.recurrence import next_fire
+    from girderformindlogger.utility.timing_wheel import is_due
+    fire = next_fire(trigger, after)
+    assert fire == expected
+    if fire:
+        assert is_due(trigger, fire.date())
+
+
+def testFCMSenderAgainstFakeServer():
+    import asyncio
+    from girderformindlogger.external.fake_fcm import create_app, start
+    from girderformindlogger.utility.notification import FCMSender
+
+    pruned = {}
+
+    async def run():
+        app = create_app(throttle_every=3)
+        runner, endpoint = await start(app)
+        sender = FCMSender(
+            'fake-key', endpoint=endpoint, concurrency=4, rate=1000, backoff=0.01,
+            on_invalid_tokens=lambda invalid, canonical: pruned.update(
+                invalid=invalid, canonical=canonical)
+        )
+        tokens = ['device-%d' % i for i in range(2500)] + [
+            'invalid-1', 'canonical-1', 'unavailable-1'
+        ]
+        try:
+            return app['stats'], await sender.send_async([
+                {'registration_ids': tokens[:1500], 'data': {'type': 'test'}},
+                {'registration_ids': tokens[1500:], 'data': {'type': 'test'}},
+                {'to': 'device-0', 'data': {'type': 'test'}}
+            ])
+        finally:
+            await runner.cleanup()
+
+    loop = asyncio.new_event_loop()
+    stats, response = loop.run_until_complete(run())
+    loop.close()
+
+    assert response['success'] == 2502
+    assert response['failure'] == 1
+    assert response['canonical_ids'] == 1
+    assert pruned == {
+        'invalid': ['invalid-1'], 'canonical': {'canonical-1': 'renewed-canonical-1'}
+    }
+    assert stats['throttled'] >= 1
+
+
+def testUploadPartsStreamsToS3(monkeypatch):
+    import base64
+    import tempfile
+    import boto3
+    moto = pytest.importorskip('moto')
+    from girderformindlogger.utility import file_storage
+
+    class Part(object):
+        def __init__(self, data):
+            self.file = tempfile.TemporaryFile()
+            self.file.write(data)
+            self.value = None
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    mock = getattr(moto, 'mock_aws', None) or moto.mock_s3
+    with mock():
+        client = boto3.client('s3', region_name=file_storage.DEFAULT_REGION)
+        client.create_bucket(Bucket='media')
+        storage = file_storage.S3Storage(client, 'media')
+
+        large = b'x' * (file_storage.CHUNK_SIZE + 1024)
+        uris = file_storage.upload_parts(storage, [
+            (Part(large), 'a/large.bin'), (Part(b'small'), 'a/small.bin')
+        ])
+
+        assert uris == ['s3://media/a/large.bin', 's3://media/a/small.bin']
+        assert storage.checkPathExists(uris[0])
+        body = client.get_object(Bucket='media', Key='a/large.bin')['Body'].read()
+        assert body == large
+
+        assert storage.key(uris[1]) == 'a/small.bin'
+        assert storage.key('s3://other/a/small.bin') is None
+        assert b''.join(storage.download('a/large.bin')) == large
+        assert base64.b64decode(b''.join(file_storage.base64_chunks(
+            [b'ab', b'cde', b'f', b'ghij']))) == b'abcdefghij'
+
+        url = storage.presigned_url('a/direct.png', 'PUT', 'image/png')
+        assert 'a/direct.png' in url and 'Signature' in url
+
+
+def testUploadPartsBoundsConcurrencyAndTime():
+    import threading
+    from girderformindlogger.exceptions import RestException
+    from girderformindlogger.utility import file_storage
+
+    class Part(object):
+        file = None
+
+        def __init__(self, value):
+            self.value = value
+
+    class Storage(object):
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.running = self.peak = 0
+            self.release = threading.Event()
+
+        def upload(self, file, key):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            if key == 'stalled':
+                self.release.wait(5)
+            else:
+                self.release.wait(0.02)
+            with self.lock:
+                self.running -= 1
+            return 's3://media/' + key
+
+    storage = Storage()
+    keys = ['part-%d' % i for i in range(8)]
+    assert file_storage.upload_parts(
+        storage, [(Part('data'), key) for key in keys], concurrency=2, timeout=5) \
+        == ['s3://media/' + key for key in keys]
+    assert storage.peak == 2
+
+    with pytest.raises(RestException) as raised:
+        file_storage.upload_parts(storage, [(Part('data'), 'stalled')], timeout=0.1)
+    assert raised.value.code == 504
+    storage.release.set()
+
+
+def testMailDeliveryReusesSession():
+    import socket
+    import time
+    controller = pytest.importorskip('aiosmtpd.controller')
+    from girderformindlogger.utility.mail_utils import MailDelivery
+
+    class Sink(object):
+        def __init__(self):
+            self.sessions = set()
+            self.envelopes = []
+
+        async def handle_RCPT(self, server, session, envelope, address, options):
+            if address.startswith('bounce'):
+                return '550 No such user'
+            envelope.rcpt_tos.append(address)
+            return '250 OK'
+
+        async def handle_DATA(self, server, session, envelope):
+            self.sessions.add(id(session))
+            self.envelopes.append(envelope.rcpt_tos)
+            return '250 OK'
+
+    class Queue(object):
+        def __init__(self, messages):
+            self.messages = messages
+            self.results = {}
+
+        def claim(self, limit):
+            claimed, self.messages = self.messages[:limit], self.messages[limit:]
+            return claimed
+
+        def pendingRecipients(self, message):
+            return message['recipients']
+
+        def markDelivered(self, message, refused, maxAttempts, backoff):
+            self.results[message['_id']] = refused
+
+        def markFailed(self, message, error, maxAttempts, backoff):
+            self.results[message['_id']] = error
+
+    sink = Sink()
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    smtp = controller.Controller(sink, hostname='127.0.0.1', port=port)
+    smtp.start()
+    try:
+        queue = Queue([{
+            '_id': i,
+            'fromAddress': 'test@localhost',
+            'recipients': ['user-%d@localhost' % i, 'bounce-%d@localhost' % i],
+            'message': 'Subject: test\r\n\r\nHello'
+        } for i in range(50)])
+        delivery = MailDelivery(
+            queue=queue, workers=1, batchSize=10, maxAttempts=5, backoff=0,
+            pollInterval=0.05, settings=lambda: {'host': '127.0.0.1', 'port': port})
+        delivery.start()
+        for _ in range(100):
+            if len(queue.results) == 50:
+                break
+            time.sleep(0.05)
+        delivery.stop()
+    finally:
+        smtp.stop()
+
+    assert len(sink.envelopes) == 50
+    assert len(sink.sessions) == 1
+    assert queue.results[0] == {'bounce-0@localhost': (550, b'No such user')}
+
+
+def testMailDeliveryFollowsSettingsAndSurvivesErrors(monkeypatch):
+    import time
+    from girderformindlogger.utility import mail_utils
+
+    sessions = []
+
+    class Session(object):
+        def __init__(self, host, port=None):
+            self.host = host
+            self.closed = False
+            sessions.append(self)
+
+        def send(self, fromAddress, toAddresses, message):
+            return {}
+
+        def close(self):
+            self.closed = True
+
+    class Queue(object):
+        def __init__(self, messages):
+            self.messages = messages
+            self.results = []
+
+        def claim(self, limit):
+            claimed, self.messages = self.messages[:limit], self.messages[limit:]
+            return claimed
+
+        def pendingRecipients(self, message):
+            return ['user@localhost']
+
+        def markDelivered(self, message, refused, maxAttempts, backoff):
+            self.results.append((message['_id'], self.host))
+
+    settings = [None, 'a', 'a', 'b']
+
+    def getSettings():
+        host = settings.pop(0)
+        if host is None:
+            raise IOError('database unavailable')
+        queue.host = host
+        return {'host': host}
+
+    monkeypatch.setattr(mail_utils, '_SMTPSession', Session)
+    queue = Queue([{'_id': i, 'fromAddress': 'test@localhost', 'message': ''} for i in range(4)])
+    delivery = mail_utils.MailDelivery(
+        queue=queue, workers=1, batchSize=1, maxAttempts=5, backoff=0,
+        pollInterval=0.01, settings=getSettings)
+    delivery.start()
+    for _ in range(100):
+        if len(queue.results) == 3:
+            break
+        time.sleep(0.01)
+    delivery.stop()
+
+    # the message claimed while the settings could not be read waits for its lease
+    assert queue.results == [(1, 'a'), (2, 'a'), (3, 'b')]
+    assert [(session.host, session.closed) for session in sessions] == [('a', True), ('b', True)]
+
+
+def testDocumentFetcherCachesAndRevalidates(tmp_path):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from girderformindlogger.utility.document_fetcher import DocumentFetcher
+
+    documents = {
+        '/item.jsonld': '{"@id": "item"}',
+        '/comments.jsonld': '{"@id": "comments", // json5\n}'
+    }
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.path, self.headers.get('If-None-Match')))
+            if self.path not in documents:
+                self.send_response(404)
+                self.end_headers()
+                return
+            etag = '"%s"' % self.path
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = documents[self.path].encode('utf8')
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+    try:
+        fetcher = DocumentFetcher(cacheDir=str(tmp_path), workers=4, perHost=2, freshFor=60)
+        assert fetcher.prefetch([base + path for path in documents] + [base + '/missing']) == 2
+        assert fetcher.load(base + '/item.jsonld') == {'@id': 'item'}
+        assert fetcher.load(base + '/comments.jsonld') == {'@id': 'comments'}
+        assert fetcher.load(base + '/missing') == {}
+        assert fetcher.load('reprolib:activities/a') == {}
+        assert sorted(path for path, _ in requests) == [
+            '/comments.jsonld', '/item.jsonld', '/missing', '/missing']
+
+        stale = DocumentFetcher(cacheDir=str(tmp_path), freshFor=0)
+        assert stale.load(base + '/item.jsonld') == {'@id': 'item'}
+        assert requests[-1] == ('/item.jsonld', '"/item.jsonld"')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert stale.load(base + '/item.jsonld') == {'@id': 'item'}
+
+
+def testDocumentFetcherCacheIsBoundedAndOptional(tmp_path, monkeypatch):
+    import tempfile
+    from girderformindlogger.utility.document_fetcher import DocumentFetcher
+
+    class Response(object):
+        status_code = 200
+        ok = True
+        headers = {}
+
+        def __init__(self, text):
+            self.text = text
+
+    class Session(object):
+        def get(self, url, headers, timeout):
+            return Response('{"@id": "%s", "padding": "%s"}' % (url, ' ' * 1000))
+
+    fetcher = DocumentFetcher(cacheDir=str(tmp_path), session=Session(), maxSize=8000)
+    for i in range(20):
+        assert fetcher.load('http://host/%d' % i)['@id'] == 'http://host/%d' % i
+    sizes = [path.stat().st_size for path in tmp_path.iterdir()]
+    assert 0 < sum(sizes) <= 8000 and len(sizes) < 20
+    assert fetcher.cacheSize == sum(sizes)
+
+    def mkstemp(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(tempfile, 'mkstemp', mkstemp)
+    assert fetcher.load('http://host/new')['@id'] == 'http://host/new'
+
+
+def testNotificationBrokerFansOut():
+    fakeredis = pytest.importorskip('fakeredis')
+    from girderformindlogger.utility.notification_broker import (
+        RESYNC, NotificationBroker, publish, recipientKey)
+
+    connection = fakeredis.FakeStrictRedis()
+    broker = NotificationBroker(connection=connection, queueSize=2)
+    first = broker.subscribe(recipientKey({'userId': 'a'}))
+    second = broker.subscribe(recipientKey({'userId': 'a'}))
+    other = broker.subscribe(recipientKey({'tokenId': 'b'}))
+
+    publish({'_id': 1, 'userId': 'a', 'updated': datetime.datetime(2020, 1, 1)}, connection)
+    publish({'_id': 2, 'tokenId': 'b'}, connection)
+    assert first.get(timeout=5) == {'_id': 1, 'userId': 'a', 'updated': '2020-01-01T00:00:00+00:00'}
+    assert second.get(timeout=5)['_id'] == 1
+    assert other.get(timeout=5)['_id'] == 2
+
+    broker.unsubscribe(recipientKey({'userId': 'a'}), second)
+    assert broker.streamCount() == 2
+    for i in range(3):
+        broker.dispatch({'_id': i, 'tokenId': 'b'})
+    assert other.get_nowait() is RESYNC
+    assert other.empty()
+
+
+def testAutoDescribeRouteBindsParams():
+    from bson.objectid import ObjectId
+    from girderformindlogger.api.describe import Description, autoDescribeRoute
+    from girderformindlogger.exceptions import RestException
+
+    @autoDescribeRoute(
+        Description('Test route')
+        .param('count', 'Count', dataType='integer')
+        .param('label', 'Label', required=False, default='none')
+        .jsonParam('data', 'Data', required=False, schema={
+            'type': 'object', 'required': ['id']})
+    )
+    def route(count, label, data, params):
+        return count, label, data
+
+    assert route(count='2', params={}) == (2, 'none', None)
+    assert route(count='2', params={'data': '{"id": {"$oid": "5e0000000000000000000000"}}'}) \
+        == (2, 'none', {'id': ObjectId('5e0000000000000000000000')})
+    with pytest.raises(RestException, match='is a required property'):
+        route(count='2', data='{"other": 1}', params={})
+    with pytest.raises(RestException, match='"count" is required'):
+        route(params={})
+
+
+def testEndpointCompressionAndETag(monkeypatch):
+    import gzip
+    import json
+    import cherrypy
+    from cherrypy.lib import httputil
+    from girderformindlogger.api import rest
+
+    monkeypatch.setattr(rest, '_setCommonCORSHeaders', lambda: None)
+    monkeypatch.setattr(rest, '_logRestRequest', lambda *args: None)
+
+    @rest.endpoint
+    @rest.etagResponse
+    def handler(self, path, params):
+        return {'value': 'repeated ' * 1000}
+
+    def request(headers):
+        cherrypy.request.headers = httputil.HeaderMap(headers)
+        cherrypy.request.method = 'GET'
+        cherrypy.request.girderRawResponse = False
+        cherrypy.response.headers = httputil.HeaderMap()
+        cherrypy.response.status = None
+        return handler(None)
+
+    body = request({'Accept-Encoding': 'gzip'})
+    etag = cherrypy.response.headers['ETag']
+    assert cherrypy.response.headers['Content-Encoding'] == 'gzip'
+    assert etag.endswith('-gzip"')
+    assert json.loads(gzip.decompress(body)) == {'value': 'repeated ' * 1000}
+
+    assert request({'If-None-Match': etag}) == b''
+    assert cherrypy.response.status == 304
+
+    body = request({'Accept-Encoding': 'gzip;q=0', 'If-None-Match': '"other"'})
+    assert 'Content-Encoding' not in cherrypy.response.headers
+    assert json.loads(body.decode('utf8')) == {'value': 'repeated ' * 1000}
+
+
+def testVersionKeyOrdersNumerically():
+    from girderformindlogger.models.protocol_history import ProtocolHistory
+    from girderformindlogger.utility.versions import versionKey
+
+    versions = ['0.0.9', '1.0.0', '1.0.10', '1.0.9', '1.2', '10.0.0', '9.10.0', '2.0.0-beta']
+    assert sorted(versions, key=versionKey) == [
+        '0.0.9', '1.0.0', '1.0.9', '1.0.10', '1.2', '2.0.0-beta', '9.10.0', '10.0.0']
+    assert versionKey('1.2') == versionKey('1.2.0')
+    assert versionKey('2.0.0-beta') == versionKey('2.0.0+build.1') == versionKey('2.0.0')
+    assert versionKey(None) == versionKey('0.0.0') == 0
+
+    intervals = [(versionKey('1.0.0'), 'screen/a'), (versionKey('1.0.10'), 'screen/b')]
+    assert ProtocolHistory.resolve(intervals, '0.1.0') == 'screen/a'
+    assert ProtocolHistory.resolve(intervals, '1.0.0') == 'screen/a'
+    assert ProtocolHistory.resolve(intervals, '1.0.9') == 'screen/b'
+    assert ProtocolHistory.resolve(intervals, '1.1.0') is None
+
+
+def testResponseTokensAreFilteredByIndexedVersionKeys(database):
+    from bson.objectid import ObjectId
+    from girderformindlogger.models.response_folder import ResponseItem
+    from girderformindlogger.models.response_tokens import ResponseTokens
+    from girderformindlogger.utility.versions import versionRange
+
+    profile = {'userId': ObjectId(), 'appletId': ObjectId(), 'accountId': ObjectId()}
+    for version in ('1.9.0', '1.10.0', '2.0.0'):
+        ResponseTokens().saveResponseToken(profile, {'version': version}, 'key', isToken=True,
+                                           version=version)
+
+    def versions(**kwargs):
+        return [token['data']['version'] for token in ResponseTokens().getResponseTokens(
+            profile, retrieveUserKeys=False, **kwargs)['tokens']]
+
+    assert versions() == ['1.9.0', '1.10.0', '2.0.0']
+    assert versions(fromVersion='1.10.0') == ['1.10.0', '2.0.0']
+    assert versions(toVersion='1.10.0') == ['1.9.0', '1.10.0']
+    assert versionRange() is None
+
+    indexes = [list(dict(index['key'])) for index in database.responseTokens.index_information().values()]
+    assert ['userId', 'appletId', 'versionKey'] in indexes
+    ResponseItem()
+    indexes = [list(dict(index['key'])) for index in database.item.index_information().values()]
+    assert ['meta.applet.@id', 'meta.subject.@id', 'meta.applet.versionKey'] in indexes
+
+
+def testResponseAlertWorkerRequeuesFailedBatch():
+    import json
+    fakeredis = pytest.importorskip('fakeredis')
+    from girderformindlogger.external.response_alerts import ResponseAlertWorker
+    from girderformindlogger.models.response_alerts import ALERT_QUEUE_KEY
+
+    class Delivery(object):
+        fail = True
+        delivered = []
+
+        def deliverQueuedAlerts(self, entries):
+            if self.fail:
+                raise IOError('SMTP server unavailable')
+            self.delivered.extend(entries)
+
+    connection = fakeredis.FakeStrictRedis()
+    worker = ResponseAlertWorker(connection=connection, name='test', window=0, retryDelay=0)
+    for i in range(3):
+        connection.lpush(ALERT_QUEUE_KEY, json.dumps({'alert': i}))
+
+    model = Delivery()
+    worker.process(model)
+    assert connection.llen(ALERT_QUEUE_KEY) == 3
+    assert connection.llen(worker.processing) == 0
+
+    model.fail = False
+    worker.process(model)
+    assert sorted(entry['alert'] for entry in model.delivered) == [0, 1, 2]
+    assert connection.llen(ALERT_QUEUE_KEY) == 0
+    assert connection.llen(worker.processing) == 0
+
+
+def testResponseAlertWorkerIsolatesAndDeadLettersBadEntries():
+    import json
+    fakeredis = pytest.importorskip('fakeredis')
+    from girderformindlogger.external.response_alerts import (
+        DEAD_LETTER_KEY, ResponseAlertWorker)
+    from girderformindlogger.models.response_alerts import ALERT_QUEUE_KEY
+
+    class Delivery(object):
+        delivered = []
+
+        def deliverQueuedAlerts(self, entries):
+            if any(entry['alert'] == 'bad' for entry in entries):
+                raise ValueError('bad entry')
+            self.delivered.extend(entry['alert'] for entry in entries)
+
+    connection = fakeredis.FakeStrictRedis()
+    worker = ResponseAlertWorker(connection=connection, name='test', window=0, retryDelay=0,
+                                 maxAttempts=2)
+    for alert in (0, 'bad', 1):
+        connection.lpush(ALERT_QUEUE_KEY, json.dumps({'alert': alert}))
+
+    model = Delivery()
+    worker.process(model)
+    assert model.delivered == [0, 1]
+    assert [json.loads(entry) for entry in connection.lrange(ALERT_QUEUE_KEY, 0, -1)] \
+        == [{'alert': 'bad', 'attempts': 1}]
+
+    worker.process(model)
+    assert model.delivered == [0, 1]
+    assert connection.llen(ALERT_QUEUE_KEY) == 0 and connection.llen(worker.processing) == 0
+    assert [json.loads(entry) for entry in connection.lrange(DEAD_LETTER_KEY, 0, -1)] \
+        == [{'alert': 'bad', 'attempts': 2}]
+
+
+def testResponseAlertWorkerRequeuesEntriesOfDeadWorkers():
+    import json
+    fakeredis = pytest.importorskip('fakeredis')
+    from girderformindlogger.external.response_alerts import HEARTBEAT_KEY, ResponseAlertWorker
+    from girderformindlogger.models.response_alerts import ALERT_QUEUE_KEY
+
+    connection = fakeredis.FakeStrictRedis()
+    alive = ResponseAlertWorker(connection=connection, name='host:1', window=0)
+    dead = ResponseAlertWorker(connection=connection, name='host:2', window=0)
+    for i in range(4):
+        connection.lpush(ALERT_QUEUE_KEY, json.dumps({'alert': i}))
+    alive.claim()
+    connection.lpush(ALERT_QUEUE_KEY, json.dumps({'alert': 4}))
+    dead.claim()
+    assert connection.llen(ALERT_QUEUE_KEY) == 0
+
+    # the restarted worker has a new pid, so a new processing list
+    restarted = ResponseAlertWorker(connection=connection, name='host:3', window=0)
+    restarted.reap()
+    assert connection.llen(ALERT_QUEUE_KEY) == 0
+
+    connection.delete(HEARTBEAT_KEY.format('host:2'))
+    restarted.reap()
+    assert connection.llen(ALERT_QUEUE_KEY) == 1
+    assert connection.llen(alive.processing) == 4 and connection.llen(dead.processing) == 0
+
+    class Delivery(object):
+        delivered = []
+
+        def deliverQueuedAlerts(self, entries):
+            self.delivered.extend(entry['alert'] for entry in entries)
+
+    model = Delivery()
+    restarted.process(model)
+    assert model.delivered == [4]
+
+
+def testResponseAlertDeliveryCanBeRetried(database, monkeypatch):
+    from bson.objectid import ObjectId
+    fakeredis = pytest.importorskip('fakeredis')
+    from girderformindlogger.models import response_alerts
+    from girderformindlogger.utility import mail_utils
+
+    connection = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(response_alerts, 'getRedisConnection', lambda: connection)
+    monkeypatch.setattr(mail_utils, 'renderTemplate', lambda name, params: name)
+    sent = []
+
+    def sendMail(subject, text, to):
+        if to == 'down@example.com' and not sent.count('down@example.com'):
+            sent.append(to)
+            raise IOError('mailbox unavailable')
+        sent.append(to)
+
+    monkeypatch.setattr(mail_utils, 'sendMail', sendMail)
+    reviewers = [ObjectId(), ObjectId()]
+    for reviewerId, email in zip(reviewers, ('up@example.com', 'down@example.com')):
+        userId = database.user.insert_one({'lang': 'en'}).inserted_id
+        database.appletProfile.insert_one({'_id': reviewerId, 'userId': userId, 'email': email})
+
+    userProfile = {'_id': ObjectId(), 'accountId': ObjectId(), 'appletId': ObjectId(),
+                   'roles': ['user'], 'reviewers': reviewers}
+    response_alerts.ResponseAlerts().queueResponseAlerts(userProfile, [
+        {'id': ObjectId(), 'schema': 'item', 'message': 'first'},
+        {'id': ObjectId(), 'schema': 'item', 'message': 'second'}
+    ])
+    entry = json.loads(connection.rpop(response_alerts.ALERT_QUEUE_KEY))
+
+    with pytest.raises(IOError):
+        response_alerts.ResponseAlerts().deliverQueuedAlerts([entry])
+    assert database.responseAlerts.count_documents({}) == 4
+    assert sent == ['up@example.com', 'down@example.com']
+
+    # the retry only sends the email which failed
+    entry['attempts'] = 1
+    assert response_alerts.ResponseAlerts().deliverQueuedAlerts([entry]) == 0
+    assert database.responseAlerts.count_documents({}) == 4
+    assert sent == ['up@example.com', 'down@example.com', 'down@example.com']
+
+    # alerts written before the progress was recorded are not saved twice
+    connection.flushall()
+    monkeypatch.setattr(mail_utils, 'sendMail', lambda subject, text, to: None)
+    assert response_alerts.ResponseAlerts().deliverQueuedAlerts([entry]) == 4
+    assert database.responseAlerts.count_documents({}) == 4
+
+
+def testPushNotificationsAreOffByDefault(monkeypatch):
+    from girderformindlogger.external import notification
+    from girderformindlogger.utility import config
+
+    sent = []
+    monkeypatch.setattr(notification.push_service, 'notify_multiple_devices',
+                        lambda **kwargs: sent.append(kwargs))
+    monkeypatch.setitem(config.getConfig(), 'notification', {})
+
+    notification.send_push_notification_batch(['device'], ['user'], 'applet', 'event')
+    assert sent == []
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+    Connect the models to an in-memory database.
+    """
+    mongomock = pytest.importorskip('mongomock')
+    from girderformindlogger.models import model_base
+
+    client = mongomock.MongoClient('mongodb://localhost/girder')
+    monkeypatch.setattr(model_base, 'getDbConnection', lambda *args, **kwargs: client)
+    for model in model_base._modelSingletons:
+        model.reconnect()
+    return client.get_database()
+
+
+def testActivityManifestMatchesPagedContent(database, monkeypatch):
+    from bson.objectid import ObjectId
+    from girderformindlogger.constants import APPLET_SCHEMA_VERSION
+    from girderformindlogger.models.activity import Activity as ActivityModel
+    from girderformindlogger.models.applet import Applet as AppletModel
+    from girderformindlogger.models.applet_content import AppletContent
+    from girderformindlogger.models.cache import Cache as CacheModel
+    from girderformindlogger.utility import jsonld_expander
+
+    def formatted(name):
+        return {
+            'activity': {'@id': name, 'schema:name': [{'@value': name}]},
+            'items': {'%s/screen' % name: {'@id': 'screen', '_id': 'screen/%s' % name}}
+        }
+
+    appletId = ObjectId()
+    cachedId, uncachedId = ObjectId(), ObjectId()
+    cache = CacheModel().insertCache('folder', cachedId, 'activity', formatted('cached'))
+    database.folder.insert_many([
+        {'_id': cachedId, 'cached': cache['_id'], 'meta': {'schema': APPLET_SCHEMA_VERSION}},
+        {'_id': uncachedId, 'meta': {'schema': APPLET_SCHEMA_VERSION}}
+    ])
+
+    formatLdObject = jsonld_expander.formatLdObject
+
+    def format(obj, mesoPrefix='folder', *args, **kwargs):
+        # An uncached activity is built (and cached) by formatLdObject.
+        if mesoPrefix == 'activity' and not obj.get('cached'):
+            cache = CacheModel().insertCache('folder', obj['_id'], 'activity', formatted('uncached'))
+            ActivityModel().update({'_id': obj['_id']}, {'$set': {'cached': cache['_id']}})
+            return formatted('uncached')
+        return formatLdObject(obj, mesoPrefix, *args, **kwargs)
+
+    monkeypatch.setattr(jsonld_expander, 'formatLdObject', format)
+
+    activities = {'cached': str(cachedId), 'uncached': str(uncachedId)}
+    manifest = AppletContent().activityManifest(activities, appletId)
+    assert sorted(manifest) == ['cached', 'uncached']
+
+    _, paged, _ = AppletModel().getNextAppletData(activities, None, 1 << 20)
+    for activityIRI, contentHash in manifest.items():
+        content = AppletContent().findOne({'_id': contentHash})
+        bundle = json.loads(bytes(content['data']).decode('utf8'))
+        assert bundle['activity'] == paged['activities'][activityIRI]
+        assert bundle['items'] == {
+            itemIRI: item for itemIRI, item in paged['items'].items()
+            if itemIRI.startswith(activityIRI + '/')
+        }
+        assert content['applets'] == [appletId]
+
+    # The uncached activity has a cache now, so its bundle is reused.
+    assert AppletContent().activityManifest(activities, appletId) == manifest
+    assert database.appletContent.count_documents({}) == 2
+
+    userId, removedId = ObjectId(), ObjectId()
+    database.appletProfile.insert_many([
+        {'appletId': appletId, 'userId': userId, 'roles': ['user']},
+        {'appletId': appletId, 'userId': removedId, 'roles': ['user'], 'deactivated': True}
+    ])
+    content = AppletContent().findOne({'_id': manifest['cached']}, fields=['applets'])
+    assert AppletContent().canRead(content, {'_id': userId, 'login': 'user'})
+    assert not AppletContent().canRead(content, {'_id': removedId, 'login': 'removed'})
+
+
+def testMediaDownloadIsLimitedToReviewees(database, monkeypatch):
+    from bson.objectid import ObjectId
+    from girderformindlogger.exceptions import AccessException
+    from girderformindlogger.utility import jsonld_expander  # noqa: imported before the api
+    from girderformindlogger.api.v1 import response
+
+    class Storage(object):
+        def key(self, uri):
+            return uri
+
+        def presigned_url(self, key, method):
+            return 'https://storage/%s' % key
+
+    monkeypatch.setattr(response, '_mediaStorage', lambda applet: Storage())
+
+    appletId = ObjectId()
+    users = {role: {'_id': ObjectId(), 'login': role} for role in (
+        'coordinator', 'reviewer', 'otherReviewer', 'participant', 'other')}
+    profiles = {role: ObjectId() for role in users}
+    roles = {
+        'coordinator': ['user', 'coordinator'], 'reviewer': ['user', 'reviewer'],
+        'otherReviewer': ['user', 'reviewer'], 'participant': ['user'], 'other': ['user']
+    }
+    database.appletProfile.insert_many([{
+        '_id': profiles[role],
+        'appletId': appletId,
+        'userId': users[role]['_id'],
+        'roles': roles[role],
+        'reviewers': [profiles['reviewer']] if role == 'participant' else []
+    } for role in users])
+
+    resource = response.ResponseItem()
+    uri = '%s/%s/%s/audio.m4a' % (profiles['participant'], appletId, ObjectId())
+
+    def download(role):
+        monkeypatch.setattr(resource, 'getCurrentUser', lambda: users[role])
+        return response.ResponseItem.getDownloadUrl.__wrapped__.__wrapped__(
+            resource, {'_id': appletId}, uri)
+
+    for role in ('coordinator', 'reviewer', 'participant'):
+        assert download(role)['url'] == 'https://storage/%s' % uri
+    for role in ('otherReviewer', 'other'):
+        with pytest.raises(AccessException):
+            download(role)
+
+
+def testAppletMembershipsFollowProfilesAndApplets(database):
+    from bson.objectid import ObjectId
+    from girderformindlogger.models.account_profile import AccountProfile
+    from girderformindlogger.models.applet import Applet as AppletModel
+    from girderformindlogger.models.applet_membership import AppletMembership
+
+    userId, accountId = ObjectId(), ObjectId()
+    first, second = ObjectId(), ObjectId()
+    database.folder.insert_many([
+        {'_id': first, 'cached': ObjectId(), 'updated': datetime.datetime(2020, 1, 1),
+         'meta': {'applet': {}}},
+        {'_id': second, 'updated': datetime.datetime(2020, 1, 1), 'meta': {'applet': {}}}
+    ])
+
+    def applets(role):
+        return [membership['appletId'] for membership in AppletMembership().getApplets(
+            userId, role, accountId)]
+
+    profile = AccountProfile().save({
+        'userId': userId, 'accountId': accountId, 'accountName': 'account',
+        'applets': {'user': [first, second], 'manager': [second]}
+    })
+    assert applets('user') == [first, second]
+    assert applets('manager') == [second]
+
+    profile['applets'] = {'user': [second]}
+    AccountProfile().save(profile)
+    assert applets('user') == [second]
+    assert applets('manager') == []
+
+    cacheId = ObjectId()
+    AppletModel().update({'_id': second}, {'$set': {
+        'cached': cacheId, 'updated': datetime.datetime(2021, 1, 1)}})
+    membership = AppletMembership().findOne({'appletId': second})
+    assert membership['cached'] == cacheId
+    assert AppletMembership().updatedSince(userId, 'user', datetime.datetime(2020, 6, 1))
+
+    applet = database.folder.find_one({'_id': second})
+    applet['updated'] = datetime.datetime(2022, 1, 1)
+    AppletModel().save(applet, validate=False)
+    assert AppletMembership().findOne({'appletId': second})['updated'] == applet['updated']
+
+    # rebuild keeps the index in place and drops the memberships of removed profiles
+    database.appletMembership.insert_one({
+        'userId': ObjectId(), 'accountId': accountId, 'appletId': first, 'roles': ['user']})
+    assert AppletMembership().rebuild() == 1
+    assert database.appletMembership.count_documents({'appletId': {'$ne': None}}) == 1
+    assert applets('user') == [second]
+
+    # an account profile saved before the index existed is indexed on demand,
+    # even though another account of the same user is indexed already
+    otherAccountId = ObjectId()
+    database.accountProfile.insert_one({
+        'userId': userId, 'accountId': otherAccountId, 'applets': {'user': [first]}})
+    assert [membership['appletId'] for membership in AppletMembership().getApplets(
+        userId, 'user')] == [second]
+    AppletMembership().syncAccounts(userId, accountId)
+    assert AppletMembership().findOne({'accountId': otherAccountId}) is None
+    AppletMembership().syncAccounts(userId)
+    assert sorted(membership['appletId'] for membership in AppletMembership().getApplets(
+        userId, 'user')) == sorted([first, second])
+
+    AccountProfile().remove(profile)
+    assert AppletMembership().findOne({'accountId': accountId}) is None
+
+
+def testFCMSenderReusesSessionAcrossCalls():
+    import asyncio
+    import threading
+    from girderformindlogger.external.fake_fcm import create_app, start
+    from girderformindlogger.utility.notification import FCMSender
+
+    loop = asyncio.new_event_loop()
+    runner, endpoint = loop.run_until_complete(start(create_app()))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+
+    sender = FCMSender('fake-key', endpoint=endpoint, rate=1000)
+    try:
+        first = sender.send([{'registration_ids': ['device-1', 'device-2'], 'data': {}}])
+        session = sender._local.session
+        second = sender.send([{'to': 'device-3', 'data': {}}])
+        assert sender._local.session is session
+        assert (first['success'], second['success']) == (2, 1)
+
+        # every thread has its own loop and session
+        other = {}
+
+        def work():
+            other['response'] = sender.send([{'to': 'device-4', 'data': {}}])
+            other['session'] = sender._local.session
+            sender.close()
+
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+        assert other['response']['success'] == 1
+        assert other['session'] is not session
+    finally:
+        sender.close()
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def importAssetstoreAdapter(name):
+    """
+    Import an assetstore adapter module, skipping the test where _hash_state
+    cannot read the hash state of the OpenSSL build.
+    """
+    import importlib
+
+    try:
+        return importlib.import_module('girderformindlogger.utility.%s' % name)
+    except ValueError as e:
+        pytest.skip('_hash_state is not supported here: %s' % e)
+
+
+def testStreamChunksSlicesWithoutCopies():
+    _streamChunks = importAssetstoreAdapter('gridfs_assetstore_adapter')._streamChunks
+
+    chunks = [{'data': bytes([i]) * 4} for i in range(4)]
+    parts = list(_streamChunks(iter(chunks), 2, 14, 2))
+    assert b''.join(parts) == (b''.join(chunk['data'] for chunk in chunks))[2:14]
+    assert isinstance(parts[0], memoryview) and parts[0].obj is chunks[0]['data']
+    assert parts[1] is chunks[1]['data'] and parts[2] is chunks[2]['data']
+    assert isinstance(parts[3], memoryview) and parts[3].obj is chunks[3]['data']
+
+
+def testResponseStatisticsFollowResponses(database, monkeypatch):
+    from bson.objectid import ObjectId
+    from girderformindlogger.exceptions import ValidationException
+    from girderformindlogger.utility import jsonld_expander  # noqa: imported before the api
+    from girderformindlogger.api.v1 import response
+    from girderformindlogger.models.response_statistics import ResponseStatistics
+
+    appletId, subjectId, activityId = ObjectId(), ObjectId(), ObjectId()
+    times = [datetime.datetime(2021, 3, 1, 8), datetime.datetime(2021, 3, 1, 20),
+             datetime.datetime(2021, 3, 2, 9)]
+    responses = [{
+        '_id': ObjectId(),
+        'created': time,
+        'baseParentType': 'user',
+        'meta': {
+            'applet': {'@id': appletId},
+            'subject': {'@id': subjectId},
+            'activity': {'@id': activityId}
+        }
+    } for time in times]
+    database.item.insert_many(responses)
+    for time in times:
+        ResponseStatistics().recordResponse(appletId, subjectId, activityId, time)
+
+    def statistics():
+        return ResponseStatistics().getStatistics(
+            appletId, datetime.datetime(2021, 3, 1), datetime.datetime(2021, 3, 2))
+
+    assert [(row['count'], row['days'], row['completionRate']) for row in statistics()] \
+        == [(3, 2, 1.0)]
+
+    # deleting the responses of a day uncounts them
+    query = {'_id': {'$in': [responses[0]['_id'], responses[2]['_id']]}}
+    ResponseStatistics().removeResponses(query)
+    database.item.delete_many(query)
+    assert [(row['count'], row['days']) for row in statistics()] == [(1, 1)]
+    assert database.responseStatistics.count_documents({}) == 1
+
+    # rebuild overwrites drifted statistics in place and drops empty days
+    database.responseStatistics.update_many({}, {'$inc': {'count': 5}})
+    database.responseStatistics.insert_one({
+        'appletId': appletId, 'subjectId': subjectId, 'activityId': activityId,
+        'day': datetime.datetime(2021, 3, 2), 'count': 1,
+        'first': times[2], 'last': times[2]})
+    assert ResponseStatistics().rebuild(appletId) == 1
+    assert [(row['count'], row['days']) for row in statistics()] == [(1, 1)]
+    assert database.responseStatistics.count_documents({}) == 1
+
+    resource = response.ResponseItem()
+    monkeypatch.setattr(resource, 'getCurrentUser', lambda: {'_id': ObjectId(), 'login': 'x'})
+    with pytest.raises(ValidationException, match='users must be a list of IDs'):
+        response.ResponseItem.getResponseStatistics.__wrapped__.__wrapped__(
+            resource, {'_id': appletId}, users=['not-an-id'])
+
+
+def testDeferredSha512Uploads(tmp_path, monkeypatch, database):
+    import hashlib
+    import os
+    from bson.objectid import ObjectId
+    from girderformindlogger import plugin
+    from girderformindlogger.utility import config
+
+    adapters = importAssetstoreAdapter('filesystem_assetstore_adapter')
+    monkeypatch.setitem(config.getConfig(), 'assetstore', {'defer_sha512': True})
+    assetstoreId = ObjectId()
+    adapter = adapters.FilesystemAssetstoreAdapter({'_id': assetstoreId, 'root': str(tmp_path)})
+
+    def store(data):
+        upload = adapter.initUpload({'size': len(data), 'received': 0})
+        upload = adapter.uploadChunk(upload, data)
+        file = adapter.finalizeUpload(upload, {
+            '_id': ObjectId(), 'size': len(data), 'assetstoreId': assetstoreId})
+        return upload, file
+
+    monkeypatch.setattr(plugin, 'loadedPlugins', lambda: ['hashsum_download'])
+    upload, deferred = store(b'data')
+    assert upload['deferSha512'] and 'sha512state' not in upload
+    assert deferred['sha512Deferred'] and deferred['path'].startswith('unhashed')
+
+    # without the plugin nothing would hash the file later
+    monkeypatch.setattr(plugin, 'loadedPlugins', lambda: [])
+    upload, hashed = store(b'data')
+    assert 'deferSha512' not in upload and 'sha512Deferred' not in hashed
+    assert hashed['sha512'] == hashlib.sha512(b'data').hexdigest()
+
+    # once the plugin hashed the deferred file, the hashed file is still the
+    # only one stored at its location
+    deferred['sha512'] = hashed['sha512']
+    database.file.insert_many([dict(deferred), dict(hashed)])
+    adapter.deleteFile(hashed)
+    assert not os.path.exists(adapter.fullPath(hashed))
+    adapter.deleteFile(deferred)
+    assert not os.path.exists(adapter.fullPath(deferred))
+
+
+def testActivityWriteBehindRetriesFailedWrites():
+    import types
+    from bson.objectid import ObjectId
+    from pymongo.errors import AutoReconnect, BulkWriteError
+    from girderformindlogger.models import profile as profile_module
+
+    profileId, activityId, otherId = ObjectId(), ObjectId(), ObjectId()
+    first, second = datetime.datetime(2021, 3, 1, 8), datetime.datetime(2021, 3, 1, 9)
+
+    class FlakyCollection(object):
+        failures = 1
+        written = []
+
+        def bulk_write(self, ops, ordered=True):
+            if self.failures:
+                self.failures -= 1
+                # a response is received while the batch is written
+                writeBehind.add(writeBehind.model, profileId, {
+                    'completedTime': second, 'activityId': activityId, 'tokenTime': second})
+                raise AutoReconnect('connection lost')
+            self.written.extend(ops)
+
+    collection = FlakyCollection()
+    writeBehind = profile_module._ActivityWriteBehind()
+    writeBehind.model = types.SimpleNamespace(collection=collection)
+    writeBehind.thread = object()  # flushed by hand
+    writeBehind.maxAttempts = 2
+    writeBehind.add(writeBehind.model, profileId, {
+        'completedTime': first, 'activityId': activityId, 'tokenTime': first})
+    with pytest.raises(AutoReconnect):
+        writeBehind.flush()
+    assert collection.written == []
+
+    # the failed completions are kept, under the ones added meanwhile
+    writeBehind.add(writeBehind.model, profileId, {
+        'completedTime': second, 'activityId': otherId})
+    assert writeBehind.pending == {profileId: {
+        'activities': {activityId: second, otherId: second},
+        'tokenTimes': [first, second],
+        'updated': second
+    }}
+
+    writeBehind.flush()
+    assert writeBehind.pending == {}
+    assert collection.written == profile_module.Profile._activityCompletionOps(profileId, {
+        'activities': {activityId: second, otherId: second},
+        'tokenTimes': [first, second],
+        'updated': second
+    })
+    # retried token times are not pushed twice
+    assert collection.written[-1]._doc['$addToSet'] == {'tokenTimes': {'$each': [first, second]}}
+    assert writeBehind.attempts == {}
+
+    # only the profiles whose writes failed are retried, until they are dropped
+    badId = ObjectId()
+
+    class FailingCollection(object):
+        written = []
+
+        def bulk_write(self, ops, ordered=True):
+            assert not ordered
+            errors = [{'index': i, 'code': 121, 'errmsg': 'invalid'}
+                      for i, op in enumerate(ops) if op._filter['_id'] == badId]
+            self.written.extend(op for op in ops if op._filter['_id'] != badId)
+            if errors:
+                raise BulkWriteError({'writeErrors': errors})
+
+    writeBehind.model = types.SimpleNamespace(collection=FailingCollection())
+    for id in (badId, profileId):
+        writeBehind.add(writeBehind.model, id, {'completedTime': second, 'activityId': otherId})
+    with pytest.raises(BulkWriteError):
+        writeBehind.flush()
+    assert list(writeBehind.pending) == [badId] and writeBehind.attempts == {badId: 1}
+    assert {op._filter['_id'] for op in writeBehind.model.collection.written} == {profileId}
+    with pytest.raises(BulkWriteError):
+        writeBehind.flush()
+    assert writeBehind.pending == {} and writeBehind.attempts == {}
+
+
+def testActivityWriteBehindSwitchReadsBooleans(monkeypatch):
+    from girderformindlogger.models import profile as profile_module
+    from girderformindlogger.utility import config
+
+    for value, enabled in (('False', False), ('false', False), ('True', True), (True, True)):
+        monkeypatch.setitem(config.getConfig(), 'profile', {'activity_write_behind': value})
+        assert profile_module._ActivityWriteBehind().enabled() is enabled
+
+
+def testBulkInvitationsReplaceExistingOnes(database, monkeypatch):
+    from bson.objectid import ObjectId
+    from girderformindlogger.models.invitation import Invitation
+    from girderformindlogger.models.profile import Profile
+
+    monkeypatch.setattr(Profile, 'coordinatorProfile',
+                        lambda self, appletId, coordinator: {'displayName': 'Coordinator'})
+    applet, coordinator = {'_id': ObjectId()}, {'_id': ObjectId()}
+    user = {'_id': ObjectId()}
+    created = datetime.datetime(2021, 3, 1)
+    previous = database.invitation.insert_one({
+        'appletId': applet['_id'], 'userId': user['_id'], 'role': 'user',
+        'created': created}).inserted_id
+
+    def row(email, **kwargs):
+        return dict({
+            'role': 'user', 'firstName': 'First', 'lastName': 'Last', 'lang': 'en',
+            'userEmail': email, 'MRN': email}, **kwargs)
+
+    invitations = Invitation().createInvitationsForSpecifiedUsers(applet, coordinator, [
+        row('new@example.com'),
+        row('user@example.com', user=user),
+        row('reviewer@example.com', role='reviewer', accessibleUsers=[user['_id']])
+    ])
+    assert [invitation['userEmail'] for invitation in invitations] \
+        == ['new@example.com', 'user@example.com', 'reviewer@example.com']
+    assert invitations[1]['_id'] == previous and invitations[1]['created'] == created
+    assert invitations[0]['firstName'] == 'First'
+    assert invitations[2]['accessibleUsers'] == [user['_id']]
+    assert invitations[0]['accessibleUsers'] is None
+
+    assert database.invitation.count_documents({'appletId': applet['_id']}) == 3
+    stored = database.invitation.find_one({'_id': previous})
+    assert stored['userId'] == user['_id'] and stored['MRN'] == 'user@example.com'
+    assert stored['firstName'] != 'First'  # encrypted
+    assert Invitation().createInvitationsForSpecifiedUsers(applet, coordinator, []) == []
+
+
+def testFuseCachesPathsAndListings(tmp_path, monkeypatch, database):
+    import os
+    from bson.objectid import ObjectId
+    pytest.importorskip('fuse')
+    from girderformindlogger import events
+    from girderformindlogger.cli import mount
+
+    lookups = []
+    for name in ('lookUpPath', 'lookUpToken'):
+        def counted(*args, _lookUp=getattr(mount.path_util, name), _name=name, **kwargs):
+            lookups.append(_name)
+            return _lookUp(*args, **kwargs)
+        monkeypatch.setattr(mount.path_util, name, counted)
+
+    user = {'_id': ObjectId(), 'login': 'alice'}
+    folder = {'_id': ObjectId(), 'name': 'Public', 'parentId': user['_id'],
+              'parentCollection': 'user', 'baseParentType': 'user', 'baseParentId': user['_id']}
+    database.user.insert_one(user)
+    database.folder.insert_one(folder)
+    database.item.insert_one({'_id': ObjectId(), 'name': 'a', 'folderId': folder['_id']})
+
+    serverFuse = mount.ServerFuse(stat=os.stat(str(tmp_path)))
+    try:
+        assert serverFuse.readdir('/user', None) == ['.', '..', 'alice']
+        serverFuse.getattr('/user/alice')
+        serverFuse.getattr('/user/alice')
+        assert lookups == ['lookUpPath']
+        # the parent is cached, so only the last component is looked up
+        assert serverFuse.readdir('/user/alice/Public', None) == ['.', '..', 'a']
+        assert lookups == ['lookUpPath', 'lookUpToken']
+
+        item = {'_id': ObjectId(), 'name': 'b', 'folderId': folder['_id']}
+        database.item.insert_one(item)
+        assert serverFuse.readdir('/user/alice/Public', None) == ['.', '..', 'a']
+        events.trigger('model.item.save.after', item)
+        assert serverFuse.readdir('/user/alice/Public', None) == ['.', '..', 'a', 'b']
+        assert lookups == ['lookUpPath', 'lookUpToken']
+
+        # removing a folder drops it and its descendants
+        events.trigger('model.folder.remove', folder)
+        database.folder.delete_one({'_id': folder['_id']})
+        with pytest.raises(mount.fuse.FuseOSError):
+            serverFuse.getattr('/user/alice/Public/a')
+    finally:
+        for model in ('user', 'collection', 'folder', 'item', 'file'):
+            for event in ('save.after', 'remove'):
+                events.unbind('model.%s.%s' % (model, event), 'server_fuse')
+
+
+def testReplaceScheduleWritesOnlyChangedEvents(database, monkeypatch):
+    from bson.objectid import ObjectId
+    fakeredis = pytest.importorskip('fakeredis')
+    from girderformindlogger.models import events as events_module
+
+    connection = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(events_module, 'getRedisConnection', lambda: connection)
+    applet = {'_id': ObjectId()}
+    alice, bob = ObjectId(), ObjectId()
+    database.appletProfile.insert_many([
+        {'_id': alice, 'appletId': applet['_id'], 'individual_events': 0,
+         'finished_events': {}},
+        {'_id': bob, 'appletId': applet['_id'], 'individual_events': 0,
+         'finished_events': {}}
+    ])
+
+    def event(title, users=None, id=None):
+        event = {'data': {'title': title}, 'schedule': {'dayOfMonth': [1]}}
+        if users is not None:
+            event['data']['users'] = [str(user) for user in users]
+        if id is not None:
+            event['id'] = id
+        return event
+
+    Events = events_module.Events
+    schedule = [event('daily'), event('alice', [alice]), event('both', [alice, bob])]
+    assert len(Events().replaceSchedule(applet, schedule)) == 3
+    ids = [event['id'] for event in schedule]
+    assert database.events.count_documents({'applet_id': applet['_id']}) == 3
+
+    def individualEvents():
+        return {profile['_id']: profile['individual_events']
+                for profile in database.appletProfile.find()}
+
+    assert individualEvents() == {alice: 2, bob: 1}
+    updated = {event['_id']: event['updated'] for event in database.events.find()}
+
+    # unchanged events are not written, missing ones are deleted on rewrite
+    database.appletProfile.update_one(
+        {'_id': alice}, {'$set': {'finished_events.%s' % ids[2]: 'done'}})
+    changed = Events().replaceSchedule(applet, [
+        event('daily', id=ids[0]), event('bob only', [bob], id=ids[1])], rewrite=True)
+    assert sorted(event['_id'] for event in changed) == sorted(ids[1:])
+    assert database.events.find_one({'_id': ids[0]})['updated'] == updated[ids[0]]
+    assert database.events.find_one({'_id': ids[1]})['data']['users'] == [bob]
+    assert database.events.find_one({'_id': ids[2]}) is None
+    assert individualEvents() == {alice: 0, bob: 1}
+    assert database.appletProfile.find_one({'_id': alice})['finished_events'] == {}
+
+    assert Events().replaceSchedule(applet, [event('daily', id=ids[0])], deleted=[]) == []
+    assert Events().replaceSchedule(applet, [], deleted=[str(ids[1])])[0]['_id'] == ids[1]
+    assert individualEvents() == {alice: 0, bob: 0}
+
+
+def testRolesAreResolvedOncePerRequest(database, monkeypatch):
+    import cherrypy
+    from bson.objectid import ObjectId
+    from cherrypy import _cprequest, lib
+    from girderformindlogger.models.profile import Profile
+    from girderformindlogger.utility import role_resolver
+    from girderformindlogger.utility._cache import requestCache
+
+    appletId, user = ObjectId(), {'_id': ObjectId(), 'login': 'alice'}
+    database.user.insert_one(dict(user))
+    profileId = database.appletProfile.insert_one({
+        'appletId': appletId, 'userId': user['_id'], 'roles': ['user', 'coordinator']
+    }).inserted_id
+
+    queries = []
+    findOne = Profile.findOne
+
+    def countedFindOne(self, *args, **kwargs):
+        queries.append(args)
+        return findOne(self, *args, **kwargs)
+
+    monkeypatch.setattr(Profile, 'findOne', countedFindOne)
+    requestCache.configure(backend='cherrypy_request', replace_existing_backend=True)
+    cherrypy.serving.load(
+        _cprequest.Request(lib.httputil.Host('127.0.0.1', 80), lib.httputil.Host('127.0.0.1', 1)),
+        _cprequest.Response())
+    try:
+        assert role_resolver.getAppletRoles(appletId, user) == ('user', 'coordinator')
+        assert role_resolver.hasRole(appletId, user['_id'], 'coordinator')
+        assert not role_resolver.hasRole(str(appletId), str(profileId), 'manager')
+        assert len(queries) == 2  # the roles, and the user of the profile id
+
+        # the request sees the roles it has changed
+        Profile().update({'_id': profileId}, {'$set': {'roles': ['user']}})
+        assert not role_resolver.hasRole(appletId, user, 'coordinator')
+        assert len(queries) == 3
+    finally:
+        cherrypy.serving.clear()
+        requestCache.configure(backend='dogpile.cache.null', replace_existing_backend=True)
+
+    # nothing is cached outside of a request
+    role_resolver.getAppletRoles(appletId, user)
+    role_resolver.getAppletRoles(appletId, user)
+    assert len(queries) == 5